@@ -11,4 +11,7 @@ class AlbumManager(BaseManager):
             "anio_album": "INT", # Nota: Tu esquema usa 'anio_album', no 'anio_lanzamiento'
             "id_artista": "INT"
         }
-        super().__init__(db_manager, "album", columns, "id_album")
+        relations = {
+            "id_artista": ("artista", "nombre_artista", "nombre_artista")
+        }
+        super().__init__(db_manager, "album", columns, "id_album", relations=relations)
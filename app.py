@@ -1,19 +1,26 @@
+import os
 import streamlit as st
 import pandas as pd
-from datetime import datetime, date, time # Importar time explícitamente
+from datetime import datetime, date, timedelta
 
 # Importar tus clases de gestión
 from db_manager import DBManager
-from user_manager import UserManager
-from artist_manager import ArtistManager
-from album_manager import AlbumManager
-from song_manager import SongManager
-from playlist_manager import PlaylistManager
-from playlist_song_manager import PlaylistSongManager
-from reproduction_manager import ReproductionManager
-from report_generator import ReportGenerator
+from manager_factory import build_managers
+from report_generator import MAX_REPORT_ROWS
+import profiling
 
 # --- Configuración de la Aplicación ---
+# Límite por defecto de cada sentencia SQL para acotar la latencia de cola (0 = sin límite)
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("STREAMING_DB_STATEMENT_TIMEOUT_MS", "30000"))
+# Leer el esquema real al iniciar para ajustar columnas, claves y estrategias de consulta
+SCHEMA_INTROSPECTION = os.environ.get("STREAMING_SCHEMA_INTROSPECTION", "1") == "1"
+# Réplicas de solo lectura para navegación y reportes, separadas por comas ("host:puerto,host:puerto")
+DB_READ_REPLICAS = tuple(r.strip() for r in os.environ.get("STREAMING_DB_REPLICAS", "").split(",") if r.strip())
+# Feed de cambios por LISTEN/NOTIFY: instala triggers y refresca tablas y contadores sin re-consultar
+CHANGE_FEED = os.environ.get("STREAMING_CHANGE_FEED", "0") == "1"
+# Con el feed activo, cada cuántos segundos se re-ejecutan las vistas en vivo (leen de caché si no hay cambios)
+LIVE_REFRESH_S = float(os.environ.get("STREAMING_LIVE_REFRESH_S", "2")) if CHANGE_FEED else None
+
 st.set_page_config(layout="wide", page_title="Plataforma de Streaming")
 st.title("🎧 Plataforma de Streaming - Gestión de Datos")
 
@@ -31,9 +38,9 @@ if 'crud_form_data' not in st.session_state:
 if 'pagination_info' not in st.session_state:
     st.session_state.pagination_info = {}
 if 'filter_settings' not in st.session_state:
-    st.session_state.filter_settings = {}
-if 'last_op_type' not in st.session_state:
-    st.session_state.last_op_type = {} # Para rastrear el último tipo de operación por tabla
+    st.session_state.filter_settings = {} # Filtro en edición (barra de filtro)
+if 'applied_filter' not in st.session_state:
+    st.session_state.applied_filter = {} # Filtro aplicado: el único que lee la tabla
 if 'show_crud_fields' not in st.session_state:
     st.session_state.show_crud_fields = {} # Controla la visibilidad de los campos por tabla/operación
 
@@ -104,54 +111,62 @@ def render_crud_tab(manager, key_prefix):
     st.header(f"Gestión de {manager.table_name.capitalize()}")
 
     # Inicializar session_state para esta tabla específica si no existe
-    if manager.table_name not in st.session_state.crud_form_data:
-        st.session_state.crud_form_data[manager.table_name] = {col: "" for col in manager.columns}
-    if manager.table_name not in st.session_state.pagination_info:
-        st.session_state.pagination_info[manager.table_name] = {"offset": 0, "limit": 10, "current_page": 1, "total_records": 0}
-    if manager.table_name not in st.session_state.filter_settings:
-        st.session_state.filter_settings[manager.table_name] = {"column": "", "value": ""}
-    if manager.table_name not in st.session_state.last_op_type:
-        st.session_state.last_op_type[manager.table_name] = None # Para rastrear el último tipo de operación por tabla
-    if manager.table_name not in st.session_state.show_crud_fields:
-        st.session_state.show_crud_fields[manager.table_name] = False # Por defecto no mostrar campos
-
+    with profiling.phase("inicialización de session_state"):
+        if manager.table_name not in st.session_state.crud_form_data:
+            st.session_state.crud_form_data[manager.table_name] = {col: "" for col in manager.columns}
+        if manager.table_name not in st.session_state.pagination_info:
+            st.session_state.pagination_info[manager.table_name] = {"offset": 0, "limit": 10, "current_page": 1, "total_records": 0}
+        if manager.table_name not in st.session_state.filter_settings:
+            st.session_state.filter_settings[manager.table_name] = {"column": "", "value": "", "resolve_relations": False}
+        if manager.table_name not in st.session_state.applied_filter:
+            st.session_state.applied_filter[manager.table_name] = {"column": "", "value": "", "resolve_relations": False}
+        if manager.table_name not in st.session_state.show_crud_fields:
+            st.session_state.show_crud_fields[manager.table_name] = False # Por defecto no mostrar campos
+
+
+    _render_crud_form(manager, key_prefix)
+    st.subheader("Datos de la Tabla")
+    _render_crud_filter(manager, key_prefix)
+    _render_crud_table(manager, key_prefix)
 
+def _on_crud_op_change(manager, key_prefix):
+    """
+    Al cambiar de operación se limpia el formulario y se ajusta la visibilidad de los campos.
+    Como callback se aplica antes de cualquier rerun (completo o del fragmento), sin forzar otro.
+    """
+    selected_crud_op = st.session_state[f"{key_prefix}_crud_op_selector"]
+    st.session_state.crud_form_data[manager.table_name] = {col: "" for col in manager.columns} # Limpiar todo al cambiar de operación
+    # Crear muestra los campos inmediatamente; Actualizar los muestra tras cargar el registro
+    st.session_state.show_crud_fields[manager.table_name] = selected_crud_op == "➕ Crear"
+
+# Cada sección es un fragmento: sus interacciones solo re-ejecutan esa sección.
+# El formulario no consulta la tabla y la paginación no reconstruye el formulario;
+# las escrituras y los cambios de filtro re-ejecutan la app para refrescar la tabla.
+@st.fragment
+@profiling.profiled("formulario")
+def _render_crud_form(manager, key_prefix):
+    """Formulario CRUD (selección de operación y campos del registro)."""
     current_form_data = st.session_state.crud_form_data[manager.table_name]
-    current_pagination_info = st.session_state.pagination_info[manager.table_name]
-    current_filter_settings = st.session_state.filter_settings[manager.table_name]
 
     # --- Selección de Operación CRUD ---
     st.subheader("Selecciona una Operación")
     selected_crud_op = st.selectbox(
         "Operación:",
         ["", "➕ Crear", "✏️ Actualizar", "🗑️ Eliminar"], # Añadir una opción vacía inicial
-        key=f"{key_prefix}_crud_op_selector"
+        key=f"{key_prefix}_crud_op_selector",
+        on_change=_on_crud_op_change,
+        args=(manager, key_prefix)
     )
 
-    # Detectar cambio de operación para limpiar/resetear formulario y controlar visibilidad
-    if selected_crud_op != st.session_state.last_op_type[manager.table_name]:
-        st.session_state.crud_form_data[manager.table_name] = {col: "" for col in manager.columns} # Limpiar todo al cambiar de operación
-        st.session_state.last_op_type[manager.table_name] = selected_crud_op
-        
-        # Ocultar campos por defecto al cambiar de operación o si la operación es vacía
-        st.session_state.show_crud_fields[manager.table_name] = False 
-        
-        # Si se selecciona Crear, mostrar los campos inmediatamente
-        if selected_crud_op == "➕ Crear":
-            st.session_state.show_crud_fields[manager.table_name] = True
-        
-        # Re-run para aplicar los cambios de visibilidad y limpiar el formulario
-        st.rerun() 
-    
     # --- Campos de Entrada del Formulario (Condicionales) ---
     st.subheader("Datos del Registro")
 
-    # Si la operación es "Crear", mostrar todos los campos excepto el ID (que es SERIAL)
+    # Si la operación es "Crear", mostrar todos los campos excepto los generados (SERIAL)
     if selected_crud_op == "➕ Crear":
         cols_for_other_fields = st.columns(3) # Para organizar entradas en columnas
         col_idx = 0
         for col_name, col_type in manager.columns.items():
-            if col_name == manager.id_column: # El ID es SERIAL, no se inserta manualmente
+            if col_type == "SERIAL": # Generado por la BD, no se inserta manualmente
                 continue
 
             current_value = st.session_state.crud_form_data[manager.table_name].get(col_name, "")
@@ -207,27 +222,19 @@ def render_crud_tab(manager, key_prefix):
             if manager.create_record_logic(st.session_state.crud_form_data[manager.table_name]):
                 st.session_state.crud_form_data[manager.table_name] = {col: "" for col in manager.columns}
                 st.session_state.show_crud_fields[manager.table_name] = False # Ocultar campos después de crear
-                st.session_state.last_op_type[manager.table_name] = "" # Resetear selectbox
-                st.rerun()
+                st.rerun() # La escritura cambia la tabla: re-ejecutar también su fragmento
 
     # Si la operación es "Actualizar", primero pedir ID, luego mostrar todos los campos
     elif selected_crud_op == "✏️ Actualizar":
-        id_placeholder_value = str(current_form_data.get(manager.id_column, "")) if current_form_data.get(manager.id_column) else ""
-        id_input_value = st.text_input(
-            f"{manager.id_column.replace('_', ' ').title()} (ID del registro a actualizar):",
-            value=id_placeholder_value,
-            key=f"{key_prefix}_{manager.id_column}_input_update_id_only"
-        )
-        st.session_state.crud_form_data[manager.table_name][manager.id_column] = id_input_value # Actualizar Session State
+        record_key = _render_key_inputs(manager, key_prefix, current_form_data, "a actualizar", "update_id_only")
 
         # Botón para cargar el registro
         if st.button("⬇️ Cargar datos para actualizar", key=f"{key_prefix}_load_for_update_btn", use_container_width=True):
-            record_id_to_load = st.session_state.crud_form_data[manager.table_name].get(manager.id_column)
-            loaded_data = manager.load_selected_record_logic(record_id_to_load)
+            loaded_data = manager.load_selected_record_logic(record_key)
             if loaded_data:
                 st.session_state.crud_form_data[manager.table_name] = loaded_data
                 st.session_state.show_crud_fields[manager.table_name] = True # Mostrar campos después de cargar
-                st.rerun() # Forzar re-render para mostrar datos cargados y habilitar inputs
+                st.rerun(scope="fragment") # Re-render del formulario para mostrar datos cargados y habilitar inputs
             else:
                 st.session_state.show_crud_fields[manager.table_name] = False # Ocultar si no se pudo cargar
 
@@ -237,8 +244,8 @@ def render_crud_tab(manager, key_prefix):
             cols_for_other_fields = st.columns(3) # Para organizar entradas en columnas
             col_idx = 0
             for col_name, col_type in manager.columns.items():
-                if col_name == manager.id_column:
-                    continue # ID ya manejado y no se debe modificar
+                if col_name in manager.key_columns:
+                    continue # La clave ya se pidió arriba y no se debe modificar
 
                 current_value = st.session_state.crud_form_data[manager.table_name].get(col_name, "")
                 
@@ -292,32 +299,64 @@ def render_crud_tab(manager, key_prefix):
                 if manager.update_record_logic(st.session_state.crud_form_data[manager.table_name]):
                     st.session_state.crud_form_data[manager.table_name] = {col: "" for col in manager.columns}
                     st.session_state.show_crud_fields[manager.table_name] = False # Ocultar campos después de actualizar
-                    st.session_state.last_op_type[manager.table_name] = "" # Resetear selectbox
-                    st.rerun()
+                    st.rerun() # La escritura cambia la tabla: re-ejecutar también su fragmento
 
     # Si la operación es "Eliminar", solo pedir ID
     elif selected_crud_op == "🗑️ Eliminar":
-        id_placeholder_value = str(current_form_data.get(manager.id_column, "")) if current_form_data.get(manager.id_column) else ""
-        id_input_value = st.text_input(
-            f"{manager.id_column.replace('_', ' ').title()} (ID del registro a eliminar):",
-            value=id_placeholder_value,
-            key=f"{key_prefix}_{manager.id_column}_input_delete_only"
-        )
-        st.session_state.crud_form_data[manager.table_name][manager.id_column] = id_input_value # Actualizar Session State
+        record_key = _render_key_inputs(manager, key_prefix, current_form_data, "a eliminar", "delete_only")
         
         if st.button("🗑️ Eliminar Registro", key=f"{key_prefix}_delete_btn", use_container_width=True):
-            record_id_to_delete = st.session_state.crud_form_data[manager.table_name].get(manager.id_column)
-            if manager.delete_record_logic(record_id_to_delete):
+            if manager.delete_record_logic(record_key):
                 st.session_state.crud_form_data[manager.table_name] = {col: "" for col in manager.columns}
                 st.session_state.show_crud_fields[manager.table_name] = False # Ocultar campos después de eliminar
-                st.session_state.last_op_type[manager.table_name] = "" # Resetear selectbox
-                st.rerun()
+                st.rerun() # La escritura cambia la tabla: re-ejecutar también su fragmento
 
-    # --- Sección de Filtro y Paginación ---
-    st.subheader("Datos de la Tabla")
+def _render_key_inputs(manager, key_prefix, current_form_data, action, key_suffix):
+    """
+    Campos de la clave primaria del registro (uno por columna si la clave es compuesta).
+    :return: Diccionario {columna_clave: valor introducido}.
+    """
+    record_key = {}
+    key_cols = st.columns(len(manager.key_columns))
+    for i, col_name in enumerate(manager.key_columns):
+        record_key[col_name] = key_cols[i].text_input(
+            f"{col_name.replace('_', ' ').title()} (ID del registro {action}):",
+            value=str(current_form_data.get(col_name, "")) if current_form_data.get(col_name) else "",
+            key=f"{key_prefix}_{col_name}_input_{key_suffix}"
+        )
+        st.session_state.crud_form_data[manager.table_name][col_name] = record_key[col_name] # Actualizar Session State
+    return record_key
+
+@st.fragment
+@profiling.profiled("filtro")
+def _render_crud_filter(manager, key_prefix):
+    """
+    Barra de filtro: editarla no recarga la tabla hasta aplicar o limpiar el filtro. Lo editado
+    se guarda en filter_settings y solo Aplicar/Limpiar lo copian a applied_filter, que es lo
+    que lee la tabla (también en la paginación y en sus reruns periódicos).
+    """
+    current_pagination_info = st.session_state.pagination_info[manager.table_name]
+    current_filter_settings = st.session_state.filter_settings[manager.table_name]
+    applied_filter = st.session_state.applied_filter[manager.table_name]
+
+    # Resolver claves foráneas con JOINs (solo si la tabla declara relaciones)
+    if manager.relations:
+        resolve_relations = st.checkbox(
+            "Mostrar nombres relacionados",
+            value=current_filter_settings.get("resolve_relations", False),
+            key=f"{key_prefix}_resolve_relations"
+        )
+        if resolve_relations != current_filter_settings.get("resolve_relations", False):
+            st.session_state.filter_settings[manager.table_name]["resolve_relations"] = resolve_relations
+            applied_filter["resolve_relations"] = resolve_relations
+            st.rerun() # Cambian las columnas de la tabla
+    else:
+        resolve_relations = False
 
     filter_cols = st.columns([0.2, 0.4, 0.2, 0.2])
     filter_column_options = [""] + [col for col in manager.columns.keys() if col != manager.id_column]
+    if resolve_relations:
+        filter_column_options += list(manager.joined_columns().keys())
 
     selected_filter_column = filter_cols[0].selectbox(
         "Columna a Filtrar:",
@@ -331,71 +370,347 @@ def render_crud_tab(manager, key_prefix):
         key=f"{key_prefix}_filter_val"
     )
 
-    # Actualizar settings de filtro en session_state
+    # Actualizar el filtro en edición (la tabla no lo usa hasta aplicarlo)
     st.session_state.filter_settings[manager.table_name]["column"] = selected_filter_column
     st.session_state.filter_settings[manager.table_name]["value"] = filter_value
 
     if filter_cols[2].button("🔍 Aplicar Filtro", key=f"{key_prefix}_apply_filter_btn"):
+        applied_filter["column"] = selected_filter_column
+        applied_filter["value"] = filter_value
         current_pagination_info["offset"] = 0 # Reiniciar paginación al filtrar
         current_pagination_info["current_page"] = 1
-        st.rerun() # Rerender para aplicar el filtro
+        st.rerun() # Re-ejecutar la app para recargar la tabla con el filtro
 
     if filter_cols[3].button("🧹 Limpiar Filtro", key=f"{key_prefix}_clear_filter_btn"):
         st.session_state.filter_settings[manager.table_name]["column"] = ""
         st.session_state.filter_settings[manager.table_name]["value"] = ""
+        applied_filter["column"] = ""
+        applied_filter["value"] = ""
         current_pagination_info["offset"] = 0 # Reiniciar paginación al limpiar
         current_pagination_info["current_page"] = 1
-        st.rerun() # Rerender para limpiar el filtro
+        st.rerun() # Re-ejecutar la app para recargar la tabla sin filtro
+
+@st.fragment(run_every=LIVE_REFRESH_S)
+@profiling.profiled("tabla")
+def _render_crud_table(manager, key_prefix):
+    """
+    Tabla paginada: navegar entre páginas solo re-ejecuta este fragmento. Con el feed de cambios
+    se re-ejecuta también periódicamente; sin escrituras notificadas la página sale de caché.
+    """
+    current_pagination_info = st.session_state.pagination_info[manager.table_name]
+    applied_filter = st.session_state.applied_filter[manager.table_name]
 
     # Placeholders para la tabla y la paginación (se llenarán en load_data_logic)
     table_placeholder = st.empty()
     pagination_label_placeholder = st.empty()
     pagination_buttons_cols = st.columns([0.1, 0.1])
 
-    # Lógica de carga de datos (usando el filtro y paginación actuales)
+    # Botones de Paginación (se leen antes de cargar para consultar una sola vez por interacción)
+    page_change = 0
+    if pagination_buttons_cols[0].button("⬅️ Anterior", key=f"{key_prefix}_prev_page_btn"):
+        page_change = -1
+    if pagination_buttons_cols[1].button("Siguiente ➡️", key=f"{key_prefix}_next_page_btn"):
+        page_change = 1
+
+    # Lógica de carga de datos (usando el filtro aplicado y la paginación actual)
     manager.load_data_logic(
         table_placeholder,
         current_pagination_info,
         pagination_label_placeholder,
-        page_change=0, # No cambiar de página de inmediato
-        filter_column=current_filter_settings["column"],
-        filter_value=current_filter_settings["value"]
+        page_change=page_change,
+        filter_column=applied_filter["column"],
+        filter_value=applied_filter["value"],
+        resolve_relations=applied_filter.get("resolve_relations", False)
     )
 
-    # Botones de Paginación
-    if pagination_buttons_cols[0].button("⬅️ Anterior", key=f"{key_prefix}_prev_page_btn"):
-        manager.load_data_logic(
-            table_placeholder,
-            current_pagination_info,
-            pagination_label_placeholder,
-            page_change=-1,
-            filter_column=current_filter_settings["column"],
-            filter_value=current_filter_settings["value"]
-        )
-    if pagination_buttons_cols[1].button("Siguiente ➡️", key=f"{key_prefix}_next_page_btn"):
-        manager.load_data_logic(
-            table_placeholder,
-            current_pagination_info,
-            pagination_label_placeholder,
-            page_change=1,
-            filter_column=current_filter_settings["column"],
-            filter_value=current_filter_settings["value"]
-        )
+@st.fragment(run_every=LIVE_REFRESH_S)
+def render_live_plays(change_feed):
+    """Reproducciones del último minuto, contadas con las notificaciones (sin consultas)."""
+    st.metric("▶️ Reproducciones (último minuto)", change_feed.plays_last_minute())
+
+# --- Función Auxiliar para Renderizar la Pestaña de Reportes ---
+def render_reports_tab(report_generator, listening_analytics):
+    """
+    Renderiza la pestaña de reportes. Los resultados se cargan por bloques con un límite de filas.
+    """
+    st.header("Reportes")
+
+    with st.expander("🕒 Calcular sesiones de escucha"):
+        session_cols = st.columns(3)
+        start_date = session_cols[0].date_input("Desde:", value=date.today() - timedelta(days=7), key="sessions_start")
+        end_date = session_cols[1].date_input("Hasta (exclusive):", value=date.today() + timedelta(days=1), key="sessions_end")
+        gap_minutes = session_cols[2].number_input("Inactividad entre sesiones (min):", min_value=1, value=30, key="sessions_gap")
+        if st.button("Calcular Sesiones", key="compute_sessions_btn", use_container_width=True):
+            with st.spinner("Sesionizando reproducciones..."):
+                saved_days = listening_analytics.compute(start_date, end_date, timedelta(minutes=int(gap_minutes)))
+            if saved_days is not None:
+                st.success(f"Sesiones calculadas para {saved_days} días.")
+
+    with st.expander("📈 Estadísticas aproximadas (sketches)"):
+        sketch_cols = st.columns(2)
+        sketch_start = sketch_cols[0].date_input("Desde:", value=date.today() - timedelta(days=7), key="sketch_start")
+        sketch_end = sketch_cols[1].date_input("Hasta (exclusive):", value=date.today() + timedelta(days=1), key="sketch_end")
+        play_statistics = report_generator.play_statistics
+        if st.button("Reconstruir sketches del periodo", key="warm_up_sketches_btn", use_container_width=True):
+            with st.spinner("Procesando reproducciones..."):
+                processed = play_statistics.warm_up(sketch_start, sketch_end)
+            if processed is None:
+                st.error("No se pudieron leer todas las reproducciones; los sketches no se modificaron.")
+            else:
+                st.success(f"{processed} reproducciones procesadas.")
+        # Los sketches se pierden al limpiarse la caché de recursos: cargar los días que falten
+        if play_statistics.missing_days(sketch_start, sketch_end):
+            with st.spinner("Cargando los días del periodo que faltan en los sketches..."):
+                covered = play_statistics.ensure_window(sketch_start, sketch_end)
+            if not covered:
+                st.warning("Los sketches no cubren todo el periodo: los resultados pueden estar por debajo del real.")
+        window = play_statistics.covered_window()
+        if window:
+            st.caption(f"Días cargados desde la base de datos: {window[0]} a {window[1]} "
+                       f"(retención: {play_statistics.retention_days} días).")
+        report_generator.generate_top_songs_approx(sketch_start, sketch_end)
+
+        listener_cols = st.columns(2)
+        listener_dimension = listener_cols[0].selectbox("Oyentes únicos por:", ["cancion", "pais"], key="sketch_dimension")
+        listener_key = listener_cols[1].text_input("Id Cancion o País:", key="sketch_key")
+        if listener_key:
+            key = int(listener_key) if listener_dimension == "cancion" and listener_key.isdigit() else listener_key
+            estimate = report_generator.unique_listeners_approx(listener_dimension, key, sketch_start, sketch_end)
+            st.metric("Oyentes únicos (aprox.)", estimate if estimate is not None else "-")
+
+    reports = {
+        "Canciones más reproducidas por país": report_generator.generate_most_played_by_country,
+        "Artistas con más álbumes y canciones": report_generator.generate_artist_counts,
+        "Sesiones de escucha por día": report_generator.generate_daily_sessions
+    }
+    report_cols = st.columns([0.6, 0.4])
+    selected_report = report_cols[0].selectbox("Reporte:", list(reports.keys()), key="report_selector")
+    max_rows = report_cols[1].number_input(
+        "Máximo de filas a mostrar:",
+        min_value=100, max_value=MAX_REPORT_ROWS, value=min(report_generator.max_rows, MAX_REPORT_ROWS),
+        step=1000, key="report_max_rows"
+    )
+
+    parallel_workers = None
+    if selected_report == "Canciones más reproducidas por país":
+        parallel_cols = st.columns(3)
+        if parallel_cols[0].checkbox("Ejecución particionada en paralelo", key="report_parallel"):
+            parallel_workers = int(parallel_cols[1].number_input(
+                "Workers:", min_value=2, max_value=16, value=4, key="report_parallel_workers"
+            ))
+        if parallel_cols[2].button("Verificar paralelismo", key="explain_parallel_btn", use_container_width=True):
+            plan = report_generator.explain_parallelism()
+            if plan is None:
+                st.error("No se pudo obtener el plan de ejecución.")
+            elif plan["parallel"]:
+                st.success(f"PostgreSQL planifica {plan['workers_planned']} workers paralelos "
+                           f"(max_parallel_workers_per_gather = {plan['max_parallel_workers_per_gather']}).")
+            else:
+                st.warning("El plan no es paralelo "
+                           f"(max_parallel_workers_per_gather = {plan['max_parallel_workers_per_gather']}). "
+                           "Use la ejecución particionada o ajuste la configuración del servidor.")
+
+    if st.button("📊 Generar Reporte", key="generate_report_btn", use_container_width=True):
+        if parallel_workers:
+            reports[selected_report](max_rows=int(max_rows), parallel_workers=parallel_workers)
+        else:
+            reports[selected_report](max_rows=int(max_rows))
+
+# --- Función Auxiliar para Renderizar la Pestaña de Recomendaciones ---
+def render_recommendations_tab(recommendation_engine):
+    """
+    Renderiza la pestaña de recomendaciones: reconstrucción del índice y consultas.
+    """
+    st.header("Recomendaciones")
+
+    st.subheader("Índice de Co-ocurrencia")
+    st.caption("Se construye a partir de las sesiones de escucha y las playlists. "
+               "Las reproducciones nuevas lo actualizan de forma incremental.")
+    if st.button("🔄 Reconstruir Índice", key="rebuild_recommendations_btn", use_container_width=True):
+        with st.spinner("Construyendo la matriz de co-ocurrencia..."):
+            indexed_songs = recommendation_engine.build()
+        if indexed_songs is not None:
+            st.success(f"Índice reconstruido: {indexed_songs} canciones con vecinos.")
+
+    rec_cols = st.columns(2)
+    with rec_cols[0]:
+        st.subheader("Canciones Similares")
+        song_id = st.number_input("Id Cancion:", min_value=1, value=None, format="%d", key="similar_song_id")
+        if song_id is not None:
+            similar = recommendation_engine.similar_songs(int(song_id))
+            if similar:
+                st.dataframe(pd.DataFrame(similar, columns=["Id Cancion", "Titulo Cancion", "Similitud"]),
+                             use_container_width=True, hide_index=True)
+            else:
+                st.info("No hay canciones similares para esta canción.")
+    with rec_cols[1]:
+        st.subheader("Recomendaciones por Usuario")
+        user_id = st.number_input("Id Usuario:", min_value=1, value=None, format="%d", key="recommend_user_id")
+        if user_id is not None:
+            recommended = recommendation_engine.recommend_for_user(int(user_id))
+            if recommended:
+                st.dataframe(pd.DataFrame(recommended, columns=["Id Cancion", "Titulo Cancion", "Puntuacion"]),
+                             use_container_width=True, hide_index=True)
+            else:
+                st.info("No hay recomendaciones para este usuario.")
+
+# --- Función Auxiliar para Renderizar la Pestaña de Detalle de Playlists ---
+def render_playlist_detail_tab(playlist_manager, playlist_song_manager, page_size=20):
+    """
+    Renderiza los resúmenes de playlists (canciones y duración ya calculadas) y las canciones
+    de una playlist en orden. Ambas listas se paginan por clave: cada página es una consulta por índice.
+    """
+    st.header("Detalle de Playlists")
+    playlist_song_manager.ensure_summary_schema()
+    if 'playlist_summary_cursors' not in st.session_state:
+        st.session_state.playlist_summary_cursors = [None] # Inicio de cada página visitada
+    if 'playlist_song_cursors' not in st.session_state:
+        st.session_state.playlist_song_cursors = [None]
+
+    if st.button("🔄 Recalcular Resúmenes", key="rebuild_playlist_summaries_btn"):
+        with st.spinner("Recalculando resúmenes..."):
+            if playlist_song_manager.rebuild_summaries():
+                st.success("Resúmenes recalculados.")
+
+    st.subheader("Resúmenes")
+    user_id = st.number_input("Id Usuario (opcional):", min_value=1, value=None, format="%d", key="playlist_summary_user")
+    if st.session_state.get("playlist_summary_user_last") != user_id:
+        st.session_state.playlist_summary_user_last = user_id
+        st.session_state.playlist_summary_cursors = [None]
+    cursors = st.session_state.playlist_summary_cursors
+    summaries = playlist_manager.playlist_summaries(
+        int(user_id) if user_id is not None else None, after_id=cursors[-1], limit=page_size
+    ) or []
+    if summaries:
+        st.dataframe(pd.DataFrame(
+            [(pid, name, songs, str(timedelta(seconds=int(seconds))), modified)
+             for pid, name, songs, seconds, modified in summaries],
+            columns=["Id Playlist", "Nombre", "Canciones", "Duracion Total", "Modificado"]
+        ), use_container_width=True, hide_index=True)
+    else:
+        st.info("No hay playlists para mostrar.")
+    summary_nav = st.columns([0.1, 0.1, 0.8])
+    if summary_nav[0].button("⬅️ Anterior", key="playlist_summary_prev", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if summary_nav[1].button("Siguiente ➡️", key="playlist_summary_next", disabled=len(summaries) < page_size):
+        cursors.append(summaries[-1][0])
+        st.rerun()
+
+    st.subheader("Canciones de la Playlist")
+    playlist_id = st.number_input("Id Playlist:", min_value=1, value=None, format="%d", key="playlist_detail_id")
+    if playlist_id is None:
+        return
+    if st.session_state.get("playlist_detail_last") != playlist_id:
+        st.session_state.playlist_detail_last = playlist_id
+        st.session_state.playlist_song_cursors = [None]
+    summary = playlist_manager.playlist_summary(int(playlist_id))
+    if not summary:
+        st.info(f"No existe la playlist {playlist_id}.")
+        return
+    name, songs, seconds, modified = summary
+    metric_cols = st.columns(3)
+    metric_cols[0].metric("Playlist", name)
+    metric_cols[1].metric("Canciones", songs)
+    metric_cols[2].metric("Duración Total", str(timedelta(seconds=int(seconds))))
+    if modified:
+        st.caption(f"Última modificación: {modified:%Y-%m-%d %H:%M:%S}")
+
+    song_cursors = st.session_state.playlist_song_cursors
+    rows = playlist_song_manager.playlist_songs(int(playlist_id), after=song_cursors[-1], limit=page_size) or []
+    if rows:
+        st.dataframe(pd.DataFrame(
+            [(orden, song_id, title, artist, str(duration) if duration else None)
+             for orden, song_id, title, artist, duration in rows],
+            columns=["Orden", "Id Cancion", "Titulo Cancion", "Artista", "Duracion"]
+        ), use_container_width=True, hide_index=True)
+    else:
+        st.info("La playlist no tiene canciones.")
+    song_nav = st.columns([0.1, 0.1, 0.8])
+    if song_nav[0].button("⬅️ Anterior", key="playlist_song_prev", disabled=len(song_cursors) == 1):
+        song_cursors.pop()
+        st.rerun()
+    if song_nav[1].button("Siguiente ➡️", key="playlist_song_next", disabled=len(rows) < page_size):
+        song_cursors.append((rows[-1][0], rows[-1][1]))
+        st.rerun()
+
+# --- Función Auxiliar para Renderizar la Pestaña de Índices ---
+def render_index_advisor_tab(index_advisor):
+    """
+    Renderiza la pestaña de administración de índices: análisis y aplicación de recomendaciones.
+    """
+    st.header("Índices")
+    st.caption("Basado en pg_stat_user_tables, pg_stat_user_indexes y, si está instalada, pg_stat_statements. "
+               "Los cambios se aplican con CONCURRENTLY para no bloquear las escrituras.")
+    if st.button("🔍 Analizar Índices", key="analyze_indexes_btn", use_container_width=True):
+        with st.spinner("Revisando el esquema y las estadísticas..."):
+            st.session_state.index_report = index_advisor.analyze()
+    report = st.session_state.get("index_report")
+    if not report:
+        return
+
+    st.subheader("Índices Recomendados")
+    if not report["missing"]:
+        st.success("No faltan índices para las claves foráneas ni las consultas conocidas.")
+    for i, rec in enumerate(report["missing"]):
+        rec_cols = st.columns([0.8, 0.2])
+        rec_cols[0].code(index_advisor.statement_text(rec), language="sql")
+        rec_cols[0].caption(f"{rec['reason']} · filas leídas secuencialmente: {rec['seq_tup_read']} "
+                            f"· sentencias registradas: {rec['statements']}")
+        if rec_cols[1].button("Crear", key=f"apply_index_{i}", use_container_width=True):
+            with st.spinner(f"Creando {rec['index_name']}..."):
+                result = index_advisor.apply(rec)
+            if result["ok"]:
+                st.success(f"Índice {rec['index_name']} creado.")
+            else:
+                st.error(f"No se pudo crear {rec['index_name']}: {result['error']}")
+            if result["dropped_invalid"]:
+                st.warning(f"Se eliminaron los índices inválidos que dejó la operación: {', '.join(result['dropped_invalid'])}")
+
+    for title, key in (("Índices sin Uso", "unused"), ("Índices Redundantes", "redundant"), ("Índices Inflados", "bloated")):
+        st.subheader(title)
+        if not report[key]:
+            st.info("Ninguno.")
+            continue
+        st.dataframe(pd.DataFrame(
+            [(rec["table"], rec["index_name"], rec["reason"], rec["bytes"], index_advisor.statement_text(rec))
+             for rec in report[key]],
+            columns=["Tabla", "Indice", "Motivo", "Bytes", "Sentencia"]
+        ), use_container_width=True, hide_index=True)
+
+    st.subheader("Actividad por Tabla")
+    st.dataframe(pd.DataFrame(
+        [(table_name, *stats.values()) for table_name, stats in report["activity"].items()],
+        columns=["Tabla", "Seq Scan", "Seq Tup Read", "Idx Scan", "Filas Vivas", "Filas Muertas"]
+    ), use_container_width=True, hide_index=True)
+    if report["statements"]:
+        st.subheader("Sentencias más Costosas")
+        st.dataframe(pd.DataFrame(report["statements"], columns=["Consulta", "Llamadas", "Media (ms)", "Total (ms)"]),
+                     use_container_width=True, hide_index=True)
 
 # --- Lógica Principal de la Aplicación ---
 if not st.session_state.db_connected:
     login_page() # Mostrar solo la página de login si no hay conexión
 else:
     # --- Una vez conectado, inicializar DBManager y los Managers ---
+    def release_db_and_managers(managers):
+        """
+        Llamada por Streamlit al expirar la entrada de la caché o al limpiarla (logout): detiene
+        el hilo de LISTEN del feed de cambios y cierra las conexiones del DBManager descartado.
+        """
+        managers["db_manager"].close()
+
     # @st.cache_resource asegura que esto se ejecute una sola vez por sesión
-    @st.cache_resource(ttl=3600)
+    @st.cache_resource(ttl=3600, on_release=release_db_and_managers)
     def get_db_and_managers(username, password):
         db_manager = DBManager(
             dbname="streaming_db",
             user=username,
             password=password,
             host="localhost",
-            port="5432"
+            port="5432",
+            statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS or None,
+            replicas=DB_READ_REPLICAS
         )
         # Intentar conectar de nuevo, por si se borró la caché o cambió el contexto
         if not db_manager.connection:
@@ -404,33 +719,17 @@ else:
                 st.session_state.db_connected = False
                 st.rerun() # Volver a la página de login
 
-        # Inicializar todos los managers con la instancia de db_manager
-        user_manager = UserManager(db_manager)
-        artist_manager = ArtistManager(db_manager)
-        album_manager = AlbumManager(db_manager)
-        song_manager = SongManager(db_manager)
-        playlist_manager = PlaylistManager(db_manager)
-        playlist_song_manager = PlaylistSongManager(db_manager)
-        reproduction_manager = ReproductionManager(db_manager)
-        report_generator = ReportGenerator(db_manager) # Se mantiene la instancia por si se quiere usar internamente
-
-        return {
-            "db_manager": db_manager,
-            "user_manager": user_manager,
-            "artist_manager": artist_manager,
-            "album_manager": album_manager,
-            "song_manager": song_manager,
-            "playlist_manager": playlist_manager,
-            "playlist_song_manager": playlist_song_manager,
-            "reproduction_manager": reproduction_manager,
-            "report_generator": report_generator
-        }
+        # Managers, listeners, introspección y feed de cambios (compartido con load_test.py)
+        return build_managers(db_manager, schema_introspection=SCHEMA_INTROSPECTION, change_feed=CHANGE_FEED)
 
     # Obtener las instancias de los managers (se cargarán de caché si ya están)
     managers = get_db_and_managers(st.session_state.db_username, st.session_state.db_password)
 
     # --- Navegación Principal (Sidebar) ---
     st.sidebar.title("Menú de Navegación")
+    if managers["change_feed"] is not None:
+        with st.sidebar:
+            render_live_plays(managers["change_feed"])
     tabs = {
         "👥 Usuarios": lambda: render_crud_tab(managers["user_manager"], "user"),
         "🎤 Artistas": lambda: render_crud_tab(managers["artist_manager"], "artist"),
@@ -438,7 +737,11 @@ else:
         "🎶 Canciones": lambda: render_crud_tab(managers["song_manager"], "song"),
         "📝 Playlists": lambda: render_crud_tab(managers["playlist_manager"], "playlist"),
         "🔗 Playlist-Canción": lambda: render_crud_tab(managers["playlist_song_manager"], "playlist_song"),
-        "▶️ Reproducciones": lambda: render_crud_tab(managers["reproduction_manager"], "reproduction")
+        "🎼 Detalle de Playlists": lambda: render_playlist_detail_tab(managers["playlist_manager"], managers["playlist_song_manager"]),
+        "▶️ Reproducciones": lambda: render_crud_tab(managers["reproduction_manager"], "reproduction"),
+        "📊 Reportes": lambda: render_reports_tab(managers["report_generator"], managers["listening_analytics"]),
+        "✨ Recomendaciones": lambda: render_recommendations_tab(managers["recommendation_engine"]),
+        "🗂️ Índices": lambda: render_index_advisor_tab(managers["index_advisor"])
     }
 
     selected_tab = st.sidebar.radio("Selecciona una pestaña:", list(tabs.keys()), key="sidebar_tab_selector")
@@ -448,6 +751,24 @@ else:
     if st.sidebar.button("🚪 Cerrar Sesión y Volver a Iniciar", key="logout_button", use_container_width=True):
         logout()
 
-    # Renderizar la pestaña seleccionada
-    tabs[selected_tab]()
+    # Perfilado del renderizado (siempre activo con STREAMING_PROFILING=1)
+    st.sidebar.markdown("---")
+    if profiling.PROFILING_ENV:
+        st.sidebar.caption("⏱️ Perfilado activado por STREAMING_PROFILING.")
+    else:
+        st.sidebar.checkbox("⏱️ Perfilar renderizado", key="profiling_enabled")
+    profiler = None
+    if profiling.is_enabled():
+        trace = st.sidebar.selectbox("Traza del rerun:", ["Sin traza", "cProfile", "pyinstrument"], key="profiling_trace")
+        profiler = None if trace == "Sin traza" else trace
+
+    # Renderizar la pestaña seleccionada (midiendo sus fases si el perfilado está activo)
+    profiling.start_run(selected_tab, profiler)
+    try:
+        tabs[selected_tab]()
+    finally:
+        profile_run = profiling.finish_run()
+    if profiling.is_enabled():
+        st.markdown("---")
+        profiling.render_waterfall(profile_run)
 
@@ -1,86 +1,285 @@
+import psycopg2
 from psycopg2 import sql
 import streamlit as st
 from datetime import datetime, date, time # Importar time explícitamente
+from time import monotonic
+
+from profiling import phase
+
+# Umbrales (filas estimadas) a partir de los cuales se cambia de estrategia tras la introspección
+ESTIMATED_COUNT_THRESHOLD = 1000000 # COUNT(*) sin filtro se sustituye por pg_class.reltuples
+KEYSET_PAGINATION_THRESHOLD = 100000 # OFFSET se sustituye por paginación por clave (keyset)
+# Resultados de lectura guardados por manager cuando hay feed de cambios
+QUERY_CACHE_ENTRIES = 256
 
 class BaseManager:
     """
     Clase base para gestionar operaciones CRUD y paginación
     en una tabla específica de la base de datos para Streamlit.
     """
-    def __init__(self, db_manager, table_name, columns, id_column):
+    def __init__(self, db_manager, table_name, columns, id_column, relations=None):
         self.db_manager = db_manager
         self.table_name = table_name
         self.columns = columns # Diccionario de columnas {nombre_columna: tipo_db}
         self.id_column = id_column
-
-    def load_data_logic(self, table_placeholder, pagination_info, page_label_placeholder, page_change=0, filter_column=None, filter_value=None):
+        # Relaciones declarativas de claves foráneas:
+        # {columna_fk: (tabla_referenciada, columna_a_mostrar, alias_en_resultado)}
+        # Se asume que la clave primaria de la tabla referenciada se llama igual que la columna FK.
+        self.relations = relations or {}
+        # Ajustables con apply_schema() a partir de los metadatos reales del esquema
+        self.key_columns = [id_column] # Clave primaria (puede ser compuesta); define el orden de paginación
+        self.schema_inspector = None
+        self.count_strategy = "exact" # "exact" o "estimate"
+        self.pagination_strategy = "offset" # "offset" o "keyset"
+        self._last_write_at = None # Momento de la última escritura (lectura de lo propio escrito)
+        # Bloqueo optimista: columna de versión entera (se incrementa en cada actualización)
+        # o None para usar la columna de sistema xmin, que PostgreSQL cambia en cada UPDATE
+        self.version_column = None
+        # Feed de cambios (ChangeFeed): si se asigna, conteos y páginas se reutilizan hasta que
+        # se notifique una escritura en la tabla o en las tablas de sus relaciones
+        self.change_feed = None
+        self._query_cache = {} # {(consulta, parámetros, fetch_type): (versión, resultado)}
+
+    def apply_schema(self, schema_inspector):
         """
-        Carga y muestra los datos de la tabla en un st.dataframe con paginación y filtro.
+        Ajusta el manager con los metadatos introspectados: columnas y tipos reales, clave primaria
+        (posiblemente compuesta) y estrategias de conteo y paginación según el tamaño
+        de la tabla y los índices existentes.
+        :return: True si la tabla existe en el esquema.
         """
-        new_offset = pagination_info["offset"] + page_change * pagination_info["limit"]
+        metadata = schema_inspector.table(self.table_name)
+        if not metadata:
+            st.warning(f"La tabla '{self.table_name}' no existe en el esquema; se usan las columnas declaradas.")
+            return False
 
+        self.schema_inspector = schema_inspector
+        self.columns = dict(metadata["columns"])
+        if metadata["primary_key"]:
+            self.key_columns = list(metadata["primary_key"])
+            if self.id_column not in self.key_columns:
+                self.id_column = self.key_columns[0]
+        # Descartar relaciones declaradas cuya columna ya no existe
+        self.relations = {fk: rel for fk, rel in self.relations.items() if fk in self.columns}
+
+        estimated_rows = metadata["estimated_rows"]
+        self.count_strategy = "estimate" if estimated_rows >= ESTIMATED_COUNT_THRESHOLD else "exact"
+
+        # Keyset solo si la clave es una única columna respaldada por un índice único
+        key_index = schema_inspector.leading_index(self.table_name, self.key_columns[0])
+        if (len(self.key_columns) == 1 and key_index and key_index["unique"]
+                and estimated_rows >= KEYSET_PAGINATION_THRESHOLD):
+            self.pagination_strategy = "keyset"
+        else:
+            self.pagination_strategy = "offset"
+        return True
+
+    def _read_route(self, *related_managers):
+        """
+        Destino de las lecturas: réplica, salvo justo después de escribir en esta tabla (o en la
+        de alguno de related_managers, si la lectura también depende de ellas), cuando la réplica
+        aún podría no tener el cambio (read-your-writes).
+        """
+        window = getattr(self.db_manager, "max_replica_lag_s", 0)
+        for manager in (self,) + related_managers:
+            if manager._last_write_at is not None and monotonic() - manager._last_write_at <= window:
+                return "primary"
+        return "replica"
+
+    def _mark_write(self):
+        """Registra una escritura para mantener las lecturas siguientes en el primario."""
+        self._last_write_at = monotonic()
+        self._query_cache.clear() # No esperar a la notificación para ver lo propio escrito
+
+    def _cached_query(self, query, params, fetch_type, resolve_relations, transform=None):
+        """
+        Ejecuta una lectura de esta tabla reutilizando el resultado anterior mientras la versión
+        de los datos no cambie. Sin feed de cambios siempre se consulta la BD.
+        :param transform: Función aplicada una vez al resultado nuevo antes de guardarlo.
+        """
+        if self.change_feed is None:
+            result = self.db_manager.execute_query(query, params, fetch_type=fetch_type, route=self._read_route())
+            return transform(result) if transform and result else result
+        tables = [self.table_name]
+        if resolve_relations:
+            tables += [ref_table for ref_table, _, _ in self.relations.values()]
+        version = self.change_feed.version(*tables)
+        key = (repr(query), tuple(params), fetch_type)
+        cached = self._query_cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        # Justo después de un cambio notificado la réplica podría no tenerlo todavía y sus filas
+        # quedarían en caché con la versión nueva: se relee del primario
+        route = self._read_route()
+        if self.change_feed.recently_changed(*tables, within_s=getattr(self.db_manager, "max_replica_lag_s", 0)):
+            route = "primary"
+        result = self.db_manager.execute_query(query, params, fetch_type=fetch_type, route=route)
+        if result is None:
+            return None # Error: no se guarda
+        if transform and result:
+            result = transform(result)
+        if len(self._query_cache) >= QUERY_CACHE_ENTRIES:
+            self._query_cache.pop(next(iter(self._query_cache)), None) # Descartar la entrada más antigua
+        self._query_cache[key] = (version, result)
+        return result
+
+    def joined_columns(self):
+        """
+        Devuelve las columnas resueltas por las relaciones {alias: (columna_fk, tabla, columna_a_mostrar)}.
+        """
+        return {
+            alias: (fk_column, ref_table, display_column)
+            for fk_column, (ref_table, display_column, alias) in self.relations.items()
+        }
+
+    def _column_type(self, column_name):
+        """Tipo de una columna propia o de una columna resuelta (siempre TEXT)."""
+        if column_name in self.columns:
+            return self.columns[column_name]
+        if column_name in self.joined_columns():
+            return "TEXT"
+        return None
+
+    def _column_ref(self, column_name):
+        """Identificador calificado de una columna propia ("t") o resuelta ("r_<columna_fk>")."""
+        joined = self.joined_columns()
+        if column_name in joined:
+            fk_column, _, display_column = joined[column_name]
+            return sql.Identifier(f"r_{fk_column}", display_column)
+        return sql.Identifier("t", column_name)
+
+    def _join_clause(self):
+        """LEFT JOINs hacia las tablas referenciadas por las relaciones declaradas."""
+        joins = [
+            sql.SQL(" LEFT JOIN {} AS {} ON {} = {}").format(
+                sql.Identifier(ref_table),
+                sql.Identifier(f"r_{fk_column}"),
+                sql.Identifier(f"r_{fk_column}", fk_column),
+                sql.Identifier("t", fk_column)
+            )
+            for fk_column, (ref_table, _, _) in self.relations.items()
+        ]
+        return sql.SQL("").join(joins)
+
+    def _build_filter_clause(self, filter_column, filter_value):
+        """
+        Construye la cláusula WHERE y sus parámetros para el filtro indicado.
+        :return: Tupla (where_clause, filter_params). Si el filtro es inválido se devuelve una cláusula vacía.
+        """
         where_clause = sql.SQL("")
         filter_params = []
 
-        if filter_column and filter_value:
-            col_type = self.columns.get(filter_column)
-            
-            # Lógica para filtrar múltiples IDs (ej. 1,2,3) o valores de texto/número
-            if col_type == "INT" and ',' in str(filter_value):
-                try:
-                    ids = [int(i.strip()) for i in filter_value.split(',') if i.strip().isdigit()]
-                    if ids:
-                        placeholders = sql.SQL(', ').join(sql.Placeholder() * len(ids))
-                        where_clause = sql.SQL(" WHERE {} IN ({})").format(sql.Identifier(filter_column), placeholders)
-                        filter_params = ids
-                    else:
-                        st.warning(f"Valores de ID inválidos en el filtro: '{filter_value}'. Se ignorará el filtro.")
-                        filter_column = None
-                except ValueError:
-                    st.error(f"Error al procesar múltiples IDs. Asegúrate de que sean números separados por comas.")
-                    filter_column = None
-            elif col_type == "TEXT":
-                where_clause = sql.SQL(" WHERE {} ILIKE %s").format(sql.Identifier(filter_column))
-                filter_params = [f"%{filter_value}%"]
-            else: # Para un solo INT, BOOLEAN, DATE, TIME, TIMESTAMP
-                where_clause = sql.SQL(" WHERE {} = %s").format(sql.Identifier(filter_column))
-                try:
-                    if col_type == "INT":
-                        filter_params = [int(filter_value)]
-                    elif col_type == "BOOLEAN":
-                        filter_params = [filter_value.lower() == 'true']
-                    elif col_type == "DATE":
-                        filter_params = [datetime.strptime(filter_value, "%Y-%m-%d").date()]
-                    elif col_type == "TIME":
-                        filter_params = [datetime.strptime(filter_value, "%H:%M:%S").time()]
-                    elif col_type == "TIMESTAMP":
-                        filter_params = [datetime.strptime(filter_value, "%Y-%m-%d %H:%M:%S")]
-                    else:
-                        filter_params = [filter_value]
-                except ValueError:
-                    st.error(f"Valor de filtro inválido para la columna '{filter_column.replace('_', ' ').title()}'. Asegúrate de que el tipo de dato sea correcto.")
-                    # No retornar, solo advertir y continuar sin aplicar este filtro inválido
-                    filter_column = None # Resetear el filtro para no fallar la consulta principal
+        if not (filter_column and filter_value):
+            return where_clause, filter_params
 
+        col_type = self._column_type(filter_column)
+        column_ref = self._column_ref(filter_column)
+
+        # Lógica para filtrar múltiples IDs (ej. 1,2,3) o valores de texto/número
+        if col_type == "INT" and ',' in str(filter_value):
+            try:
+                ids = [int(i.strip()) for i in filter_value.split(',') if i.strip().isdigit()]
+                if ids:
+                    placeholders = sql.SQL(', ').join(sql.Placeholder() * len(ids))
+                    where_clause = sql.SQL(" WHERE {} IN ({})").format(column_ref, placeholders)
+                    filter_params = ids
+                else:
+                    st.warning(f"Valores de ID inválidos en el filtro: '{filter_value}'. Se ignorará el filtro.")
+            except ValueError:
+                st.error(f"Error al procesar múltiples IDs. Asegúrate de que sean números separados por comas.")
+        elif col_type == "TEXT":
+            # Siempre "contiene" sin distinguir mayúsculas: los índices existentes no cambian qué filas
+            # devuelve el filtro (un índice GIN gin_trgm_ops sobre la columna lo acelera sin cambiarlo)
+            where_clause = sql.SQL(" WHERE {} ILIKE %s").format(column_ref)
+            filter_params = [f"%{filter_value}%"]
+        else: # Para un solo INT, BOOLEAN, DATE, TIME, TIMESTAMP
+            try:
+                if col_type == "INT":
+                    filter_params = [int(filter_value)]
+                elif col_type == "BOOLEAN":
+                    filter_params = [filter_value.lower() == 'true']
+                elif col_type == "DATE":
+                    filter_params = [datetime.strptime(filter_value, "%Y-%m-%d").date()]
+                elif col_type == "TIME":
+                    filter_params = [datetime.strptime(filter_value, "%H:%M:%S").time()]
+                elif col_type == "TIMESTAMP":
+                    filter_params = [datetime.strptime(filter_value, "%Y-%m-%d %H:%M:%S")]
+                else:
+                    filter_params = [filter_value]
+                where_clause = sql.SQL(" WHERE {} = %s").format(column_ref)
+            except ValueError:
+                st.error(f"Valor de filtro inválido para la columna '{filter_column.replace('_', ' ').title()}'. Asegúrate de que el tipo de dato sea correcto.")
+                # No retornar, solo advertir y continuar sin aplicar este filtro inválido
+                filter_params = []
+
+        return where_clause, filter_params
+
+    def _display_columns(self, resolve_relations):
+        """
+        Columnas del resultado en orden de visualización: cada nombre resuelto
+        se coloca justo después de su columna FK.
+        """
+        display_columns = []
+        for col_name in self.columns.keys():
+            display_columns.append(col_name)
+            if resolve_relations and col_name in self.relations:
+                display_columns.append(self.relations[col_name][2])
+        return display_columns
+
+    def load_data_logic(self, table_placeholder, pagination_info, page_label_placeholder, page_change=0, filter_column=None, filter_value=None, resolve_relations=False):
+        """
+        Carga y muestra los datos de la tabla en un st.dataframe con paginación y filtro.
+        Si resolve_relations es True y la tabla declara relaciones, los nombres referenciados
+        se resuelven con LEFT JOINs en la misma consulta paginada (una sola consulta por página).
+        """
+        resolve_relations = resolve_relations and bool(self.relations)
+        new_offset = pagination_info["offset"] + page_change * pagination_info["limit"]
+
+        if filter_column and not resolve_relations and filter_column not in self.columns:
+            filter_column = None # Filtro sobre una columna resuelta sin JOIN: se ignora
+        where_clause, filter_params = self._build_filter_clause(filter_column, filter_value)
+
+        # Los LEFT JOIN hacia claves primarias no cambian el número de filas: solo se necesitan
+        # en el conteo cuando el filtro se aplica sobre una columna resuelta.
+        filter_needs_join = bool(filter_params) and filter_column in self.joined_columns()
+        join_clause = self._join_clause() if resolve_relations else sql.SQL("")
 
         # Volver a calcular total_records con el filtro aplicado
-        count_query_template = sql.SQL("SELECT COUNT(*) FROM {} {}").format(
-            sql.Identifier(self.table_name),
-            where_clause
-        )
-        total_records_result = self.db_manager.execute_query(count_query_template, filter_params, fetch_type='one')
-        if total_records_result:
-            pagination_info["total_records"] = total_records_result[0]
+        estimated_total = None
+        if self.count_strategy == "estimate" and not filter_params:
+            # Tabla grande sin filtro: la estimación del catálogo evita recorrerla completa
+            estimated_total = self.schema_inspector.estimated_rows(self.table_name)
+        pagination_info["total_is_estimate"] = estimated_total is not None
+        if estimated_total is not None:
+            pagination_info["total_records"] = estimated_total
         else:
-            pagination_info["total_records"] = 0
+            count_query_template = sql.SQL("SELECT COUNT(*) FROM {} AS t{}{}").format(
+                sql.Identifier(self.table_name),
+                join_clause if filter_needs_join else sql.SQL(""),
+                where_clause
+            )
+            with phase("consulta de conteo"):
+                total_records_result = self._cached_query(count_query_template, filter_params, 'one', filter_needs_join)
+            if total_records_result:
+                pagination_info["total_records"] = total_records_result[0]
+            else:
+                pagination_info["total_records"] = 0
 
 
         max_offset = max(0, pagination_info["total_records"] - pagination_info["limit"])
         new_offset = max(0, min(new_offset, max_offset))
 
         if page_change != 0 and new_offset == pagination_info["offset"] and pagination_info["total_records"] > 0:
+            # Se vuelve a mostrar la página actual: en un rerun del fragmento la tabla se redibuja desde cero
             st.info("Ya estás en la primera/última página.")
-            return
+            page_change = 0
+
+        # Paginación por clave: solo si la página anterior se cargó con el mismo filtro
+        filter_signature = (filter_column, filter_value) if filter_params else None
+        use_keyset = (
+            self.pagination_strategy == "keyset" and new_offset > 0
+            and pagination_info.get("keyset_signature", False) == filter_signature
+            and pagination_info.get("first_key") is not None
+        )
 
         pagination_info["offset"] = new_offset
         pagination_info["current_page"] = (pagination_info["offset"] // pagination_info["limit"]) + 1
@@ -88,33 +287,75 @@ class BaseManager:
         # Actualizar el placeholder de la etiqueta de página
         with page_label_placeholder:
             total_pages = (pagination_info['total_records'] + pagination_info['limit'] - 1) // pagination_info['limit']
-            st.write(f"Página {pagination_info['current_page']} de {total_pages if total_pages > 0 else 1}")
+            approx = "~" if pagination_info["total_is_estimate"] else ""
+            st.write(f"Página {pagination_info['current_page']} de {approx}{total_pages if total_pages > 0 else 1}")
 
-        # Definir main_query_template SIEMPRE antes de su uso
-        main_query_template = sql.SQL("SELECT {} FROM {} {} ORDER BY {} LIMIT %s OFFSET %s").format(
-            sql.SQL(',').join(map(sql.Identifier, self.columns.keys())),
-            sql.Identifier(self.table_name),
-            where_clause,
-            sql.Identifier(self.id_column)
+        display_columns = self._display_columns(resolve_relations)
+        select_list = sql.SQL(',').join(
+            sql.SQL("{} AS {}").format(self._column_ref(col_name), sql.Identifier(col_name))
+            for col_name in display_columns
         )
-        query_params = filter_params + [pagination_info["limit"], pagination_info["offset"]]
-        data = self.db_manager.execute_query(main_query_template, tuple(query_params), fetch_type='all')
+
+        order_by = sql.SQL(', ').join(sql.Identifier("t", col) for col in self.key_columns)
+
+        # Definir main_query_template SIEMPRE antes de su uso
+        if use_keyset:
+            key_ref = sql.Identifier("t", self.key_columns[0])
+            if page_change > 0:
+                key_condition, key_value, direction = ">", pagination_info["last_key"], "ASC"
+            elif page_change < 0:
+                key_condition, key_value, direction = "<", pagination_info["first_key"], "DESC"
+            else:
+                key_condition, key_value, direction = ">=", pagination_info["first_key"], "ASC"
+            main_query_template = sql.SQL("SELECT {} FROM {} AS t{}{}{} {} {} %s ORDER BY {} {} LIMIT %s").format(
+                select_list,
+                sql.Identifier(self.table_name),
+                join_clause,
+                where_clause,
+                sql.SQL(" AND" if filter_params else " WHERE"),
+                key_ref,
+                sql.SQL(key_condition),
+                key_ref,
+                sql.SQL(direction)
+            )
+            query_params = filter_params + [key_value, pagination_info["limit"]]
+        else:
+            main_query_template = sql.SQL("SELECT {} FROM {} AS t{}{} ORDER BY {} LIMIT %s OFFSET %s").format(
+                select_list,
+                sql.Identifier(self.table_name),
+                join_clause,
+                where_clause,
+                order_by
+            )
+            query_params = filter_params + [pagination_info["limit"], pagination_info["offset"]]
+        # Si se leyó en orden descendente se invierte (una sola vez, antes de guardarlo en caché)
+        reverse = (lambda result: result.reverse() or result) if use_keyset and page_change < 0 else None
+        with phase("consulta de página"):
+            data = self._cached_query(main_query_template, tuple(query_params), 'columnar', resolve_relations, reverse)
+        if data and self.pagination_strategy == "keyset":
+            pagination_info["first_key"] = data.value(self.key_columns[0], 0)
+            pagination_info["last_key"] = data.value(self.key_columns[0], -1)
+            pagination_info["keyset_signature"] = filter_signature
 
         import pandas as pd
         if data:
-            df = pd.DataFrame(data, columns=self.columns.keys())
-            # Formatear fechas/tiempos en el DataFrame para una mejor visualización
-            for col_name, col_type in self.columns.items():
-                if col_type == "DATE" and col_name in df.columns:
-                    df[col_name] = df[col_name].apply(lambda x: x.strftime("%Y-%m-%d") if isinstance(x, (datetime, date)) else None)
-                elif col_type == "TIME" and col_name in df.columns:
-                    df[col_name] = df[col_name].apply(lambda x: str(x) if isinstance(x, time) else None)
-                elif col_type == "TIMESTAMP" and col_name in df.columns:
-                    df[col_name] = df[col_name].apply(lambda x: x.strftime("%Y-%m-%d %H:%M:%S") if isinstance(x, datetime) else None)
-                elif col_type == "BOOLEAN" and col_name in df.columns:
-                     df[col_name] = df[col_name].apply(lambda x: 'True' if x else ('False' if x is False else None))
+            with phase("DataFrame y formato"):
+                df = data.to_dataframe(display_columns)
+                # Formatear fechas/tiempos en el DataFrame para una mejor visualización (por columna, no por celda)
+                for col_name, col_type in self.columns.items():
+                    if col_name not in df.columns:
+                        continue
+                    column = df[col_name]
+                    if col_type in ("DATE", "TIMESTAMP") and pd.api.types.is_datetime64_any_dtype(column):
+                        df[col_name] = column.dt.strftime("%Y-%m-%d" if col_type == "DATE" else "%Y-%m-%d %H:%M:%S")
+                    elif col_type == "TIMESTAMP": # timestamptz llega sin convertir
+                        df[col_name] = column.apply(lambda x: x.strftime("%Y-%m-%d %H:%M:%S") if isinstance(x, datetime) else None)
+                    elif col_type == "TIME":
+                        df[col_name] = column.astype("string")
+                    elif col_type == "BOOLEAN":
+                        df[col_name] = column.astype("boolean").astype("string")
 
-            with table_placeholder: # Usar el placeholder para actualizar
+            with phase("st.dataframe"), table_placeholder: # Usar el placeholder para actualizar
                 st.dataframe(df, use_container_width=True, hide_index=True)
         else:
             with table_placeholder: # Usar el placeholder para actualizar
@@ -126,15 +367,16 @@ class BaseManager:
                 st.write(f"Página 0 de 0")
 
 
-    def create_record_logic(self, form_data):
+    def create_record_logic(self, form_data, transaction=None):
         """
         Crea un nuevo registro en la tabla.
         :param form_data: Diccionario de valores de entrada desde el formulario de Streamlit.
+        :param transaction: Transacción de DBManager.transaction() en la que ejecutar la escritura (opcional).
         """
         values = []
         col_names = []
         for col_name, col_type in self.columns.items():
-            if col_name == self.id_column: # El ID es SERIAL, no se inserta manualmente
+            if col_type == "SERIAL": # Generado por la BD, no se inserta manualmente
                 continue
 
             value = form_data.get(col_name)
@@ -177,36 +419,108 @@ class BaseManager:
             sql.Identifier(self.id_column)
         )
         
-        new_id = self.db_manager.execute_query(insert_query, tuple(values), fetch_type='one')
+        executor = transaction or self.db_manager
+        new_id = executor.execute_query(insert_query, tuple(values), fetch_type='one')
         if new_id:
-            st.success(f"Registro de {self.table_name} creado con ID: {new_id[0]}")
+            self._mark_write()
+            self._after_create(new_id[0], dict(zip(col_names, values)), transaction)
+            if transaction is None: # Dentro de una transacción informa quien la abrió
+                st.success(f"Registro de {self.table_name} creado con ID: {new_id[0]}")
             return True
         return False
 
-    def load_selected_record_logic(self, selected_id_str):
+    def _after_create(self, record_id, record, transaction):
+        """
+        Punto de extensión llamado tras insertar un registro.
+        :param record_id: Valor de id_column del registro insertado (RETURNING).
+        :param record: Diccionario {columna: valor convertido} de lo insertado.
+        :param transaction: Transacción en curso o None.
+        """
+        pass
+
+    def create_many_records_logic(self, form_data_list, transaction=None):
+        """
+        Crea varios registros en una sola transacción: o se insertan todos o ninguno.
+        :param form_data_list: Lista de diccionarios con los valores de cada registro.
+        :param transaction: Transacción externa en la que participar (opcional).
+        :return: Número de registros creados (0 si la operación se revirtió).
+        """
+        if not form_data_list:
+            st.warning("No hay datos válidos para crear los registros.")
+            return 0
+        try:
+            with (transaction.savepoint() if transaction else self.db_manager.transaction()) as tx:
+                for form_data in form_data_list:
+                    if not self.create_record_logic(form_data, transaction=tx):
+                        raise ValueError("Registro inválido en el lote.")
+        except (ValueError, psycopg2.Error):
+            st.error(f"No se creó ningún registro de {self.table_name}: la operación se revirtió.")
+            return 0
+        if transaction is None:
+            st.success(f"{len(form_data_list)} registros de {self.table_name} creados correctamente.")
+        return len(form_data_list)
+
+    def _parse_key(self, record_key):
+        """
+        Valores de la clave primaria (en el orden de key_columns) de un registro.
+        :param record_key: ID como string del input (clave simple) o diccionario
+                           {columna_clave: valor} (necesario si la clave es compuesta).
+        :return: Lista de valores o None si falta alguno o no es válido (el error ya se mostró).
+        """
+        if not isinstance(record_key, dict):
+            record_key = {self.id_column: record_key}
+        key_values = []
+        for col_name in self.key_columns:
+            value = record_key.get(col_name)
+            if value is None or str(value).strip() == "":
+                st.warning(f"Por favor, introduce {col_name.replace('_', ' ').title()} del registro.")
+                return None
+            if self.columns.get(col_name) in ("INT", "SERIAL"):
+                try:
+                    value = int(value)
+                except ValueError:
+                    st.error(f"{col_name.replace('_', ' ').title()} debe ser un número entero.")
+                    return None
+            key_values.append(value)
+        return key_values
+
+    def _key_clause(self):
+        """Condición sobre todas las columnas de la clave primaria (un parámetro por columna)."""
+        return sql.SQL(" AND ").join(
+            sql.SQL("{} = %s").format(sql.Identifier(col_name)) for col_name in self.key_columns
+        )
+
+    def _describe_key(self, key_values):
+        """Texto de la clave de un registro para los mensajes ("5" o "id_playlist=1, id_cancion=7")."""
+        if len(key_values) == 1:
+            return str(key_values[0])
+        return ", ".join(f"{col_name}={value}" for col_name, value in zip(self.key_columns, key_values))
+
+    def load_selected_record_logic(self, record_key):
         """
         Carga el registro seleccionado en los campos del formulario.
-        :param selected_id_str: ID del registro a cargar (como string del input).
+        :param record_key: ID del registro (como string del input) o diccionario con todas las
+                           columnas de la clave primaria si es compuesta.
         :return: Diccionario con los valores del registro o None.
         """
-        if not selected_id_str:
-            st.warning("Por favor, introduce el ID del registro para cargar.")
-            return None
-        try:
-            selected_id = int(selected_id_str)
-        except ValueError:
-            st.error("El ID debe ser un número entero.")
+        key_values = self._parse_key(record_key)
+        if key_values is None:
             return None
 
-        query = sql.SQL("SELECT {} FROM {} WHERE {} = %s").format(
+        # Se lee la versión de la fila junto con los valores; el primario garantiza que sea la vigente
+        query = sql.SQL("SELECT {}, {}::text FROM {} WHERE {}").format(
             sql.SQL(',').join(map(sql.Identifier, self.columns.keys())),
+            sql.Identifier(self.version_column or "xmin"),
             sql.Identifier(self.table_name),
-            sql.Identifier(self.id_column)
+            self._key_clause()
         )
-        record = self.db_manager.execute_query(query, (selected_id,), fetch_type='one')
+        record = self.db_manager.execute_query(query, tuple(key_values), fetch_type='one')
 
         if record:
             record_dict = {}
+            # Valores tal como están en la BD, para enviar solo lo modificado al actualizar
+            record_dict["_original"] = dict(zip(self.columns.keys(), record))
+            record_dict["_version"] = record[-1]
             for i, col_name in enumerate(self.columns.keys()):
                 value = record[i]
                 # Convertir valores de la BD a un formato adecuado para los widgets de Streamlit
@@ -220,35 +534,44 @@ class BaseManager:
                     record_dict[col_name] = value # st.checkbox maneja bool directamente
                 else:
                     record_dict[col_name] = value
-            record_dict[self.id_column] = selected_id_str # Asegurar que el ID se mantenga en el formulario
+            for col_name, value in zip(self.key_columns, key_values):
+                record_dict[col_name] = str(value) # Asegurar que la clave se mantenga en el formulario
             return record_dict
         else:
-            st.error(f"No se encontró ningún registro con ID: {selected_id}")
+            st.error(f"No se encontró ningún registro con ID: {self._describe_key(key_values)}")
             return None
 
 
-    def update_record_logic(self, form_data):
+    @staticmethod
+    def _same_value(new_value, original_value):
+        """Compara un valor del formulario con el de la BD (p. ej. '3.50' y Decimal('3.50'))."""
+        if new_value == original_value:
+            return True
+        return new_value is not None and original_value is not None and str(new_value) == str(original_value)
+
+    def update_record_logic(self, form_data, transaction=None, check_version=True):
         """
         Actualiza un registro existente en la tabla.
+        Si form_data viene de load_selected_record_logic solo se envían las columnas modificadas,
+        y con check_version se rechaza la escritura si otra sesión cambió la fila desde que se cargó.
         :param form_data: Diccionario de valores de entrada desde el formulario de Streamlit.
+        :param transaction: Transacción de DBManager.transaction() en la que ejecutar la escritura (opcional).
+        :param check_version: Verificar la versión leída al cargar (bloqueo optimista).
         """
-        id_value_str = form_data.get(self.id_column)
-        if not id_value_str:
-            st.error(f"Por favor, introduce el ID del {self.table_name} a actualizar.")
-            return False
-
-        try:
-            id_value = int(id_value_str)
-        except ValueError:
-            st.error("El ID debe ser un número entero.")
+        key_values = self._parse_key({col_name: form_data.get(col_name) for col_name in self.key_columns})
+        if key_values is None:
             return False
 
         set_clauses = []
         params = []
+        original = form_data.get("_original")
+        expected_version = form_data.get("_version") if check_version else None
+        if original is not None and [original.get(col_name) for col_name in self.key_columns] != key_values:
+            original = expected_version = None # La clave se cambió después de cargar: no hay valores previos
         
         for col_name, col_type in self.columns.items():
-            if col_name == self.id_column:
-                continue
+            if col_name in self.key_columns or col_name == self.version_column:
+                continue # La clave identifica la fila y no se modifica
 
             value = form_data.get(col_name) # Obtener el valor del formulario
 
@@ -266,7 +589,10 @@ class BaseManager:
                     params.append(datetime.strptime(value, '%Y-%m-%d %H:%M:%S') if value else None)
                 else: # TEXT
                     params.append(value if value is not None and value != '' else None)
-                
+
+                if original is not None and col_name in original and self._same_value(params[-1], original[col_name]):
+                    params.pop() # Sin cambios: no reescribir la columna (ni sus índices)
+                    continue
                 set_clauses.append(sql.SQL("{} = %s").format(sql.Identifier(col_name)))
             except ValueError:
                 st.error(f"Error en el formato del campo '{col_name.replace('_', ' ').title()}'.")
@@ -277,41 +603,64 @@ class BaseManager:
 
 
         if not set_clauses:
+            if original is not None:
+                st.info("No hay cambios que guardar.")
+                return True
             st.info("No hay campos para actualizar.")
             return False
 
-        params.append(id_value) # El ID va al final para la cláusula WHERE
-
-        update_query = sql.SQL("UPDATE {} SET {} WHERE {} = %s").format(
+        if self.version_column:
+            set_clauses.append(sql.SQL("{0} = {0} + 1").format(sql.Identifier(self.version_column)))
+        params.extend(key_values) # La clave va al final para la cláusula WHERE
+        where_clause = self._key_clause()
+        if expected_version is not None:
+            where_clause = sql.SQL("{} AND {}::text = %s").format(
+                where_clause, sql.Identifier(self.version_column or "xmin")
+            )
+            params.append(expected_version)
+
+        update_query = sql.SQL("UPDATE {} SET {} WHERE {} RETURNING {}").format(
             sql.Identifier(self.table_name),
             sql.SQL(', ').join(set_clauses),
+            where_clause,
             sql.Identifier(self.id_column)
         )
-        self.db_manager.execute_query(update_query, tuple(params))
-        st.success(f"Registro de {self.table_name} actualizado correctamente.")
+        executor = transaction or self.db_manager
+        updated = executor.execute_query(update_query, tuple(params), fetch_type='all')
+        if updated is None:
+            return False # El error ya se mostró
+        if not updated:
+            if expected_version is not None:
+                st.error(f"El registro {self._describe_key(key_values)} de {self.table_name} fue modificado o eliminado por otra sesión "
+                         "desde que se cargó. Vuelve a cargarlo antes de guardar los cambios.")
+            else:
+                st.error(f"No se encontró ningún registro con ID: {self._describe_key(key_values)}")
+            return False
+        self._mark_write()
+        if transaction is None:
+            st.success(f"Registro de {self.table_name} actualizado correctamente.")
         return True
 
 
-    def delete_record_logic(self, id_value_str):
+    def delete_record_logic(self, record_key, transaction=None):
         """
         Elimina un registro de la tabla especificada.
-        :param id_value_str: ID del registro a eliminar (como string del input).
+        :param record_key: ID del registro a eliminar (como string del input) o diccionario con
+                           todas las columnas de la clave primaria si es compuesta.
+        :param transaction: Transacción de DBManager.transaction() en la que ejecutar la escritura (opcional).
         """
-        if not id_value_str:
-            st.error(f"Por favor, introduce el ID del {self.table_name} a eliminar.")
+        key_values = self._parse_key(record_key)
+        if key_values is None:
             return False
 
-        try:
-            id_value = int(id_value_str)
-        except ValueError:
-            st.error("El ID debe ser un número entero.")
-            return False
-
-        delete_query = sql.SQL("DELETE FROM {} WHERE {} = %s").format(
+        delete_query = sql.SQL("DELETE FROM {} WHERE {}").format(
             sql.Identifier(self.table_name),
-            sql.Identifier(self.id_column)
+            self._key_clause()
         )
-        self.db_manager.execute_query(delete_query, (id_value,))
-        st.success(f"Registro de {self.table_name} eliminado correctamente.")
+        executor = transaction or self.db_manager
+        executor.execute_query(delete_query, tuple(key_values))
+        self._mark_write()
+        if transaction is None:
+            st.success(f"Registro de {self.table_name} eliminado correctamente.")
         return True
 
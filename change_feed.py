@@ -0,0 +1,151 @@
+import json
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import streamlit as st
+from psycopg2 import sql
+
+CHANNEL = "cambios_streaming"
+
+# Número de versión de cada notificación: además hace distintas las notificaciones de una
+# misma transacción, que PostgreSQL entregaría una sola vez si fueran idénticas
+VERSION_SEQUENCE = "CREATE SEQUENCE IF NOT EXISTS notificar_cambio_version"
+
+# Función de trigger: notifica tabla, operación, nivel (STATEMENT o ROW; a nivel de fila solo
+# INSERT en reproduccion, para contar reproducciones por evento) y el número de versión.
+# No se envía la fila: serializarla en cada inserción encarece el camino más caliente y
+# podría superar el límite de 8000 bytes de NOTIFY.
+TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION notificar_cambio() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(TG_ARGV[0], json_build_object(
+        'tabla', TG_TABLE_NAME, 'op', TG_OP, 'nivel', TG_LEVEL,
+        'version', nextval('notificar_cambio_version')
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+# Tabla cuyas inserciones se notifican fila a fila
+PLAYS_TABLE = "reproduccion"
+
+class ChangeFeed:
+    """
+    Clase para recibir los cambios de la base de datos por LISTEN/NOTIFY (triggers en cada tabla)
+    y exponerlos a las sesiones sin consultas: un contador de versión por tabla para invalidar
+    cachés de páginas y reportes, y las reproducciones del último minuto.
+    """
+    def __init__(self, db_manager, channel=CHANNEL, window_s=60):
+        self.db_manager = db_manager
+        self.channel = channel
+        self.window_s = window_s
+        self.versions = {} # {tabla: número de notificaciones recibidas}
+        self._total_version = 0
+        self._epoch = 0 # Aumenta cuando pudieron perderse notificaciones (reconexión)
+        self._recent_plays = deque() # Instantes (monotonic) de las reproducciones de la ventana
+        self._changed_at = {} # {tabla: instante (monotonic) de la última notificación}
+        self._epoch_at = None # Instante (monotonic) del último aumento de _epoch
+        self._lock = threading.Lock()
+        self.started = False
+
+    def install(self, tables):
+        """
+        Actualiza la función de notificación y crea los triggers que falten en las tablas indicadas.
+        Los triggers ya instalados no se tocan: CREATE/DROP TRIGGER bloquean las escrituras
+        en la tabla y esto se ejecuta cada vez que se reconstruye la caché de recursos.
+        :return: True si quedaron instalados.
+        """
+        wanted = {}
+        for table_name in tables:
+            wanted[f"notificar_{table_name}_sentencia"] = (table_name, "AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE", "STATEMENT")
+            if table_name == PLAYS_TABLE:
+                wanted[f"notificar_{table_name}_fila"] = (table_name, "AFTER INSERT", "ROW")
+        existing = self.db_manager.execute_query(sql.SQL("""
+            SELECT c.relname, t.tgname
+            FROM pg_trigger t
+            JOIN pg_class c ON c.oid = t.tgrelid
+            WHERE NOT t.tgisinternal AND t.tgname = ANY(%s)
+        """), (list(wanted),), fetch_type='all')
+        if existing is None:
+            return False # El error ya se mostró
+        existing = set(existing)
+        missing = {name: spec for name, spec in wanted.items() if (spec[0], name) not in existing}
+        try:
+            with self.db_manager.transaction() as tx:
+                # Reemplazar la función no bloquea las tablas; mantiene al día el formato de la notificación
+                tx.execute_query(sql.SQL(VERSION_SEQUENCE))
+                tx.execute_query(sql.SQL(TRIGGER_FUNCTION))
+                for trigger_name, (table_name, timing, level) in missing.items():
+                    tx.execute_query(sql.SQL(
+                        "CREATE TRIGGER {} {} ON {} FOR EACH {} EXECUTE FUNCTION notificar_cambio({})"
+                    ).format(
+                        sql.Identifier(trigger_name), sql.SQL(timing), sql.Identifier(table_name),
+                        sql.SQL(level), sql.Literal(self.channel)
+                    ))
+        except psycopg2.Error as e:
+            st.warning(f"No se pudieron instalar los triggers de notificación: {e}")
+            return False
+        return True
+
+    def start(self):
+        """Empieza a escuchar el canal (el hilo de escucha es el de DBManager)."""
+        if not self.started:
+            self.db_manager.listen(self.channel, self._on_notify)
+            self.started = True
+
+    def _on_notify(self, payload):
+        if payload is None: # Pudo haber cambios sin notificar: invalidar todo
+            with self._lock:
+                self._epoch += 1
+                self._total_version += 1
+                self._epoch_at = time.monotonic()
+            return
+        change = json.loads(payload)
+        table_name = change.get("tabla")
+        with self._lock:
+            if change.get("nivel") != "ROW": # Las filas de reproduccion llegan también con la notificación de sentencia
+                self.versions[table_name] = self.versions.get(table_name, 0) + 1
+                self._total_version += 1
+                self._changed_at[table_name] = time.monotonic()
+            elif table_name == PLAYS_TABLE:
+                self._recent_plays.append(time.monotonic())
+                self._expire_plays()
+
+    def _expire_plays(self):
+        horizon = time.monotonic() - self.window_s
+        while self._recent_plays and self._recent_plays[0] < horizon:
+            self._recent_plays.popleft()
+
+    def version(self, *tables):
+        """
+        Versión de los datos: de las tablas indicadas (tupla) o, sin argumentos, de toda la base.
+        Cambia cada vez que se notifica una escritura; sirve como clave de caché.
+        """
+        with self._lock:
+            if not tables:
+                return self._total_version
+            return (self._epoch,) + tuple(self.versions.get(table_name, 0) for table_name in tables)
+
+    def recently_changed(self, *tables, within_s):
+        """
+        Si se notificó un cambio en las tablas indicadas (o en cualquiera, sin argumentos) hace
+        menos de within_s segundos. Mientras tanto una réplica puede no tener aún el cambio, y lo
+        leído de ella quedaría en caché con la versión nueva: hay que leer del primario.
+        """
+        with self._lock:
+            if tables:
+                changes = [self._changed_at.get(table_name) for table_name in tables]
+            else:
+                changes = list(self._changed_at.values())
+            changes.append(self._epoch_at)
+        changes = [changed_at for changed_at in changes if changed_at is not None]
+        return bool(changes) and time.monotonic() - max(changes) <= within_s
+
+    def plays_last_minute(self):
+        """Reproducciones registradas en la ventana (por defecto, el último minuto), sin consultar la BD."""
+        with self._lock:
+            self._expire_plays()
+            return len(self._recent_plays)
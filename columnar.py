@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+# OIDs de tipos de PostgreSQL (cursor.description[i].type_code)
+BOOL_OIDS = {16}
+INT_OIDS = {20, 21, 23}
+FLOAT_OIDS = {700, 701} # real y double precision; NUMERIC (1700) se conserva como Decimal (sin perder precisión)
+DATETIME_OIDS = {1082, 1114} # date y timestamp sin zona horaria
+TEXT_OIDS = {25, 1042, 1043}
+# Si la proporción de valores distintos supera esto, el diccionario no ahorra memoria y se decodifica
+DICTIONARY_MAX_RATIO = 0.5
+# Filas leídas del cursor por bloque al construir un resultado completo
+FETCH_CHUNK_ROWS = 10000
+
+class ColumnarResult:
+    """
+    Resultado de una consulta almacenado por columnas: un array NumPy por columna
+    (enteros y booleanos con máscara de nulos, reales como float64, NUMERIC como Decimal, fechas como datetime64)
+    y las columnas de texto codificadas con diccionario (códigos int32 + valores distintos),
+    de modo que columnas como pais, dispositivo o genero guardan cada valor una sola vez.
+    Se construye por bloques, así que solo un bloque de tuplas vive en memoria a la vez.
+    """
+    def __init__(self, names, type_codes):
+        self.names = list(names)
+        self.type_codes = list(type_codes)
+        self.num_rows = 0
+        self._chunks = [[] for _ in self.names] # Por columna: lista de (valores, máscara de nulos)
+        self._dictionaries = [{} if code in TEXT_OIDS else None for code in self.type_codes]
+
+    @classmethod
+    def from_description(cls, description):
+        return cls([column.name for column in description], [column.type_code for column in description])
+
+    @classmethod
+    def from_cursor(cls, cursor, chunk_size=FETCH_CHUNK_ROWS):
+        """Lee todo el resultado del cursor por bloques de chunk_size filas."""
+        result = cls.from_description(cursor.description)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            result.append(rows)
+        return result
+
+    def __len__(self):
+        return self.num_rows
+
+    def append(self, rows):
+        """Añade un bloque de filas (lista de tuplas) convirtiéndolo a columnas."""
+        if not rows:
+            return
+        for i, values in enumerate(zip(*rows)):
+            self._chunks[i].append(self._encode(i, values))
+        self.num_rows += len(rows)
+
+    def _encode(self, i, values):
+        count = len(values)
+        code = self.type_codes[i]
+        dictionary = self._dictionaries[i]
+        if dictionary is not None:
+            codes = np.fromiter(
+                (-1 if v is None else dictionary.setdefault(v, len(dictionary)) for v in values),
+                dtype=np.int32, count=count
+            )
+            return codes, None
+        if code in INT_OIDS or code in BOOL_OIDS:
+            mask = np.fromiter((v is None for v in values), dtype=bool, count=count)
+            dtype = np.int64 if code in INT_OIDS else bool
+            return np.fromiter((0 if v is None else v for v in values), dtype=dtype, count=count), mask
+        if code in FLOAT_OIDS:
+            return np.fromiter((np.nan if v is None else float(v) for v in values), dtype=np.float64, count=count), None
+        if code in DATETIME_OIDS:
+            return np.array(values, dtype="datetime64[us]"), None # None se convierte en NaT
+        array = np.empty(count, dtype=object) # Resto de tipos (NUMERIC, TIME, JSON, arrays...) sin convertir
+        array[:] = values
+        return array, None
+
+    def _consolidate(self, i):
+        """Une los bloques de la columna i en un solo array (y lo conserva así)."""
+        chunks = self._chunks[i]
+        if len(chunks) > 1:
+            values = np.concatenate([values for values, _ in chunks])
+            masks = [mask for _, mask in chunks]
+            mask = None if masks[0] is None else np.concatenate(masks)
+            self._chunks[i] = [(values, mask)]
+        return self._chunks[i][0] if self._chunks[i] else (np.empty(0, dtype=object), None)
+
+    def column(self, name):
+        """Columna como array de pandas/NumPy listo para un DataFrame."""
+        i = self.names.index(name)
+        values, mask = self._consolidate(i)
+        dictionary = self._dictionaries[i]
+        if dictionary is not None:
+            categories = np.empty(len(dictionary), dtype=object)
+            categories[:] = list(dictionary)
+            if self.num_rows and len(dictionary) > DICTIONARY_MAX_RATIO * self.num_rows:
+                decoded = np.empty(len(values), dtype=object) # Casi todos distintos: texto plano
+                present = values >= 0
+                decoded[present] = categories[values[present]]
+                return decoded
+            return pd.Categorical.from_codes(values, categories=categories)
+        if mask is not None:
+            if values.dtype == bool:
+                return pd.arrays.BooleanArray(values, mask)
+            return pd.arrays.IntegerArray(values, mask)
+        return values
+
+    def value(self, name, index):
+        """Valor de una celda como objeto de Python (apto como parámetro de una consulta)."""
+        value = self.column(name)[index]
+        if value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+            return None
+        return value.item() if isinstance(value, np.generic) else value
+
+    def reverse(self):
+        """Invierte el orden de las filas."""
+        for i in range(len(self.names)):
+            values, mask = self._consolidate(i)
+            self._chunks[i] = [(values[::-1].copy(), None if mask is None else mask[::-1].copy())] if self.num_rows else []
+
+    def to_dataframe(self, columns=None):
+        """
+        DataFrame sin pasar por tuplas de Python.
+        :param columns: Nombres a mostrar en lugar de los de la consulta (mismo orden).
+        """
+        labels = columns or self.names
+        return pd.DataFrame({label: self.column(name) for label, name in zip(labels, self.names)}, copy=False)
+
+    def nbytes(self):
+        """Memoria aproximada de los arrays (sin contar los valores de texto del diccionario)."""
+        total = 0
+        for chunks in self._chunks:
+            for values, mask in chunks:
+                total += values.nbytes + (mask.nbytes if mask is not None else 0)
+        return total
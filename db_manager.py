@@ -1,70 +1,608 @@
+import itertools
+import logging
+import random
+import select
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.extensions
 import streamlit as st
 from psycopg2 import sql
 
+from columnar import ColumnarResult
+
+# Errores transitorios: conexión perdida, fallos de serialización y deadlocks.
+# Solo se reintentan en sentencias idempotentes.
+TRANSIENT_ERRORS = (
+    psycopg2.OperationalError,
+    psycopg2.InterfaceError,
+    psycopg2.extensions.TransactionRollbackError,
+)
+
+# Sentencias que pueden repetirse sin efectos secundarios
+READ_ONLY_PREFIXES = ("SELECT", "SHOW", "VALUES", "EXPLAIN")
+
+# Retraso de replicación en segundos (0 si la réplica está al día o el nodo no está en recuperación)
+REPLICA_LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+REPLICA_RETRY_S = 30 # Tiempo que se descarta una réplica caída antes de volver a probarla
+LISTEN_POLL_S = 1.0 # Espera máxima del hilo de LISTEN antes de revisar canales nuevos o la parada
+
+logger = logging.getLogger("streaming.db")
+_rerun_internals_warned = False # El aviso de internals ausentes se registra una sola vez
+
+def _get_script_run_ctx():
+    """Contexto de ejecución del script de Streamlit actual (None fuera de Streamlit)."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        return get_script_run_ctx()
+    except Exception:
+        return None
+
+def _rerun_detection_available(ctx):
+    """
+    Si se puede detectar un rerun leyendo los internals de Streamlit (ScriptRequests._state y
+    _rerun_data, sin garantía de estabilidad entre versiones). Si faltan, las consultas solo se
+    cortan por statement_timeout y se registra un aviso (una vez).
+    """
+    global _rerun_internals_warned
+    requests = getattr(ctx, "script_requests", None)
+    if hasattr(requests, "_state") and hasattr(requests, "_rerun_data"):
+        return True
+    if not _rerun_internals_warned:
+        _rerun_internals_warned = True
+        logger.warning("Esta versión de Streamlit no expone ScriptRequests._state/_rerun_data: "
+                       "las consultas no se cancelarán al re-ejecutar la sesión (solo por statement_timeout).")
+    return False
+
+def _rerun_requested(ctx):
+    """
+    Indica si Streamlit pidió detener o re-ejecutar el script de esta sesión,
+    es decir, si el resultado de la consulta en curso ya no se va a mostrar.
+    Los reruns de fragmentos (run_every, st.rerun(scope="fragment")) no cuentan: solo
+    re-ejecutan el fragmento y no interrumpen el script en curso.
+    """
+    requests = getattr(ctx, "script_requests", None)
+    state = getattr(requests, "_state", None)
+    name = getattr(state, "name", "CONTINUE")
+    if name == "CONTINUE":
+        return False
+    if name == "RERUN":
+        rerun_data = getattr(requests, "_rerun_data", None)
+        if getattr(rerun_data, "fragment_id_queue", None) or getattr(rerun_data, "is_fragment_scoped_rerun", False):
+            return False
+    return True
+
+class _Replica:
+    """Conexión de solo lectura a una réplica, con su propio candado y estado de retraso."""
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.connection = None
+        self._lock = threading.RLock()
+        self.lag_s = None
+        self.lag_checked_at = 0.0
+        self.down_until = 0.0
+
+class Transaction:
+    """
+    Unidad de trabajo abierta con DBManager.transaction().
+    Todas las sentencias ejecutadas a través de ella se confirman juntas al salir del bloque.
+    """
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+
+    def execute_query(self, query, params=None, fetch_type=None, timeout_ms=None):
+        """Ejecuta una sentencia dentro de la transacción (los errores se propagan)."""
+        return self.db_manager.execute_query(query, params, fetch_type=fetch_type, timeout_ms=timeout_ms)
+
+    def savepoint(self):
+        """Abre un SAVEPOINT anidado; si su bloque falla solo se revierte ese tramo."""
+        return self.db_manager.transaction()
+
+    def on_commit(self, callback):
+        """
+        Registra callback() para después del COMMIT, fuera de la transacción. Si la transacción
+        (o el savepoint en el que se registró) se revierte, no se llama.
+        """
+        self.db_manager._on_commit.append(callback)
+
 @st.cache_resource(ttl=3600) # La conexión se mantendrá en caché por 1 hora
 class DBManager:
     """
     Clase para gestionar la conexión a la base de datos PostgreSQL
     y la ejecución de consultas.
     """
-    def __init__(self, dbname, user, password, host, port):
+    def __init__(self, dbname, user, password, host, port, statement_timeout_ms=None,
+                 max_retries=3, backoff_base=0.2, backoff_max=5.0, cancel_on_rerun=True,
+                 replicas=(), max_replica_lag_s=5.0, lag_check_interval_s=10.0):
         self.dbname = dbname
         self.user = user
         self.password = password
         self.host = host
         self.port = port
+        self.statement_timeout_ms = statement_timeout_ms # Límite por defecto para cada sentencia (None = sin límite)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cancel_on_rerun = cancel_on_rerun
         self.connection = None
+        self._lock = threading.RLock() # Serializa el uso de la conexión compartida entre sesiones
+        self._tx_depth = 0 # Nivel de anidamiento de la transacción abierta (0 = autocommit)
+        self._tx_owner = None # Hilo que abrió la transacción
+        self._on_commit = [] # Funciones registradas con Transaction.on_commit en la transacción abierta
+        # Réplicas de solo lectura: "host:puerto" o (host, puerto). Mismas credenciales y base de datos.
+        self.replicas = [
+            _Replica(*(replica.rsplit(":", 1) if isinstance(replica, str) else replica))
+            for replica in replicas
+        ]
+        self.max_replica_lag_s = max_replica_lag_s
+        self.lag_check_interval_s = lag_check_interval_s
+        self._replica_cycle = itertools.count() # Reparto round-robin
+        # Contadores de uso (consultas, errores, reintentos, tiempo en el servidor) para diagnóstico
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+        # LISTEN/NOTIFY: un hilo con conexión propia reparte las notificaciones a los suscriptores
+        self._subscribers = {} # {canal: [callback(payload)]}
+        self._listen_lock = threading.Lock()
+        self._listen_stop = threading.Event()
+        self._listener = None
+
+    def _open_connection(self, host=None, port=None):
+        """
+        Abre una conexión nueva con los parámetros configurados (lanza psycopg2.Error).
+        host y port permiten conectar a una réplica; por defecto se usa el primario.
+        """
+        options = None
+        if self.statement_timeout_ms:
+            options = f"-c statement_timeout={int(self.statement_timeout_ms)}"
+        connection = psycopg2.connect(
+            dbname=self.dbname, # Usará "streaming_db" pasado desde app.py
+            user=self.user,
+            password=self.password,
+            host=host or self.host,
+            port=port or self.port,
+            client_encoding='UTF8', # Asegura la codificación UTF-8
+            options=options
+        )
+        connection.autocommit = True
+        return connection
 
     def connect(self):
         """
         Establece la conexión con la base de datos.
         """
         try:
-            self.connection = psycopg2.connect(
-                dbname=self.dbname, # Usará "streaming_db" pasado desde app.py
-                user=self.user,
-                password=self.password,
-                host=self.host,
-                port=self.port,
-                client_encoding='UTF8' # Asegura la codificación UTF-8
-            )
-            self.connection.autocommit = True
+            self.connection = self._open_connection()
             return True # Indicar que la conexión fue exitosa
         except psycopg2.Error as e:
             st.error(f"No se pudo conectar a la base de datos: {e}\n"
                      f"Asegúrate de que PostgreSQL esté corriendo y la base de datos '{self.dbname}' exista.")
             return False # Indicar que la conexión falló
 
-    def execute_query(self, query, params=None, fetch_type=None):
+    def _reconnect(self):
+        """
+        Reemplaza una conexión perdida por una nueva sin mostrar errores.
+        :return: True si la reconexión fue exitosa.
+        """
+        try:
+            if self.connection and not self.connection.closed:
+                self.connection.close()
+        except psycopg2.Error:
+            pass
+        try:
+            self.connection = self._open_connection()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _is_read_only(self, query):
+        """Heurística para decidir si una sentencia es idempotente y se puede reintentar."""
+        try:
+            text = query.as_string(self.connection) if isinstance(query, sql.Composable) else str(query)
+        except (psycopg2.Error, TypeError):
+            return False
+        text = text.lstrip(" \n\t(").upper()
+        return text.startswith(READ_ONLY_PREFIXES) and not text.startswith("EXPLAIN ANALYZE")
+
+    def _backoff(self, attempt):
+        """Espera exponencial con jitter antes del siguiente intento."""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def _watch_for_abandon(self, connection, ctx, done, abandoned):
+        """
+        Hilo vigilante: si la sesión de Streamlit pide un rerun mientras la consulta
+        sigue en curso, cancela la consulta en el servidor.
+        """
+        while not done.wait(0.1):
+            if _rerun_requested(ctx):
+                abandoned.set()
+                try:
+                    connection.cancel()
+                except psycopg2.Error:
+                    pass
+                return
+
+    def _execute_once(self, query, params, fetch_type, timeout_ms, abandoned, node=None):
+        """
+        Ejecuta la sentencia una vez sobre la conexión del primario o de la réplica indicada en node.
+        """
+        node = node or self
+        connection = node.connection
+        ctx = _get_script_run_ctx() if self.cancel_on_rerun else None
+        with node._lock, connection.cursor() as cursor:
+            if timeout_ms is not None:
+                cursor.execute("SET statement_timeout = %s", (int(timeout_ms),))
+            done = threading.Event()
+            watchdog = None
+            if ctx is not None and _rerun_detection_available(ctx):
+                watchdog = threading.Thread(target=self._watch_for_abandon, args=(connection, ctx, done, abandoned), daemon=True)
+                watchdog.start()
+            started = time.perf_counter()
+            try:
+                cursor.execute(query, params)
+            except psycopg2.Error:
+                self._count("errors")
+                raise
+            finally:
+                self._count("queries", time.perf_counter() - started)
+                done.set()
+                if watchdog is not None:
+                    watchdog.join()
+                if timeout_ms is not None and not connection.closed:
+                    try: # Restaurar el límite por defecto de la conexión
+                        cursor.execute("SET statement_timeout = %s", (int(self.statement_timeout_ms or 0),))
+                    except psycopg2.Error:
+                        pass
+            if fetch_type == 'one':
+                return cursor.fetchone()
+            elif fetch_type == 'all':
+                return cursor.fetchall()
+            elif fetch_type == 'columnar':
+                return ColumnarResult.from_cursor(cursor)
+            return None
+
+    def _replica_available(self, replica):
+        """
+        Comprueba (como mucho cada lag_check_interval_s) que la réplica responde y que su
+        retraso no supera max_replica_lag_s.
+        """
+        now = time.monotonic()
+        if now < replica.down_until:
+            return False
+        try:
+            if replica.connection is None or replica.connection.closed:
+                replica.connection = self._open_connection(replica.host, replica.port)
+                replica.lag_checked_at = 0.0
+            if now - replica.lag_checked_at >= self.lag_check_interval_s:
+                with replica._lock, replica.connection.cursor() as cursor:
+                    cursor.execute(REPLICA_LAG_QUERY)
+                    replica.lag_s = float(cursor.fetchone()[0])
+                replica.lag_checked_at = now
+        except psycopg2.Error:
+            replica.down_until = now + REPLICA_RETRY_S
+            return False
+        return replica.lag_s is not None and replica.lag_s <= self.max_replica_lag_s
+
+    def _pick_replica(self):
+        """Siguiente réplica disponible en orden round-robin, o None para usar el primario."""
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._replica_cycle) % len(self.replicas)]
+            if self._replica_available(replica):
+                return replica
+        return None
+
+    def _report_cancel(self, error, timeout_ms, abandoned):
+        """Informa de una consulta cancelada salvo que la sesión ya la hubiera abandonado."""
+        if not abandoned.is_set():
+            limit = timeout_ms if timeout_ms is not None else self.statement_timeout_ms
+            st.error(f"La consulta superó el tiempo límite ({limit} ms) y fue cancelada: {error}")
+        return None
+
+    def execute_query(self, query, params=None, fetch_type=None, timeout_ms=None, idempotent=None, route="primary"):
         """
         Ejecuta una consulta SQL en la base de datos.
         :param query: La consulta SQL a ejecutar.
         :param params: Parámetros para la consulta (opcional).
-        :param fetch_type: 'one' para un solo resultado, 'all' para todos, None para sin resultados.
+        :param fetch_type: 'one' para un solo resultado, 'all' para todos, 'columnar' para todos como
+                           ColumnarResult (por columnas, sin lista de tuplas), None para sin resultados.
+        :param timeout_ms: statement_timeout para esta llamada en milisegundos (opcional).
+        :param idempotent: Si la sentencia se puede reintentar; None lo deduce (solo lecturas).
+        :param route: 'primary' o 'replica'. Las lecturas enviadas a 'replica' vuelven al primario
+                      si no hay réplicas al día o si la réplica falla.
         :return: Resultados de la consulta o None.
         """
         if not self.connection:
             st.error("No hay conexión a la base de datos. Por favor, conecta primero.")
             return None
+        if route == "replica" and self.replicas and not self._in_transaction():
+            replica = self._pick_replica()
+            if replica is not None:
+                abandoned = threading.Event()
+                try:
+                    return self._execute_once(query, params, fetch_type, timeout_ms, abandoned, node=replica)
+                except psycopg2.extensions.QueryCanceledError as e:
+                    return self._report_cancel(e, timeout_ms, abandoned)
+                except TRANSIENT_ERRORS:
+                    replica.down_until = time.monotonic() + REPLICA_RETRY_S # Continuar en el primario
+                except psycopg2.Error as e:
+                    st.error(f"Error al ejecutar la consulta: {e}")
+                    return None
+        if self.connection.closed and not self._reconnect():
+            st.error("Se perdió la conexión a la base de datos y no se pudo restablecer.")
+            return None
+        if self._in_transaction():
+            # Dentro de una transacción no se reintenta ni se reconecta: el error se propaga
+            # para que transaction() revierta todo el bloque.
+            try:
+                return self._execute_once(query, params, fetch_type, timeout_ms, threading.Event())
+            except psycopg2.Error as e:
+                st.error(f"Error al ejecutar la consulta (se revertirá la transacción): {e}")
+                raise
+        if idempotent is None:
+            idempotent = self._is_read_only(query)
+
+        attempt = 0
+        while True:
+            abandoned = threading.Event()
+            try:
+                return self._execute_once(query, params, fetch_type, timeout_ms, abandoned)
+            except psycopg2.extensions.QueryCanceledError as e:
+                return self._report_cancel(e, timeout_ms, abandoned)
+            except TRANSIENT_ERRORS as e:
+                if not idempotent or attempt >= self.max_retries:
+                    if self.connection.closed:
+                        self._reconnect() # Dejar la conexión utilizable para la siguiente llamada
+                    st.error(f"Error al ejecutar la consulta: {e}")
+                    return None
+                self._backoff(attempt)
+                attempt += 1
+                self._count("retries")
+                if self.connection.closed:
+                    self._reconnect() # Si falla, el siguiente intento consumirá otro reintento
+            except psycopg2.Error as e:
+                st.error(f"Error al ejecutar la consulta: {e}")
+                return None
+
+    def new_connection(self, route="primary"):
+        """
+        Abre una conexión independiente (autocommit) para trabajo en paralelo; con route="replica"
+        se conecta a una réplica disponible si la hay. Quien la pide debe cerrarla.
+        """
+        node = self._pick_replica() if route == "replica" and self.replicas else None
+        return self._open_connection(*((node.host, node.port) if node else ()))
+
+    def stream_query(self, query, params=None, chunk_size=500, max_chunk_size=20000, max_rows=None,
+                     route="primary", timeout_ms=None, stats=None, columnar=False):
+        """
+        Ejecuta una consulta con un cursor del lado del servidor y la entrega por bloques,
+        sin cargar el resultado completo en memoria. Usa una conexión propia para no bloquear
+        la conexión compartida mientras se consume el resultado.
+        :param chunk_size: Tamaño del primer bloque; se duplica en cada bloque hasta max_chunk_size,
+                           así el primer bloque llega enseguida y los siguientes requieren menos viajes.
+        :param max_rows: Máximo de filas a entregar (None = sin límite).
+        :param stats: Diccionario opcional donde se anotan 'rows', 'truncated_rows' (filas no entregadas
+                      por el límite, contadas en el servidor con MOVE sin transferirlas) y 'failed'.
+        :param columnar: Acumular los bloques en un ColumnarResult y entregarlo (el mismo objeto,
+                         cada vez más grande) tras cada bloque, en lugar de listas de filas.
+        :return: Generador de listas de filas (o del ColumnarResult acumulado).
+        """
+        stats = stats if stats is not None else {}
+        stats["rows"] = 0
+        stats["truncated_rows"] = 0
+        stats["failed"] = False
+        abandoned = threading.Event()
+        connection = None
         try:
-            with self.connection.cursor() as cursor:
+            connection = self.new_connection(route)
+            connection.autocommit = False # Los cursores del servidor viven dentro de una transacción
+            cursor_name = f"stream_{uuid.uuid4().hex}"
+            with connection.cursor() as control:
+                if timeout_ms is not None:
+                    control.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+            with connection.cursor(name=cursor_name) as cursor:
+                self._count("streams")
                 cursor.execute(query, params)
-                if fetch_type == 'one':
-                    return cursor.fetchone()
-                elif fetch_type == 'all':
-                    return cursor.fetchall()
-                return None
+                result = None
+                size = chunk_size
+                while max_rows is None or stats["rows"] < max_rows:
+                    if max_rows is not None:
+                        size = min(size, max_rows - stats["rows"])
+                    rows = cursor.fetchmany(size)
+                    if not rows:
+                        break
+                    fetched = len(rows)
+                    stats["rows"] += fetched
+                    if columnar:
+                        if result is None:
+                            result = ColumnarResult.from_description(cursor.description)
+                        result.append(rows)
+                        rows = None # Solo se conservan las columnas
+                        yield result
+                    else:
+                        yield rows
+                    if fetched < size:
+                        break
+                    size = min(size * 2, max_chunk_size)
+                else:
+                    with connection.cursor() as control: # Contar el resto sin transferirlo
+                        control.execute(sql.SQL("MOVE FORWARD ALL IN {}").format(sql.Identifier(cursor_name)))
+                        stats["truncated_rows"] = control.rowcount
+        except psycopg2.extensions.QueryCanceledError as e:
+            self._count("errors")
+            stats["failed"] = True
+            self._report_cancel(e, timeout_ms, abandoned)
         except psycopg2.Error as e:
+            self._count("errors")
+            stats["failed"] = True
             st.error(f"Error al ejecutar la consulta: {e}")
-            return None
+        finally:
+            if connection is not None and not connection.closed:
+                connection.close() # Cierra el cursor y cancela la consulta si se abandonó el generador
+
+    def _count(self, counter, elapsed_s=None):
+        with self._stats_lock:
+            self._stats[counter] += 1
+            if elapsed_s is not None:
+                self._stats["query_time_s"] += elapsed_s
+
+    def reset_stats(self):
+        """Pone a cero los contadores de uso."""
+        with self._stats_lock:
+            self._stats = {"queries": 0, "errors": 0, "retries": 0, "streams": 0, "query_time_s": 0.0}
+
+    def stats(self):
+        """
+        Copia de los contadores: queries (sentencias ejecutadas, incluidos reintentos), errors,
+        retries, streams (consultas por cursor del servidor) y query_time_s (tiempo total de ejecución).
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def listen(self, channel, callback):
+        """
+        Suscribe callback(payload) a las notificaciones NOTIFY del canal. Todas las suscripciones
+        comparten un hilo y una conexión dedicados. Tras (re)conectar se llama a callback(None),
+        porque pudieron perderse notificaciones mientras no había conexión.
+        """
+        with self._listen_lock:
+            self._subscribers.setdefault(channel, []).append(callback)
+            if self._listener is None or not self._listener.is_alive():
+                self._listen_stop.clear()
+                self._listener = threading.Thread(target=self._listen_loop, name="db-listen", daemon=True)
+                self._listener.start()
+
+    def _listen_loop(self):
+        """Hilo de LISTEN: espera notificaciones con select() y las entrega a los suscriptores."""
+        connection = None
+        listening = set()
+        attempt = 0
+        while not self._listen_stop.is_set():
+            try:
+                if connection is None or connection.closed:
+                    connection = self._open_connection()
+                    listening = set()
+                with self._listen_lock:
+                    channels = set(self._subscribers)
+                with connection.cursor() as cursor:
+                    for channel in channels - listening:
+                        cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+                        self._notify_subscribers(channel, None) # Posible hueco antes del LISTEN
+                listening = channels
+                attempt = 0
+                if select.select([connection], [], [], LISTEN_POLL_S) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    self._notify_subscribers(notify.channel, notify.payload)
+            except (psycopg2.Error, OSError):
+                if connection is not None and not connection.closed:
+                    connection.close()
+                connection = None
+                self._listen_stop.wait(min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                attempt += 1
+        if connection is not None and not connection.closed:
+            connection.close()
+
+    def _notify_subscribers(self, channel, payload):
+        with self._listen_lock:
+            callbacks = list(self._subscribers.get(channel, ()))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception: # Un suscriptor defectuoso no debe detener el hilo
+                pass
+
+    def _in_transaction(self):
+        """Indica si el hilo actual tiene una transacción abierta."""
+        return self._tx_depth > 0 and self._tx_owner == threading.get_ident()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Agrupa varias llamadas a execute_query en una sola transacción (un solo COMMIT).
+        Las llamadas anidadas crean SAVEPOINTs. Si el bloque lanza una excepción se revierte
+        la transacción (o el savepoint) y la excepción se propaga. Las funciones registradas
+        con Transaction.on_commit se llaman tras el COMMIT, ya sin el candado de la conexión.
+
+        Uso:
+            with db_manager.transaction() as tx:
+                tx.execute_query(...)
+                with tx.savepoint():
+                    tx.execute_query(...)
+        """
+        with self._lock:
+            depth = self._tx_depth
+            savepoint = sql.Identifier(f"sp_{depth}")
+            if depth == 0:
+                if not self.connection or (self.connection.closed and not self._reconnect()):
+                    raise psycopg2.InterfaceError("No hay conexión a la base de datos.")
+                self.connection.autocommit = False
+                self._tx_owner = threading.get_ident()
+                self._on_commit = []
+            else:
+                with self.connection.cursor() as cursor:
+                    cursor.execute(sql.SQL("SAVEPOINT {}").format(savepoint))
+            self._tx_depth += 1
+            committed = []
+            pending_from = len(self._on_commit) # Lo registrado en este nivel se descarta si se revierte
+            try:
+                yield Transaction(self)
+            except BaseException:
+                self._tx_depth -= 1
+                del self._on_commit[pending_from:]
+                if not self.connection.closed:
+                    try:
+                        if depth == 0:
+                            self.connection.rollback()
+                        else:
+                            with self.connection.cursor() as cursor:
+                                cursor.execute(sql.SQL("ROLLBACK TO SAVEPOINT {}").format(savepoint))
+                    except psycopg2.Error:
+                        pass
+                raise
+            else:
+                self._tx_depth -= 1
+                if depth == 0:
+                    self.connection.commit()
+                    committed, self._on_commit = self._on_commit, []
+                else:
+                    with self.connection.cursor() as cursor:
+                        cursor.execute(sql.SQL("RELEASE SAVEPOINT {}").format(savepoint))
+            finally:
+                if depth == 0:
+                    self._tx_owner = None
+                    if not self.connection.closed:
+                        try:
+                            self.connection.autocommit = True
+                        except psycopg2.Error:
+                            self._reconnect()
+        for callback in committed:
+            callback()
 
     def close(self):
         """
         Cierra la conexión a la base de datos si está abierta.
         """
+        self._listen_stop.set()
+        if self._listener is not None:
+            self._listener.join(LISTEN_POLL_S * 2)
+            self._listener = None
+        for replica in self.replicas:
+            if replica.connection and not replica.connection.closed:
+                replica.connection.close()
+            replica.connection = None
         if self.connection:
             self.connection.close()
             self.connection = None
             st.info("Conexión a la base de datos cerrada.")
-
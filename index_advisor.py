@@ -0,0 +1,337 @@
+import argparse
+
+import psycopg2
+from psycopg2 import sql
+
+from schema_inspector import SchemaInspector
+
+# Índices que piden las consultas de analítica y reportes, además de las claves foráneas de los managers
+WORKLOAD_INDEXES = [
+    ("reproduccion", ("id_usuario", "fecha_reproduccion"), "Sesionización (ORDER BY id_usuario, fecha_reproduccion)"),
+    ("reproduccion", ("fecha_reproduccion",), "Reportes, sketches y particiones por rango de fechas"),
+    ("playlist_cancion", ("id_playlist", "orden", "id_cancion"), "Canciones de una playlist en orden (detalle de playlists)"),
+]
+# Índices sin uso más pequeños que esto no compensan el aviso
+UNUSED_INDEX_MIN_BYTES = 1024 * 1024
+# Densidad media de hojas (pgstatindex) por debajo de la cual un btree se considera inflado
+BLOAT_LEAF_DENSITY = 50.0
+# CREATE/DROP INDEX CONCURRENTLY recorren la tabla completa: sin límite de tiempo
+INDEX_TIMEOUT_MS = 0
+
+# Índices inválidos que deja una operación CONCURRENTLY interrumpida: el propio índice
+# (CREATE/DROP) o la copia <nombre>_ccnew de un REINDEX
+INVALID_LEFTOVERS_QUERY = """
+SELECT i.relname
+FROM pg_index ix
+JOIN pg_class i ON i.oid = ix.indexrelid
+JOIN pg_namespace n ON n.oid = i.relnamespace
+WHERE n.nspname = %s AND NOT ix.indisvalid
+  AND (i.relname = %s OR starts_with(i.relname, %s))
+"""
+
+def _index_name(table_name, columns):
+    """Nombre del índice recomendado (PostgreSQL trunca los identificadores a 63 bytes)."""
+    return f"idx_{table_name}_{'_'.join(columns)}"[:63]
+
+class IndexAdvisor:
+    """
+    Clase para revisar los índices del esquema: recomienda los que faltan para las claves
+    foráneas declaradas en los managers y las consultas de analítica, señala los que no se usan,
+    los redundantes y los inflados, y aplica las recomendaciones con CREATE/DROP INDEX CONCURRENTLY.
+    """
+    def __init__(self, db_manager, managers, schema="public"):
+        self.db_manager = db_manager
+        self.managers = managers
+        self.schema = schema
+        self.schema_inspector = SchemaInspector(db_manager, schema)
+
+    def _extension_installed(self, name):
+        result = self.db_manager.execute_query(
+            sql.SQL("SELECT 1 FROM pg_extension WHERE extname = %s"), (name,), fetch_type='one'
+        )
+        return result is not None
+
+    def table_activity(self):
+        """
+        Actividad por tabla según pg_stat_user_tables.
+        :return: Diccionario {tabla: {seq_scan, seq_tup_read, idx_scan, live_rows, dead_rows}}.
+        """
+        rows = self.db_manager.execute_query(sql.SQL("""
+            SELECT relname, seq_scan, seq_tup_read, COALESCE(idx_scan, 0), n_live_tup, n_dead_tup
+            FROM pg_stat_user_tables
+            WHERE schemaname = %s
+        """), (self.schema,), fetch_type='all') or []
+        return {
+            table_name: {"seq_scan": seq_scan, "seq_tup_read": seq_tup_read, "idx_scan": idx_scan,
+                         "live_rows": live_rows, "dead_rows": dead_rows}
+            for table_name, seq_scan, seq_tup_read, idx_scan, live_rows, dead_rows in rows
+        }
+
+    def heavy_statements(self, limit=20):
+        """
+        Sentencias con más tiempo total según pg_stat_statements (lista vacía si no está instalada).
+        :return: Lista de (consulta, llamadas, tiempo_medio_ms, tiempo_total_ms).
+        """
+        if not self._extension_installed("pg_stat_statements"):
+            return []
+        return self.db_manager.execute_query(sql.SQL("""
+            SELECT query, calls, round(mean_exec_time::numeric, 2), round(total_exec_time::numeric, 2)
+            FROM pg_stat_statements
+            WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+            ORDER BY total_exec_time DESC
+            LIMIT %s
+        """), (limit,), fetch_type='all') or []
+
+    def _is_covered(self, table_name, columns):
+        """Si algún índice de la tabla empieza por las columnas indicadas (en ese orden)."""
+        table = self.schema_inspector.table(table_name)
+        if not table:
+            return True # Tabla inexistente: nada que recomendar
+        return any(index["columns"][:len(columns)] == list(columns) for index in table["indexes"])
+
+    def _candidates(self):
+        """Columnas que deberían estar indexadas: (tabla, columnas, motivo)."""
+        candidates = []
+        for manager in self.managers:
+            table = self.schema_inspector.table(manager.table_name) or {}
+            fk_columns = list(manager.relations) + [
+                column for column in table.get("foreign_keys", {}) if column not in manager.relations
+            ]
+            for column in fk_columns:
+                candidates.append((manager.table_name, (column,), "Clave foránea (JOIN y resolución de relaciones)"))
+        candidates.extend(WORKLOAD_INDEXES)
+        unique = {}
+        for table_name, columns, reason in candidates:
+            unique.setdefault((table_name, tuple(columns)), reason)
+        return [(table_name, columns, reason) for (table_name, columns), reason in unique.items()]
+
+    def missing_indexes(self, activity=None, statements=None):
+        """
+        Índices recomendados que no existen, ordenados por filas leídas en recorridos secuenciales.
+        :return: Lista de diccionarios con table, columns, reason, seq_tup_read, statements y statement.
+        """
+        activity = self.table_activity() if activity is None else activity
+        statements = self.heavy_statements() if statements is None else statements
+        recommendations = []
+        for table_name, columns, reason in self._candidates():
+            if self._is_covered(table_name, columns):
+                continue
+            matching = sum(1 for query, *_ in statements if table_name in query and columns[0] in query)
+            recommendations.append({
+                "table": table_name,
+                "columns": list(columns),
+                "reason": reason,
+                "seq_tup_read": activity.get(table_name, {}).get("seq_tup_read", 0),
+                "statements": matching, # Sentencias del registro que mencionan la tabla y la columna
+                "statement": sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})").format(
+                    sql.Identifier(_index_name(table_name, columns)),
+                    sql.Identifier(self.schema, table_name),
+                    sql.SQL(", ").join(map(sql.Identifier, columns))
+                ),
+                "index_name": _index_name(table_name, columns)
+            })
+        recommendations.sort(key=lambda rec: (rec["statements"], rec["seq_tup_read"]), reverse=True)
+        return recommendations
+
+    def unused_indexes(self):
+        """
+        Índices sin ningún escaneo desde el último reinicio de estadísticas que no respaldan
+        una clave primaria, única ni restricción.
+        """
+        rows = self.db_manager.execute_query(sql.SQL("""
+            SELECT s.relname, s.indexrelname, s.idx_scan, pg_relation_size(s.indexrelid)
+            FROM pg_stat_user_indexes s
+            JOIN pg_index ix ON ix.indexrelid = s.indexrelid
+            WHERE s.schemaname = %s AND s.idx_scan = 0
+              AND NOT ix.indisunique AND NOT ix.indisprimary
+              AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = s.indexrelid)
+              AND pg_relation_size(s.indexrelid) >= %s
+            ORDER BY pg_relation_size(s.indexrelid) DESC
+        """), (self.schema, UNUSED_INDEX_MIN_BYTES), fetch_type='all') or []
+        return [self._drop_recommendation(table_name, index_name, "Sin escaneos", size)
+                for table_name, index_name, _, size in rows]
+
+    def redundant_indexes(self):
+        """Índices no únicos cuyas columnas son prefijo de otro índice del mismo tipo en la tabla."""
+        recommendations = []
+        for table_name, table in self.schema_inspector.tables.items():
+            for index in table["indexes"]:
+                if index["unique"] or index["primary"]:
+                    continue
+                for other in table["indexes"]:
+                    if (other is not index and other["method"] == index["method"]
+                            and len(other["columns"]) > len(index["columns"])
+                            and other["columns"][:len(index["columns"])] == index["columns"]):
+                        recommendations.append(self._drop_recommendation(
+                            table_name, index["name"], f"Redundante con {other['name']}", None
+                        ))
+                        break
+        return recommendations
+
+    def bloated_indexes(self):
+        """
+        Btrees con baja densidad de hojas según pgstatindex (lista vacía si pgstattuple no está instalada).
+        Se reconstruyen con REINDEX INDEX CONCURRENTLY.
+        """
+        if not self._extension_installed("pgstattuple"):
+            return []
+        rows = self.db_manager.execute_query(sql.SQL("""
+            SELECT t.relname, i.relname, s.avg_leaf_density, pg_relation_size(i.oid)
+            FROM pg_index ix
+            JOIN pg_class i ON i.oid = ix.indexrelid
+            JOIN pg_class t ON t.oid = ix.indrelid
+            JOIN pg_namespace n ON n.oid = t.relnamespace
+            JOIN pg_am am ON am.oid = i.relam
+            CROSS JOIN LATERAL pgstatindex(i.oid) s
+            WHERE n.nspname = %s AND am.amname = 'btree' AND pg_relation_size(i.oid) >= %s
+              AND s.avg_leaf_density < %s
+            ORDER BY pg_relation_size(i.oid) DESC
+        """), (self.schema, UNUSED_INDEX_MIN_BYTES, BLOAT_LEAF_DENSITY), fetch_type='all') or []
+        return [{
+            "table": table_name,
+            "index_name": index_name,
+            "reason": f"Densidad de hojas {density:.0f} %",
+            "bytes": size,
+            "statement": sql.SQL("REINDEX INDEX CONCURRENTLY {}").format(sql.Identifier(self.schema, index_name))
+        } for table_name, index_name, density, size in rows]
+
+    def _drop_recommendation(self, table_name, index_name, reason, size):
+        return {
+            "table": table_name,
+            "index_name": index_name,
+            "reason": reason,
+            "bytes": size,
+            "statement": sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(self.schema, index_name))
+        }
+
+    def analyze(self):
+        """
+        Ejecuta todas las revisiones.
+        :return: Diccionario con activity, statements, missing, unused, redundant y bloated, o None si falló.
+        """
+        if not self.schema_inspector.load():
+            return None
+        activity = self.table_activity()
+        statements = self.heavy_statements()
+        return {
+            "activity": activity,
+            "statements": statements,
+            "missing": self.missing_indexes(activity, statements),
+            "unused": self.unused_indexes(),
+            "redundant": self.redundant_indexes(),
+            "bloated": self.bloated_indexes()
+        }
+
+    def statement_text(self, recommendation):
+        """Texto SQL de una recomendación, para mostrarlo o copiarlo."""
+        return recommendation["statement"].as_string(self.db_manager.connection)
+
+    def apply(self, recommendation):
+        """
+        Aplica una recomendación en una conexión propia en autocommit: las operaciones CONCURRENTLY
+        no pueden ir dentro de una transacción y, en la conexión compartida, retendrían su candado
+        (y a todas las sesiones) durante toda la construcción. Tampoco se cancelan si la sesión de
+        Streamlit se re-ejecuta. Las llamadas sobre un mismo índice se serializan con un advisory lock.
+        Solo si la sentencia de esta llamada falla se eliminan los índices inválidos que deja: un índice
+        inválido sin error propio puede ser el que otra sesión aún está construyendo.
+        :return: Diccionario con ok (índice creado y válido, o eliminado), error (texto o None)
+                 y dropped_invalid (índices inválidos eliminados).
+        """
+        index_name = recommendation["index_name"]
+        result = {"ok": False, "error": None, "dropped_invalid": []}
+        try:
+            connection = self.db_manager.new_connection()
+        except psycopg2.Error as e:
+            result["error"] = str(e)
+            return result
+        try:
+            with connection.cursor() as cursor:
+                is_drop = recommendation["statement"].as_string(connection).startswith("DROP")
+                cursor.execute("SET statement_timeout = %s", (INDEX_TIMEOUT_MS,))
+                # Se libera al cerrar la conexión
+                cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", (f"index_advisor:{self.schema}.{index_name}",))
+                try:
+                    cursor.execute(recommendation["statement"])
+                except psycopg2.Error as e:
+                    result["error"] = str(e)
+                if result["error"] is not None:
+                    cursor.execute(INVALID_LEFTOVERS_QUERY, (self.schema, index_name, f"{index_name}_ccnew"))
+                    for (leftover,) in cursor.fetchall():
+                        cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(
+                            sql.Identifier(self.schema, leftover)
+                        ))
+                        result["dropped_invalid"].append(leftover)
+                cursor.execute(sql.SQL("""
+                    SELECT ix.indisvalid
+                    FROM pg_index ix
+                    JOIN pg_class i ON i.oid = ix.indexrelid
+                    JOIN pg_namespace n ON n.oid = i.relnamespace
+                    WHERE n.nspname = %s AND i.relname = %s
+                """), (self.schema, index_name))
+                valid = cursor.fetchone()
+        except psycopg2.Error as e:
+            result["error"] = result["error"] or str(e)
+            return result
+        finally:
+            connection.close()
+        if is_drop:
+            result["ok"] = valid is None
+        else:
+            result["ok"] = result["error"] is None and valid is not None and valid[0]
+            if result["error"] is None and valid is not None and not valid[0]:
+                # IF NOT EXISTS omitió un índice inválido ajeno: se deja a quien lo construye
+                result["error"] = "El índice existe pero no es válido (otra sesión lo está construyendo o quedó inválido)."
+        return result
+
+def main():
+    """Uso: python index_advisor.py --password ... [--apply]"""
+    from db_manager import DBManager
+    from user_manager import UserManager
+    from artist_manager import ArtistManager
+    from album_manager import AlbumManager
+    from song_manager import SongManager
+    from playlist_manager import PlaylistManager
+    from playlist_song_manager import PlaylistSongManager
+    from reproduction_manager import ReproductionManager
+
+    parser = argparse.ArgumentParser(description="Recomendaciones y mantenimiento de índices.")
+    parser.add_argument("--dbname", default="streaming_db")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--apply", action="store_true", help="Crear los índices recomendados que faltan.")
+    args = parser.parse_args()
+
+    db_manager = DBManager(args.dbname, args.user, args.password, args.host, args.port)
+    if not db_manager.connection and not db_manager.connect():
+        raise SystemExit("No se pudo conectar a la base de datos.")
+    managers = [manager_class(db_manager) for manager_class in (
+        UserManager, ArtistManager, AlbumManager, SongManager,
+        PlaylistManager, PlaylistSongManager, ReproductionManager
+    )]
+    advisor = IndexAdvisor(db_manager, managers)
+    report = advisor.analyze()
+    if report is None:
+        raise SystemExit("No se pudo leer el esquema.")
+
+    print("Índices recomendados:")
+    for rec in report["missing"]:
+        print(f"  {advisor.statement_text(rec)};  -- {rec['reason']} "
+              f"(seq_tup_read={rec['seq_tup_read']}, sentencias={rec['statements']})")
+    for title, key in (("Sin uso", "unused"), ("Redundantes", "redundant"), ("Inflados", "bloated")):
+        print(f"{title}:")
+        for rec in report[key]:
+            print(f"  {advisor.statement_text(rec)};  -- {rec['reason']}")
+
+    if args.apply:
+        for rec in report["missing"]:
+            result = advisor.apply(rec)
+            status = "OK" if result["ok"] else f"FALLÓ ({result['error']})"
+            print(f"{status}: {advisor.statement_text(rec)}")
+            for leftover in result["dropped_invalid"]:
+                print(f"  Eliminado índice inválido: {leftover}")
+    db_manager.close()
+
+if __name__ == "__main__":
+    main()
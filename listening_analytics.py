@@ -0,0 +1,153 @@
+from datetime import datetime, time, timedelta
+
+import streamlit as st
+from psycopg2 import sql
+
+# Inactividad que separa dos sesiones de escucha del mismo usuario
+DEFAULT_SESSION_GAP = timedelta(minutes=30)
+# Si no se conoce la duración de la canción, un salto es pasar a otra antes de este intervalo
+DEFAULT_SKIP_GAP = timedelta(seconds=30)
+# Límite de la lectura ordenada de reproducciones del intervalo (más que el interactivo)
+COMPUTE_TIMEOUT_MS = 1800000
+# Tabla de agregados diarios (el feed de cambios le instala un trigger para invalidar el reporte)
+SESSIONS_TABLE = "sesion_diaria"
+
+SCHEMA_STATEMENT = """
+CREATE TABLE IF NOT EXISTS sesion_diaria (
+    fecha DATE PRIMARY KEY,
+    sesiones INT NOT NULL,
+    usuarios INT NOT NULL,
+    reproducciones BIGINT NOT NULL,
+    duracion_total_seg BIGINT NOT NULL,
+    saltos BIGINT NOT NULL,
+    cambios_dispositivo BIGINT NOT NULL,
+    actualizado TIMESTAMP NOT NULL DEFAULT now()
+)
+"""
+
+def iter_sessions(rows, gap=DEFAULT_SESSION_GAP):
+    """
+    Agrupa reproducciones en sesiones en una sola pasada.
+    :param rows: Iterable de filas (id_usuario, id_cancion, fecha_reproduccion, ...) ordenadas
+                 por id_usuario y fecha_reproduccion.
+    :param gap: Inactividad máxima entre dos reproducciones de la misma sesión.
+    :return: Generador de listas de filas; solo la sesión en curso se mantiene en memoria.
+    """
+    session = []
+    for row in rows:
+        if session:
+            previous = session[-1]
+            if row[0] != previous[0] or row[2] is None or previous[2] is None or row[2] - previous[2] > gap:
+                yield session
+                session = []
+        session.append(row)
+    if session:
+        yield session
+
+def _seconds(duration):
+    """Segundos de una duración TIME de PostgreSQL (None si se desconoce)."""
+    if isinstance(duration, time):
+        return duration.hour * 3600 + duration.minute * 60 + duration.second
+    if isinstance(duration, timedelta):
+        return duration.total_seconds()
+    return None
+
+class ListeningAnalytics:
+    """
+    Clase para calcular métricas de sesiones de escucha (duración, canciones por sesión,
+    saltos y cambios de dispositivo) y guardarlas agregadas por día en sesion_diaria.
+    """
+    def __init__(self, db_manager, session_gap=DEFAULT_SESSION_GAP, skip_gap=DEFAULT_SKIP_GAP):
+        self.db_manager = db_manager
+        self.session_gap = session_gap
+        self.skip_gap = skip_gap
+
+    def ensure_schema(self):
+        """Crea la tabla de agregados diarios si no existe."""
+        self.db_manager.execute_query(sql.SQL(SCHEMA_STATEMENT))
+
+    def _iter_plays(self, start_date, end_date, stats):
+        """
+        Reproducciones del intervalo [start_date, end_date) en orden (id_usuario, fecha_reproduccion),
+        leídas por bloques con un cursor del servidor. stats["failed"] indica si la lectura se cortó.
+        """
+        query = sql.SQL("""
+            SELECT r.id_usuario, r.id_cancion, r.fecha_reproduccion, r.dispositivo, c.duracion
+            FROM reproduccion r
+            LEFT JOIN cancion c ON c.id_cancion = r.id_cancion
+            WHERE r.fecha_reproduccion >= %s AND r.fecha_reproduccion < %s
+            ORDER BY r.id_usuario, r.fecha_reproduccion
+        """)
+        start = datetime.combine(start_date, time.min)
+        end = datetime.combine(end_date, time.min)
+        for rows in self.db_manager.stream_query(query, (start, end), route="replica", max_chunk_size=50000,
+                                                 timeout_ms=COMPUTE_TIMEOUT_MS, stats=stats):
+            yield from rows
+
+    def _session_metrics(self, session):
+        """Métricas de una sesión: (duración en segundos, saltos, cambios de dispositivo)."""
+        skips = 0
+        device_switches = 0
+        for previous, current in zip(session, session[1:]):
+            listened = current[2] - previous[2]
+            song_seconds = _seconds(previous[4])
+            if song_seconds is not None:
+                if listened.total_seconds() < song_seconds:
+                    skips += 1
+            elif listened < self.skip_gap:
+                skips += 1
+            if previous[3] != current[3]:
+                device_switches += 1
+        last_song_seconds = _seconds(session[-1][4]) or 0
+        duration = (session[-1][2] - session[0][2]).total_seconds() + last_song_seconds
+        return duration, skips, device_switches
+
+    def compute(self, start_date, end_date, session_gap=None):
+        """
+        Sesioniza las reproducciones de [start_date, end_date) en una sola pasada y reemplaza los
+        agregados de esos días. La memoria usada depende de la sesión en curso y del número de días,
+        no del número de reproducciones. Las sesiones se asignan al día en que empiezan; las que cruzan
+        los límites del intervalo quedan cortadas. Si la lectura falla no se modifican los agregados.
+        :param session_gap: Inactividad que separa sesiones (por defecto la de la instancia).
+        :return: Número de días guardados, o None si falló.
+        """
+        session_gap = session_gap or self.session_gap
+        self.ensure_schema()
+        daily = {} # {fecha: [sesiones, usuarios, reproducciones, duracion, saltos, cambios]}
+        last_user_by_day = {} # Las sesiones llegan agrupadas por usuario: basta recordar el último
+        stats = {}
+        for session in iter_sessions(self._iter_plays(start_date, end_date, stats), session_gap):
+            if session[0][2] is None:
+                continue # Reproducción sin fecha: no pertenece a ningún día
+            day = session[0][2].date()
+            duration, skips, device_switches = self._session_metrics(session)
+            totals = daily.setdefault(day, [0, 0, 0, 0, 0, 0])
+            totals[0] += 1
+            if last_user_by_day.get(day) != session[0][0]:
+                totals[1] += 1
+                last_user_by_day[day] = session[0][0]
+            totals[2] += len(session)
+            totals[3] += int(duration)
+            totals[4] += skips
+            totals[5] += device_switches
+        if stats.get("failed", True):
+            st.error("No se pudieron leer todas las reproducciones del intervalo; las sesiones diarias no se modificaron.")
+            return None
+
+        days = sorted(daily)
+        columns = list(zip(*(daily[day] for day in days))) if days else [[]] * 6
+        try:
+            with self.db_manager.transaction() as tx:
+                tx.execute_query(sql.SQL("DELETE FROM sesion_diaria WHERE fecha >= %s AND fecha < %s"),
+                                 (start_date, end_date))
+                if days:
+                    tx.execute_query(sql.SQL("""
+                        INSERT INTO sesion_diaria (fecha, sesiones, usuarios, reproducciones,
+                                                   duracion_total_seg, saltos, cambios_dispositivo)
+                        SELECT * FROM unnest(%s::date[], %s::int[], %s::int[], %s::bigint[],
+                                             %s::bigint[], %s::bigint[], %s::bigint[])
+                    """), (days, *[list(column) for column in columns]))
+        except Exception as e:
+            st.error(f"No se pudieron guardar las sesiones diarias: {e}")
+            return None
+        return len(days)
@@ -0,0 +1,236 @@
+import argparse
+import random
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+
+from psycopg2 import sql
+
+from db_manager import DBManager
+from manager_factory import CRUD_MANAGER_KEYS, build_managers
+
+# Peso relativo de cada flujo de usuario en la mezcla de operaciones
+DEFAULT_MIX = {"browse": 6, "filter": 2, "write": 1, "report": 1}
+# Intervalo de muestreo de pg_stat_activity
+ACTIVITY_SAMPLE_S = 0.5
+# Filas de cada reporte en la prueba (el límite por defecto es para uso interactivo)
+REPORT_MAX_ROWS = 1000
+
+class _Rollback(Exception):
+    """Revierte la transacción de escritura de la prueba sin dejar datos."""
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+class LoadTest:
+    """
+    Simula sesiones concurrentes de la aplicación llamando a la capa de managers igual que
+    render_crud_tab y la pestaña de reportes (sin interfaz): cada sesión empieza con un login y
+    después navega páginas, filtra, crea/actualiza/elimina y genera reportes. Todas las sesiones comparten un DBManager,
+    como en la aplicación, donde está en caché de recursos. Los managers se construyen con
+    build_managers(), como en la aplicación (introspección, listeners y feed de cambios).
+    """
+    def __init__(self, db_manager, mix=None, schema_introspection=True, change_feed=False):
+        self.db_manager = db_manager
+        self.mix = mix or DEFAULT_MIX
+        wired = build_managers(db_manager, schema_introspection=schema_introspection, change_feed=change_feed)
+        self.managers = [wired[key] for key in CRUD_MANAGER_KEYS]
+        self.reproduction_manager = wired["reproduction_manager"]
+        self.report_generator = wired["report_generator"]
+        self.report_generator.max_rows = REPORT_MAX_ROWS
+        self.user_ids = self._sample_ids("usuario", "id_usuario")
+        self.song_ids = self._sample_ids("cancion", "id_cancion")
+
+    def _sample_ids(self, table_name, id_column):
+        rows = self.db_manager.execute_query(
+            sql.SQL("SELECT {} FROM {} LIMIT 1000").format(sql.Identifier(id_column), sql.Identifier(table_name)),
+            fetch_type='all'
+        )
+        return [row[0] for row in rows or []]
+
+    # --- Flujos de usuario ---
+    def login(self, rng):
+        """Iniciar sesión: como el formulario de login, abrir una conexión con las credenciales y comprobarla."""
+        connection = self.db_manager.new_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+        finally:
+            connection.close()
+
+    def browse(self, rng):
+        """Abrir una tabla y avanzar dos páginas."""
+        manager = rng.choice(self.managers)
+        pagination_info = {"offset": 0, "limit": 10, "current_page": 1, "total_records": 0}
+        for page_change in (0, 1, 1):
+            manager.load_data_logic(nullcontext(), pagination_info, nullcontext(), page_change=page_change,
+                                    resolve_relations=bool(manager.relations))
+
+    def filter(self, rng):
+        """Filtrar una columna de texto por una letra."""
+        manager = rng.choice([m for m in self.managers if "TEXT" in m.columns.values()])
+        column = rng.choice([col for col, col_type in manager.columns.items() if col_type == "TEXT"])
+        pagination_info = {"offset": 0, "limit": 10, "current_page": 1, "total_records": 0}
+        manager.load_data_logic(nullcontext(), pagination_info, nullcontext(),
+                                filter_column=column, filter_value=rng.choice("aeiou"))
+
+    def write(self, rng):
+        """
+        Crear, cargar, actualizar y eliminar una reproducción en una transacción que se revierte.
+        Los listeners de reproducciones solo se llaman tras el COMMIT, así que no la registran.
+        """
+        if not self.user_ids or not self.song_ids:
+            return
+        form_data = {
+            "id_usuario": rng.choice(self.user_ids),
+            "id_cancion": rng.choice(self.song_ids),
+            "fecha_reproduccion": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "dispositivo": "load-test",
+            "ubicacion": "load-test"
+        }
+        try:
+            with self.db_manager.transaction() as tx:
+                if not self.reproduction_manager.create_record_logic(form_data, transaction=tx):
+                    raise _Rollback()
+                new_id = str(tx.execute_query(sql.SQL("SELECT lastval()"), fetch_type='one')[0])
+                update_data = dict(form_data, **{"id_reproduccion": new_id, "dispositivo": "load-test-2"})
+                self.reproduction_manager.update_record_logic(update_data, transaction=tx)
+                self.reproduction_manager.delete_record_logic(new_id, transaction=tx)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def report(self, rng):
+        """Generar un reporte."""
+        rng.choice([
+            self.report_generator.generate_artist_counts,
+            self.report_generator.generate_most_played_by_country
+        ])(max_rows=REPORT_MAX_ROWS)
+
+    # --- Ejecución ---
+    def _session(self, seed, deadline, latencies, failures):
+        rng = random.Random(seed)
+        flows = list(self.mix)
+        weights = [self.mix[flow] for flow in flows]
+        flow = "login" # Cada sesión empieza autenticándose; después sigue la mezcla de flujos
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                getattr(self, flow)(rng)
+            except Exception as e: # Los managers informan con st.error; aquí solo quedan fallos inesperados
+                failures.append(f"{flow}: {e}")
+            latencies.setdefault(flow, []).append(time.perf_counter() - started)
+            flow = rng.choices(flows, weights)[0]
+
+    def _sample_activity(self, stop, samples):
+        """Cuenta las conexiones de esta base de datos en pg_stat_activity por estado."""
+        connection = self.db_manager.new_connection()
+        try:
+            with connection.cursor() as cursor:
+                while not stop.wait(ACTIVITY_SAMPLE_S):
+                    cursor.execute("""
+                        SELECT count(*), count(*) FILTER (WHERE state = 'active'),
+                               count(*) FILTER (WHERE wait_event_type = 'Lock')
+                        FROM pg_stat_activity
+                        WHERE datname = current_database() AND pid <> pg_backend_pid()
+                    """)
+                    samples.append(cursor.fetchone())
+        finally:
+            connection.close()
+
+    def run(self, sessions, duration_s):
+        """
+        Ejecuta `sessions` sesiones en paralelo durante duration_s segundos.
+        :return: Diccionario con operaciones, rendimiento, latencias por flujo, errores y conexiones.
+        """
+        self.db_manager.reset_stats()
+        latencies = [{} for _ in range(sessions)]
+        failures = []
+        samples = []
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample_activity, args=(stop, samples), daemon=True)
+        sampler.start()
+        deadline = time.monotonic() + duration_s
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self._session, args=(i, deadline, latencies[i], failures))
+                   for i in range(sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        sampler.join()
+
+        by_flow = {}
+        for session_latencies in latencies:
+            for flow, values in session_latencies.items():
+                by_flow.setdefault(flow, []).extend(values)
+        operations = sum(len(values) for values in by_flow.values())
+        return {
+            "sessions": sessions,
+            "operations": operations,
+            "throughput": operations / elapsed if elapsed else 0.0,
+            "latency": {
+                flow: {"p50": _percentile(values, 0.50), "p95": _percentile(values, 0.95),
+                       "p99": _percentile(values, 0.99), "count": len(values)}
+                for flow, values in by_flow.items()
+            },
+            "failures": failures,
+            "db": self.db_manager.stats(),
+            "connections_max": max((sample[0] for sample in samples), default=0),
+            "active_max": max((sample[1] for sample in samples), default=0),
+            "lock_waits_max": max((sample[2] for sample in samples), default=0)
+        }
+
+def _print_result(result):
+    db = result["db"]
+    print(f"\n=== {result['sessions']} sesiones: {result['operations']} operaciones, "
+          f"{result['throughput']:.1f} op/s ===")
+    for flow, latency in sorted(result["latency"].items()):
+        print(f"  {flow:<7} n={latency['count']:<6} p50={latency['p50'] * 1000:8.1f} ms  "
+              f"p95={latency['p95'] * 1000:8.1f} ms  p99={latency['p99'] * 1000:8.1f} ms")
+    print(f"  BD: {db['queries']} consultas, {db['streams']} streams, {db['errors']} errores, "
+          f"{db['retries']} reintentos, {db['query_time_s']:.1f} s en ejecución")
+    print(f"  Conexiones: máx {result['connections_max']}, activas máx {result['active_max']}, "
+          f"esperando bloqueos máx {result['lock_waits_max']}")
+    if result["failures"]:
+        print(f"  Fallos inesperados: {len(result['failures'])} (primero: {result['failures'][0]})")
+
+def main():
+    """Uso: python load_test.py --password ... --sessions 1,5,10,20 --duration 30"""
+    parser = argparse.ArgumentParser(description="Prueba de carga de la capa de managers.")
+    parser.add_argument("--dbname", default="streaming_db")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--sessions", default="1,5,10,20", help="Niveles de concurrencia separados por comas.")
+    parser.add_argument("--duration", type=float, default=30.0, help="Segundos por nivel.")
+    parser.add_argument("--mix", default=None,
+                        help="Pesos de los flujos, p. ej. browse=6,filter=2,write=1,report=1.")
+    parser.add_argument("--no-schema-introspection", action="store_true",
+                        help="Usar las columnas declaradas en lugar del esquema real.")
+    parser.add_argument("--change-feed", action="store_true",
+                        help="Instalar los triggers de notificación y usar el feed de cambios, como la aplicación con STREAMING_CHANGE_FEED=1.")
+    args = parser.parse_args()
+
+    mix = None
+    if args.mix:
+        mix = {flow: int(weight) for flow, weight in (item.split("=") for item in args.mix.split(","))}
+    db_manager = DBManager(args.dbname, args.user, args.password, args.host, args.port)
+    if not db_manager.connection and not db_manager.connect():
+        raise SystemExit("No se pudo conectar a la base de datos.")
+    load_test = LoadTest(db_manager, mix, schema_introspection=not args.no_schema_introspection,
+                         change_feed=args.change_feed)
+    for sessions in (int(level) for level in args.sessions.split(",")):
+        _print_result(load_test.run(sessions, args.duration))
+    db_manager.close()
+
+if __name__ == "__main__":
+    main()
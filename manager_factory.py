@@ -0,0 +1,74 @@
+from user_manager import UserManager
+from artist_manager import ArtistManager
+from album_manager import AlbumManager
+from song_manager import SongManager
+from playlist_manager import PlaylistManager
+from playlist_song_manager import PlaylistSongManager
+from reproduction_manager import ReproductionManager
+from report_generator import ReportGenerator
+from schema_inspector import SchemaInspector
+from recommendation_engine import RecommendationEngine
+from listening_analytics import ListeningAnalytics, SESSIONS_TABLE
+from play_sketches import PlayStatistics
+from index_advisor import IndexAdvisor
+from change_feed import ChangeFeed
+
+# Claves de build_managers() con los managers CRUD, en el orden de las pestañas
+CRUD_MANAGER_KEYS = (
+    "user_manager", "artist_manager", "album_manager", "song_manager",
+    "playlist_manager", "playlist_song_manager", "reproduction_manager"
+)
+
+def build_managers(db_manager, schema_introspection=True, change_feed=False):
+    """
+    Construye y conecta entre sí los managers sobre un DBManager ya conectado, igual para la
+    aplicación y la prueba de carga: listeners de reproducciones, introspección del esquema
+    y, si se pide, el feed de cambios.
+    :param schema_introspection: Ajustar columnas, claves y estrategias con el esquema real.
+    :param change_feed: Instalar los triggers de notificación y asignar el feed a los managers.
+    :return: Diccionario {nombre: instancia}; "change_feed" es None si no está activo.
+    """
+    managers = {
+        "db_manager": db_manager,
+        "user_manager": UserManager(db_manager),
+        "artist_manager": ArtistManager(db_manager),
+        "album_manager": AlbumManager(db_manager),
+        "song_manager": SongManager(db_manager),
+        "playlist_manager": PlaylistManager(db_manager),
+        "playlist_song_manager": PlaylistSongManager(db_manager),
+        "reproduction_manager": ReproductionManager(db_manager)
+    }
+    crud_managers = [managers[key] for key in CRUD_MANAGER_KEYS]
+    # Los resúmenes de playlist los escribe PlaylistSongManager y los lee PlaylistManager
+    managers["playlist_manager"].summary_manager = managers["playlist_song_manager"]
+
+    play_statistics = PlayStatistics(db_manager)
+    recommendation_engine = RecommendationEngine(db_manager)
+    managers["reproduction_manager"].add_play_listener(play_statistics.record_play)
+    managers["reproduction_manager"].add_play_listener(recommendation_engine.record_play)
+    managers["report_generator"] = ReportGenerator(db_manager, play_statistics=play_statistics)
+    managers["recommendation_engine"] = recommendation_engine
+    listening_analytics = ListeningAnalytics(db_manager)
+    managers["listening_analytics"] = listening_analytics
+    managers["index_advisor"] = IndexAdvisor(db_manager, crud_managers)
+
+    if schema_introspection:
+        schema_inspector = SchemaInspector(db_manager)
+        if schema_inspector.load():
+            for manager in crud_managers:
+                manager.apply_schema(schema_inspector)
+
+    feed = None
+    if change_feed:
+        feed = ChangeFeed(db_manager)
+        # sesion_diaria la reescribe ListeningAnalytics.compute: su trigger mueve la versión del reporte
+        listening_analytics.ensure_schema()
+        if feed.install([manager.table_name for manager in crud_managers] + [SESSIONS_TABLE]):
+            feed.start()
+            for manager in crud_managers:
+                manager.change_feed = feed
+            managers["report_generator"].change_feed = feed
+        else:
+            feed = None
+    managers["change_feed"] = feed
+    return managers
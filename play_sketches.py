@@ -0,0 +1,312 @@
+import hashlib
+import threading
+from datetime import date, datetime, time, timedelta
+
+import numpy as np
+from psycopg2 import sql
+
+# Límite de la lectura de reproducciones al reconstruir los sketches (más que el interactivo)
+WARM_UP_TIMEOUT_MS = 1800000
+
+def _hash64(value, salt=b""):
+    """Hash estable de 64 bits (no depende de PYTHONHASHSEED, así los sketches se pueden combinar)."""
+    digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8, salt=salt.ljust(16, b"\0")[:16])
+    return int.from_bytes(digest.digest(), "big")
+
+class HyperLogLog:
+    """
+    Estimador de cardinalidad (valores distintos) con 2^p registros de un byte.
+    Error relativo típico: 1.04 / sqrt(2^p) (≈3 % con p=10). Dos sketches se combinan
+    con el máximo registro a registro, así que se pueden unir días en ventanas arbitrarias.
+    Mientras pocos registros son distintos de cero (la mayoría de pares canción-día) se guardan
+    en un diccionario {registro: rango}; el array denso se crea al superar sparse_limit.
+    """
+    def __init__(self, p=10):
+        self.p = p
+        self.sparse = {} # {registro: rango} mientras la representación es dispersa
+        self.registers = None # Array denso de 2^p bytes (None mientras es dispersa)
+        self.sparse_limit = max(8, (1 << p) // 64)
+
+    def _densify(self):
+        if self.registers is None:
+            self.registers = np.zeros(1 << self.p, dtype=np.uint8)
+            for index, rank in self.sparse.items():
+                self.registers[index] = rank
+            self.sparse = {}
+
+    def _update(self, index, rank):
+        if self.registers is not None:
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+        elif rank > self.sparse.get(index, 0):
+            self.sparse[index] = rank
+            if len(self.sparse) > self.sparse_limit:
+                self._densify()
+
+    def add(self, value):
+        h = _hash64(value)
+        index = h >> (64 - self.p)
+        remainder = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - remainder.bit_length() + 1 # Posición del primer bit a 1
+        self._update(index, rank)
+
+    def merge(self, other):
+        """Une otro sketch (mismo p) en este."""
+        if other.registers is None:
+            for index, rank in other.sparse.items():
+                self._update(index, rank)
+        else:
+            self._densify()
+            np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = 1 << self.p
+        alpha = 0.7213 / (1 + 1.079 / m)
+        if self.registers is None:
+            ranks = np.fromiter(self.sparse.values(), dtype=np.float64, count=len(self.sparse))
+            zeros = m - len(self.sparse)
+            harmonic = zeros + np.sum(np.power(2.0, -ranks)) # Cada registro a cero aporta 2^0
+        else:
+            zeros = int(np.count_nonzero(self.registers == 0))
+            harmonic = np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        estimate = alpha * m * m / harmonic
+        if estimate <= 2.5 * m and zeros: # Corrección para cardinalidades pequeñas (linear counting)
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+class CountMinSketch:
+    """
+    Frecuencias aproximadas en memoria fija (depth x width contadores). Nunca subestima;
+    la sobreestimación está acotada por e/width * total con probabilidad 1 - e^-depth.
+    Se combinan sumando las tablas.
+    """
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self._salts = [f"cms{row}".encode("utf-8") for row in range(depth)]
+
+    def _columns(self, key):
+        return [_hash64(key, salt) % self.width for salt in self._salts]
+
+    def add(self, key, count=1):
+        for row, column in enumerate(self._columns(key)):
+            self.table[row, column] += count
+
+    def estimate(self, key):
+        return int(min(self.table[row, column] for row, column in enumerate(self._columns(key))))
+
+    def merge(self, other):
+        self.table += other.table
+        return self
+
+class SpaceSaving:
+    """
+    Elementos más frecuentes (heavy hitters) con k contadores. Todo elemento con frecuencia
+    mayor que total/k está garantizado en la lista; cada conteo sobreestima como mucho su error.
+    """
+    def __init__(self, k=200):
+        self.k = k
+        self.counts = {} # {elemento: conteo}
+        self.errors = {} # {elemento: sobreestimación máxima}
+
+    def add(self, key, count=1):
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.k:
+            self.counts[key] = count
+            self.errors[key] = 0
+        else: # Reemplazar al mínimo heredando su conteo como error
+            evicted = min(self.counts, key=self.counts.get)
+            floor = self.counts.pop(evicted)
+            self.errors.pop(evicted)
+            self.counts[key] = floor + count
+            self.errors[key] = floor
+
+    def _floor(self):
+        """Cota del conteo de cualquier elemento no monitorizado: el mínimo si está lleno, 0 si no."""
+        return min(self.counts.values()) if len(self.counts) >= self.k else 0
+
+    def merge(self, other):
+        """
+        Combina otro resumen sumando conteos y conservando los k mayores. A un elemento ausente
+        en uno de los dos se le suma el mínimo de ese resumen (su frecuencia allí puede llegar
+        hasta ese valor), también como error, para que los conteos sigan sin subestimar.
+        """
+        own_floor, other_floor = self._floor(), other._floor()
+        for key in set(self.counts) | set(other.counts):
+            count = self.counts.get(key, own_floor) + other.counts.get(key, other_floor)
+            error = self.errors.get(key, own_floor) + other.errors.get(key, other_floor)
+            self.counts[key] = count
+            self.errors[key] = error
+        if len(self.counts) > self.k:
+            kept = sorted(self.counts, key=self.counts.get, reverse=True)[:self.k]
+            self.counts = {key: self.counts[key] for key in kept}
+            self.errors = {key: self.errors[key] for key in kept}
+        return self
+
+    def top(self, n):
+        """Lista de (elemento, conteo_estimado, error_maximo) de mayor a menor."""
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+        return [(key, count, self.errors[key]) for key, count in ranked]
+
+class PlayStatistics:
+    """
+    Clase para mantener estadísticas aproximadas de reproducciones por día:
+    oyentes únicos por canción y por país (HyperLogLog), conteo por canción (Count-Min)
+    y canciones más escuchadas (Space-Saving). Se actualiza con cada reproducción
+    ingerida y responde consultas sobre cualquier ventana de días combinando los sketches.
+    Los sketches viven en memoria: los días que no se han cargado desde reproduccion
+    (warmed_days) solo tienen lo ingerido en vivo, y ensure_window los carga antes de consultar.
+    """
+    def __init__(self, db_manager, hll_precision=10, top_k=200, retention_days=90):
+        self.db_manager = db_manager
+        self.hll_precision = hll_precision
+        self.top_k = top_k
+        self.retention_days = retention_days
+        self.listeners = {} # {(dimension, clave, dia): HyperLogLog} con dimension "cancion" o "pais"
+        self.play_counts = {} # {dia: CountMinSketch}
+        self.heavy_hitters = {} # {dia: SpaceSaving}
+        self.warmed_days = set() # Días cargados por completo desde reproduccion
+        self._user_country = {} # Caché id_usuario -> pais
+        self._lock = threading.Lock()
+
+    def _country(self, id_usuario):
+        """País del usuario (consultado una sola vez por usuario)."""
+        if id_usuario not in self._user_country:
+            result = self.db_manager.execute_query(
+                sql.SQL("SELECT pais FROM usuario WHERE id_usuario = %s"), (id_usuario,),
+                fetch_type='one', route="replica"
+            )
+            self._user_country[id_usuario] = result[0] if result else None
+        return self._user_country[id_usuario]
+
+    def _add_to(self, sketches, id_usuario, id_cancion, played_at, country):
+        """Actualiza los sketches (listeners, play_counts, heavy_hitters) del día de la reproducción."""
+        listeners, play_counts, heavy_hitters = sketches
+        day = played_at.date()
+        for key in (("cancion", id_cancion, day), ("pais", country, day)):
+            if key[1] is None:
+                continue
+            sketch = listeners.get(key)
+            if sketch is None:
+                sketch = listeners[key] = HyperLogLog(self.hll_precision)
+            sketch.add(id_usuario)
+        play_counts.setdefault(day, CountMinSketch()).add(id_cancion)
+        heavy_hitters.setdefault(day, SpaceSaving(self.top_k)).add(id_cancion)
+
+    def _add(self, id_usuario, id_cancion, played_at, country):
+        with self._lock:
+            self._add_to((self.listeners, self.play_counts, self.heavy_hitters),
+                         id_usuario, id_cancion, played_at, country)
+
+    def record_play(self, play):
+        """
+        Ingiere una reproducción (diccionario con id_usuario, id_cancion y fecha_reproduccion).
+        Pensado para registrarse con ReproductionManager.add_play_listener.
+        """
+        played_at = play.get("fecha_reproduccion")
+        if play.get("id_usuario") is None or play.get("id_cancion") is None or not isinstance(played_at, datetime):
+            return
+        self._add(play["id_usuario"], play["id_cancion"], played_at, self._country(play["id_usuario"]))
+
+    def warm_up(self, start_date, end_date):
+        """
+        Reconstruye los sketches de [start_date, end_date) recorriendo reproduccion una vez
+        con un cursor del servidor. Los sketches nuevos se construyen aparte y solo reemplazan
+        a los de esos días si la lectura se completó.
+        :return: Número de reproducciones procesadas, o None si la lectura falló (sin cambios).
+        """
+        query = sql.SQL("""
+            SELECT r.id_usuario, r.id_cancion, r.fecha_reproduccion, u.pais
+            FROM reproduccion r
+            LEFT JOIN usuario u ON u.id_usuario = r.id_usuario
+            WHERE r.fecha_reproduccion >= %s AND r.fecha_reproduccion < %s
+        """)
+        start = datetime.combine(start_date, time.min)
+        end = datetime.combine(end_date, time.min)
+        sketches = ({}, {}, {})
+        stats = {}
+        processed = 0
+        for rows in self.db_manager.stream_query(query, (start, end), route="replica", max_chunk_size=50000,
+                                                 timeout_ms=WARM_UP_TIMEOUT_MS, stats=stats):
+            for id_usuario, id_cancion, played_at, country in rows:
+                if played_at is not None:
+                    self._add_to(sketches, id_usuario, id_cancion, played_at, country)
+            processed += len(rows)
+        if stats.get("failed", True):
+            return None
+        with self._lock: # Reemplazar los días del intervalo (lo ingerido en vivo ya está en la lectura)
+            self._drop_days(lambda day: start_date <= day < end_date)
+            self.listeners.update(sketches[0])
+            self.play_counts.update(sketches[1])
+            self.heavy_hitters.update(sketches[2])
+            self.warmed_days.update(self._days(start_date, end_date))
+        self.expire()
+        return processed
+
+    def missing_days(self, start_date, end_date):
+        """Días de [start_date, end_date), dentro de la retención y hasta hoy, aún no cargados desde la BD."""
+        oldest = date.today() - timedelta(days=self.retention_days)
+        with self._lock:
+            return [day for day in self._days(max(start_date, oldest), min(end_date, date.today() + timedelta(days=1)))
+                    if day not in self.warmed_days]
+
+    def ensure_window(self, start_date, end_date):
+        """
+        Carga los días de la ventana que falten (p. ej. tras limpiarse la caché de recursos, que
+        descarta los sketches) para que las consultas no se queden por debajo del real.
+        :return: True si toda la ventana (dentro de la retención) está cubierta.
+        """
+        missing = self.missing_days(start_date, end_date)
+        if not missing:
+            return True
+        return self.warm_up(min(missing), max(missing) + timedelta(days=1)) is not None
+
+    def covered_window(self):
+        """Primer y último día cargados desde la BD, o None si no se ha cargado ninguno."""
+        with self._lock:
+            return (min(self.warmed_days), max(self.warmed_days)) if self.warmed_days else None
+
+    def _drop_days(self, predicate):
+        self.listeners = {key: sketch for key, sketch in self.listeners.items() if not predicate(key[2])}
+        self.play_counts = {day: sketch for day, sketch in self.play_counts.items() if not predicate(day)}
+        self.heavy_hitters = {day: sketch for day, sketch in self.heavy_hitters.items() if not predicate(day)}
+        self.warmed_days = {day for day in self.warmed_days if not predicate(day)}
+
+    def expire(self):
+        """Elimina los sketches de días fuera del periodo de retención."""
+        oldest = date.today() - timedelta(days=self.retention_days)
+        with self._lock:
+            self._drop_days(lambda day: day < oldest)
+
+    def _days(self, start_date, end_date):
+        return [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days)]
+
+    def unique_listeners(self, dimension, key, start_date, end_date):
+        """
+        Oyentes únicos aproximados de una canción ("cancion") o un país ("pais") en [start_date, end_date).
+        """
+        merged = HyperLogLog(self.hll_precision)
+        with self._lock:
+            for day in self._days(start_date, end_date):
+                sketch = self.listeners.get((dimension, key, day))
+                if sketch is not None:
+                    merged.merge(sketch)
+        return merged.count()
+
+    def play_count(self, id_cancion, start_date, end_date):
+        """Reproducciones aproximadas de una canción en [start_date, end_date) (nunca por debajo del real)."""
+        with self._lock:
+            return sum(self.play_counts[day].estimate(id_cancion)
+                       for day in self._days(start_date, end_date) if day in self.play_counts)
+
+    def top_songs(self, n, start_date, end_date):
+        """Canciones más reproducidas en [start_date, end_date): lista de (id_cancion, conteo, error_maximo)."""
+        merged = SpaceSaving(self.top_k)
+        with self._lock:
+            for day in self._days(start_date, end_date):
+                if day in self.heavy_hitters:
+                    merged.merge(self.heavy_hitters[day])
+        return merged.top(n)
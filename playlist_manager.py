@@ -1,3 +1,5 @@
+from psycopg2 import sql
+
 from base_manager import BaseManager
 
 class PlaylistManager(BaseManager):
@@ -11,5 +13,54 @@ class PlaylistManager(BaseManager):
             "descripcion": "TEXT",
             "id_usuario": "INT"
         }
-        super().__init__(db_manager, "playlist", columns, "id_playlist")
+        relations = {
+            "id_usuario": ("usuario", "nombre", "nombre_usuario")
+        }
+        super().__init__(db_manager, "playlist", columns, "id_playlist", relations=relations)
+        # PlaylistSongManager que escribe playlist_resumen: sus escrituras también llevan
+        # las lecturas de resúmenes al primario (se asigna en build_managers)
+        self.summary_manager = None
+
+    def _summary_route(self):
+        """Destino de las lecturas de playlist_resumen (read-your-writes también tras añadir canciones)."""
+        related = (self.summary_manager,) if self.summary_manager is not None else ()
+        return self._read_route(*related)
+
+    def playlist_summaries(self, id_usuario=None, after_id=None, limit=50):
+        """
+        Playlists con su número de canciones, duración total y última modificación, leídos de
+        playlist_resumen (mantenido por PlaylistSongManager) sin recorrer playlist_cancion.
+        Paginado por clave sobre id_playlist.
+        :param id_usuario: Solo las playlists de este usuario (None = todas).
+        :param after_id: Último id_playlist de la página anterior (None = primera página).
+        :return: Lista de (id_playlist, nombre_playlist, canciones, duracion_total_seg, modificado) o None.
+        """
+        conditions = []
+        params = []
+        if id_usuario is not None:
+            conditions.append(sql.SQL("p.id_usuario = %s"))
+            params.append(id_usuario)
+        if after_id is not None:
+            conditions.append(sql.SQL("p.id_playlist > %s"))
+            params.append(after_id)
+        where_clause = sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
+        params.append(limit)
+        return self.db_manager.execute_query(sql.SQL("""
+            SELECT p.id_playlist, p.nombre_playlist, COALESCE(r.canciones, 0),
+                   COALESCE(r.duracion_total_seg, 0), r.modificado
+            FROM playlist p
+            LEFT JOIN playlist_resumen r ON r.id_playlist = p.id_playlist{}
+            ORDER BY p.id_playlist
+            LIMIT %s
+        """).format(where_clause), tuple(params), fetch_type='all', route=self._summary_route())
 
+    def playlist_summary(self, id_playlist):
+        """
+        Resumen de una playlist: (nombre_playlist, canciones, duracion_total_seg, modificado) o None.
+        """
+        return self.db_manager.execute_query(sql.SQL("""
+            SELECT p.nombre_playlist, COALESCE(r.canciones, 0), COALESCE(r.duracion_total_seg, 0), r.modificado
+            FROM playlist p
+            LEFT JOIN playlist_resumen r ON r.id_playlist = p.id_playlist
+            WHERE p.id_playlist = %s
+        """), (id_playlist,), fetch_type='one', route=self._summary_route())
@@ -1,6 +1,54 @@
+import psycopg2
+import streamlit as st
+from psycopg2 import sql
+
 from base_manager import BaseManager
 
+# Resumen por playlist mantenido con cada escritura en playlist_cancion. El índice
+# (id_playlist, orden, id_cancion) para leer las canciones en orden lo recomienda
+# IndexAdvisor, que lo crea con CONCURRENTLY fuera de la interfaz
+SUMMARY_SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS playlist_resumen (
+        id_playlist INT PRIMARY KEY REFERENCES playlist (id_playlist) ON DELETE CASCADE,
+        canciones INT NOT NULL,
+        duracion_total_seg BIGINT NOT NULL,
+        modificado TIMESTAMP NOT NULL DEFAULT now()
+    )
+    """,
+]
+
+# Suma una canción al resumen (o crea el resumen si es la primera)
+SUMMARY_ADD_QUERY = """
+INSERT INTO playlist_resumen (id_playlist, canciones, duracion_total_seg, modificado)
+SELECT %s, 1, COALESCE(EXTRACT(EPOCH FROM c.duracion), 0)::bigint, now()
+FROM (SELECT 1) AS uno
+LEFT JOIN cancion c ON c.id_cancion = %s
+ON CONFLICT (id_playlist) DO UPDATE SET
+    canciones = playlist_resumen.canciones + EXCLUDED.canciones,
+    duracion_total_seg = playlist_resumen.duracion_total_seg + EXCLUDED.duracion_total_seg,
+    modificado = EXCLUDED.modificado
+"""
+
+# Recalcula el resumen de una playlist (recorre solo sus filas por el índice)
+SUMMARY_REFRESH_QUERY = """
+INSERT INTO playlist_resumen (id_playlist, canciones, duracion_total_seg, modificado)
+SELECT %s, COUNT(pc.id_cancion), COALESCE(SUM(EXTRACT(EPOCH FROM c.duracion)), 0)::bigint, now()
+FROM playlist_cancion pc
+LEFT JOIN cancion c ON c.id_cancion = pc.id_cancion
+WHERE pc.id_playlist = %s
+ON CONFLICT (id_playlist) DO UPDATE SET
+    canciones = EXCLUDED.canciones,
+    duracion_total_seg = EXCLUDED.duracion_total_seg,
+    modificado = EXCLUDED.modificado
+"""
+
 class PlaylistSongManager(BaseManager):
+    """
+    Gestiona las operaciones CRUD para la tabla 'playlist_cancion' y mantiene, en la misma
+    transacción que cada escritura, el resumen por playlist (canciones y duración total)
+    en playlist_resumen.
+    """
     def __init__(self, db_manager):
         # Definición de columnas de la tabla playlist_cancion
         # Asegúrate de que estas columnas coincidan con tu esquema de base de datos
@@ -9,6 +57,126 @@ class PlaylistSongManager(BaseManager):
             "id_cancion": "INT",
             "orden": "INT"
         }
+        relations = {
+            "id_playlist": ("playlist", "nombre_playlist", "nombre_playlist"),
+            "id_cancion": ("cancion", "titulo_cancion", "titulo_cancion")
+        }
         # ¡IMPORTANTE! Hemos cambiado "playlist_song" a "playlist_cancion" aquí
-        super().__init__(db_manager, "playlist_cancion", columns, "id_playlist")
+        super().__init__(db_manager, "playlist_cancion", columns, "id_playlist", relations=relations)
+        # Clave compuesta: una fila por canción en cada playlist (apply_schema la confirma con el esquema)
+        self.key_columns = ["id_playlist", "id_cancion"]
+        self._summary_ready = None
+
+    def ensure_summary_schema(self):
+        """
+        Crea la tabla de resúmenes si no existe; si la tabla es nueva la llena con un único recorrido de playlist_cancion. Solo consulta la BD la primera vez.
+        """
+        if self._summary_ready:
+            return
+        exists = self.db_manager.execute_query(
+            sql.SQL("SELECT to_regclass('playlist_resumen') IS NOT NULL"), fetch_type='one'
+        )
+        if exists is None:
+            return # Sin conexión: se reintentará en la siguiente llamada
+        for statement in SUMMARY_SCHEMA_STATEMENTS:
+            self.db_manager.execute_query(sql.SQL(statement))
+        if not exists[0]:
+            self.rebuild_summaries()
+        self._summary_ready = True
+
+    def rebuild_summaries(self):
+        """
+        Recalcula todos los resúmenes (p. ej. tras cambiar la duración de canciones, que no
+        actualiza los resúmenes). Usa una sola agregación sobre playlist_cancion.
+        :return: True si se completó.
+        """
+        try:
+            with self.db_manager.transaction() as tx:
+                tx.execute_query(sql.SQL("DELETE FROM playlist_resumen"))
+                tx.execute_query(sql.SQL("""
+                    INSERT INTO playlist_resumen (id_playlist, canciones, duracion_total_seg, modificado)
+                    SELECT pc.id_playlist, COUNT(*), COALESCE(SUM(EXTRACT(EPOCH FROM c.duracion)), 0)::bigint, now()
+                    FROM playlist_cancion pc
+                    JOIN playlist p ON p.id_playlist = pc.id_playlist
+                    LEFT JOIN cancion c ON c.id_cancion = pc.id_cancion
+                    GROUP BY pc.id_playlist
+                """))
+        except psycopg2.Error:
+            return False # El error ya se mostró
+        self._mark_write() # Las lecturas de resúmenes siguientes van al primario
+        return True
+
+    def _write_with_summary(self, write, transaction, success_message):
+        """
+        Ejecuta write(tx) y la actualización del resumen en una misma transacción
+        (o en un savepoint de la transacción recibida): o se aplican ambas o ninguna.
+        """
+        self.ensure_summary_schema()
+        try:
+            with (transaction.savepoint() if transaction else self.db_manager.transaction()) as tx:
+                if not write(tx):
+                    raise ValueError("Escritura no realizada.")
+        except (ValueError, psycopg2.Error):
+            return False # El motivo ya se mostró
+        if transaction is None:
+            st.success(success_message)
+        return True
+
+    def _after_create(self, record_id, record, transaction):
+        """
+        Suma la canción nueva al resumen de su playlist (dentro de la transacción del INSERT).
+        record_id es el id_playlist devuelto por el INSERT.
+        """
+        transaction.execute_query(sql.SQL(SUMMARY_ADD_QUERY), (record_id, record.get("id_cancion")))
+
+    def _refresh_summary(self, transaction, record_key):
+        """Recalcula el resumen de la playlist del registro indicado (por su clave)."""
+        id_playlist = dict(zip(self.key_columns, self._parse_key(record_key)))["id_playlist"]
+        transaction.execute_query(sql.SQL(SUMMARY_REFRESH_QUERY), (id_playlist, id_playlist))
+
+    def create_record_logic(self, form_data, transaction=None):
+        return self._write_with_summary(
+            lambda tx: super(PlaylistSongManager, self).create_record_logic(form_data, transaction=tx),
+            transaction, f"Registro de {self.table_name} creado correctamente."
+        )
+
+    def update_record_logic(self, form_data, transaction=None, check_version=True):
+        def write(tx):
+            if not super(PlaylistSongManager, self).update_record_logic(form_data, transaction=tx,
+                                                                        check_version=check_version):
+                return False
+            self._refresh_summary(tx, {col_name: form_data.get(col_name) for col_name in self.key_columns})
+            return True
+        return self._write_with_summary(write, transaction, f"Registro de {self.table_name} actualizado correctamente.")
+
+    def delete_record_logic(self, record_key, transaction=None):
+        def write(tx):
+            if not super(PlaylistSongManager, self).delete_record_logic(record_key, transaction=tx):
+                return False
+            self._refresh_summary(tx, record_key)
+            return True
+        return self._write_with_summary(write, transaction, f"Registro de {self.table_name} eliminado correctamente.")
 
+    def playlist_songs(self, id_playlist, after=None, limit=50):
+        """
+        Canciones de una playlist en orden, con título y artista, paginadas por clave
+        (orden, id_cancion) sobre el índice (id_playlist, orden, id_cancion).
+        :param after: Tupla (orden, id_cancion) de la última fila de la página anterior (None = primera).
+        :return: Lista de (orden, id_cancion, titulo_cancion, nombre_artista, duracion) o None si falló.
+        """
+        self.ensure_summary_schema()
+        keyset = sql.SQL("")
+        params = [id_playlist]
+        if after is not None:
+            keyset = sql.SQL(" AND (pc.orden, pc.id_cancion) > (%s, %s)")
+            params.extend(after)
+        params.append(limit)
+        return self.db_manager.execute_query(sql.SQL("""
+            SELECT pc.orden, pc.id_cancion, c.titulo_cancion, a.nombre_artista, c.duracion
+            FROM playlist_cancion pc
+            LEFT JOIN cancion c ON c.id_cancion = pc.id_cancion
+            LEFT JOIN artista a ON a.id_artista = c.id_artista
+            WHERE pc.id_playlist = %s{}
+            ORDER BY pc.orden, pc.id_cancion
+            LIMIT %s
+        """).format(keyset), tuple(params), fetch_type='all', route=self._read_route())
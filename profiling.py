@@ -0,0 +1,167 @@
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import pandas as pd
+import streamlit as st
+
+# Perfilado activado para todas las sesiones (además del interruptor de la barra lateral)
+PROFILING_ENV = os.environ.get("STREAMING_PROFILING", "0") == "1"
+# Funciones mostradas del perfil de cProfile (ordenadas por tiempo acumulado)
+PROFILE_TOP_FUNCTIONS = 30
+# Ancho en caracteres de las barras de la cascada
+WATERFALL_WIDTH = 40
+
+# Una línea por rerun perfilado en la consola del servidor
+logger = logging.getLogger("streaming.profiling")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s [perfil] %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Ejecución en curso del hilo/contexto actual (cada rerun de Streamlit corre en su propio hilo)
+_current_run = ContextVar("profiling_run", default=None)
+
+class ProfileRun:
+    """
+    Fases medidas durante un rerun: (nombre, inicio en s desde el comienzo, duración en s, nivel).
+    Opcionalmente guarda la traza de cProfile o pyinstrument del rerun completo.
+    """
+    def __init__(self, label, profiler=None):
+        self.label = label
+        self.started = time.perf_counter()
+        self.phases = []
+        self.depth = 0
+        self.total_s = None
+        self.trace = None
+        self._profiler_name = profiler
+        self._profiler = None
+
+    def start_profiler(self):
+        if self._profiler_name == "cProfile":
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError: # Otro perfilador activo (p. ej. otra sesión perfilando a la vez)
+                self._profiler = None
+                st.warning("Ya hay otro perfilador activo; se continúa sin traza.")
+        elif self._profiler_name == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                st.warning("pyinstrument no está instalado; se continúa sin traza.")
+                return
+            self._profiler = Profiler()
+            self._profiler.start()
+
+    def stop_profiler(self):
+        if self._profiler is None:
+            return
+        if self._profiler_name == "cProfile":
+            self._profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(self._profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+            self.trace = output.getvalue()
+        else:
+            self._profiler.stop()
+            self.trace = self._profiler.output_text(unicode=True)
+        self._profiler = None
+
+    def as_log_line(self):
+        phases = ", ".join(f"{'  ' * depth}{name}={duration * 1000:.1f}ms" for name, _, duration, depth in self.phases)
+        return f"{self.label}: total={self.total_s * 1000:.1f}ms [{phases}]"
+
+def is_enabled():
+    """Si el perfilado está activo para esta sesión (variable de entorno o interruptor lateral)."""
+    return PROFILING_ENV or bool(st.session_state.get("profiling_enabled"))
+
+def start_run(label, profiler=None):
+    """
+    Comienza a medir un rerun si el perfilado está activo.
+    :param profiler: None, "cProfile" o "pyinstrument" para capturar además una traza completa.
+    """
+    if not is_enabled():
+        return None
+    run = ProfileRun(label, profiler)
+    _current_run.set(run)
+    run.start_profiler()
+    return run
+
+def finish_run():
+    """Termina la medición en curso, la registra en el log y la devuelve (None si no había)."""
+    run = _current_run.get()
+    if run is None:
+        return None
+    _current_run.set(None)
+    run.stop_profiler()
+    run.total_s = time.perf_counter() - run.started
+    logger.info(run.as_log_line())
+    return run
+
+@contextmanager
+def phase(name):
+    """Mide el bloque como una fase del rerun en curso (sin coste si no se está perfilando)."""
+    run = _current_run.get()
+    if run is None:
+        yield
+        return
+    start = time.perf_counter()
+    entry = [name, start - run.started, 0.0, run.depth]
+    run.phases.append(entry)
+    run.depth += 1
+    try:
+        yield
+    finally:
+        run.depth -= 1
+        entry[2] = time.perf_counter() - start
+
+@contextmanager
+def fragment_run(label):
+    """
+    Para fragmentos: dentro de un rerun completo sus fases se anidan en él; si el fragmento se
+    re-ejecuta solo, se mide como una ejecución propia que se registra y se muestra al final del
+    propio fragmento (el resto de la página no se vuelve a dibujar en ese rerun).
+    """
+    if _current_run.get() is not None or not is_enabled():
+        with phase(label):
+            yield
+        return
+    start_run(f"fragmento {label}")
+    try:
+        yield
+    finally:
+        run = finish_run()
+    render_waterfall(run)
+
+def profiled(label):
+    """Decorador para fragmentos: mide cada ejecución de la función con fragment_run(label)."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with fragment_run(label):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def render_waterfall(run):
+    """Muestra la cascada de fases de un rerun (y la traza, si se capturó)."""
+    if run is None:
+        return
+    with st.expander(f"⏱️ Perfil: {run.label} — {run.total_s * 1000:.1f} ms", expanded=False):
+        scale = WATERFALL_WIDTH / run.total_s if run.total_s else 0
+        rows = []
+        for name, offset, duration, depth in run.phases:
+            bar = " " * int(offset * scale) + "█" * max(1, int(duration * scale))
+            rows.append(("  " * depth + name, round(offset * 1000, 1), round(duration * 1000, 1), bar))
+        st.dataframe(pd.DataFrame(rows, columns=["Fase", "Inicio (ms)", "Duración (ms)", "Cascada"]),
+                     use_container_width=True, hide_index=True)
+        if run.trace:
+            st.code(run.trace, language="text")
@@ -0,0 +1,361 @@
+import numpy as np
+import streamlit as st
+from psycopg2 import sql
+from scipy import sparse
+
+from listening_analytics import DEFAULT_SESSION_GAP, iter_sessions
+
+# Límite de canciones por sesión/playlist: acota el número de pares (n^2) de cestas anómalas
+MAX_BASKET_SONGS = 200
+# Cestas procesadas por lote al acumular la matriz de co-ocurrencia
+BASKETS_PER_BATCH = 20000
+# Filas por sentencia al guardar resultados
+INSERT_BATCH_ROWS = 50000
+# Límite de cada lectura completa de la construcción (ordena todo reproduccion): más que el interactivo
+BUILD_TIMEOUT_MS = 1800000
+# Espacio de los advisory locks por canción que serializan la actualización de sus vecinos
+NEIGHBORS_LOCK_SPACE = 41
+
+SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS cancion_coocurrencia (
+        id_cancion_a INT NOT NULL,
+        id_cancion_b INT NOT NULL,
+        conteo INT NOT NULL,
+        PRIMARY KEY (id_cancion_a, id_cancion_b)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS cancion_popularidad (
+        id_cancion INT PRIMARY KEY,
+        conteo INT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS cancion_vecino (
+        id_cancion INT NOT NULL,
+        posicion SMALLINT NOT NULL,
+        id_vecino INT NOT NULL,
+        puntuacion REAL NOT NULL,
+        PRIMARY KEY (id_cancion, posicion)
+    )
+    """,
+]
+
+class RecommendationEngine:
+    """
+    Clase para generar recomendaciones de canciones a partir de la co-ocurrencia en sesiones
+    de escucha (reproduccion) y en playlists (playlist_cancion).
+
+    La matriz canción-canción se construye en un proceso por lotes y se guardan los top-K
+    vecinos de cada canción (cancion_vecino), de modo que las consultas solo leen K filas
+    por índice. Las reproducciones nuevas actualizan la co-ocurrencia de forma incremental.
+    """
+    def __init__(self, db_manager, top_k=20, session_gap=DEFAULT_SESSION_GAP):
+        self.db_manager = db_manager
+        self.top_k = top_k
+        self.session_gap = session_gap
+        self._schema_ready = None
+
+    def ensure_schema(self):
+        """Crea las tablas del índice de recomendaciones si no existen."""
+        for statement in SCHEMA_STATEMENTS:
+            self.db_manager.execute_query(sql.SQL(statement))
+        self._schema_ready = True
+
+    def _is_ready(self):
+        """Indica (consultándolo una sola vez) si el índice ya fue creado."""
+        if self._schema_ready is None:
+            result = self.db_manager.execute_query(
+                sql.SQL("SELECT to_regclass('cancion_vecino') IS NOT NULL"), fetch_type='one'
+            )
+            self._schema_ready = bool(result and result[0])
+        return self._schema_ready
+
+    # --- Construcción por lotes ---
+
+    def _iter_session_baskets(self, max_id, stats):
+        """
+        Cestas de canciones por sesión de escucha, recorriendo reproduccion una sola vez.
+        Solo canciones con ID <= max_id (las que caben en la matriz); stats indica si la lectura falló.
+        """
+        query = sql.SQL("""
+            SELECT id_usuario, id_cancion, fecha_reproduccion
+            FROM reproduccion
+            WHERE id_cancion <= %s
+            ORDER BY id_usuario, fecha_reproduccion
+        """)
+
+        def plays():
+            for rows in self.db_manager.stream_query(query, (max_id,), route="replica", max_chunk_size=50000,
+                                                     timeout_ms=BUILD_TIMEOUT_MS, stats=stats):
+                yield from rows
+
+        for session in iter_sessions(plays(), self.session_gap):
+            basket = {row[1] for row in session[:MAX_BASKET_SONGS]}
+            if len(basket) > 1:
+                yield basket
+
+    def _iter_playlist_baskets(self, max_id, stats):
+        """Cestas de canciones por playlist (solo canciones con ID <= max_id)."""
+        query = sql.SQL("""
+            SELECT id_playlist, id_cancion FROM playlist_cancion WHERE id_cancion <= %s ORDER BY id_playlist
+        """)
+        current_playlist, basket = None, set()
+        for rows in self.db_manager.stream_query(query, (max_id,), route="replica", max_chunk_size=50000,
+                                                 timeout_ms=BUILD_TIMEOUT_MS, stats=stats):
+            for id_playlist, id_cancion in rows:
+                if id_playlist != current_playlist:
+                    if len(basket) > 1:
+                        yield basket
+                    basket = set()
+                    current_playlist = id_playlist
+                if len(basket) < MAX_BASKET_SONGS:
+                    basket.add(id_cancion)
+        if len(basket) > 1:
+            yield basket
+
+    def _accumulate(self, baskets, n_songs):
+        """
+        Acumula C = X^T X por lotes, donde X es la matriz dispersa cesta x canción (binaria).
+        Solo un lote de X está en memoria a la vez.
+        """
+        cooccurrence = sparse.csr_matrix((n_songs, n_songs), dtype=np.int32)
+        rows, cols = [], []
+        n_baskets = 0
+
+        def flush():
+            data = np.ones(len(cols), dtype=np.int32)
+            batch = sparse.csr_matrix((data, (rows, cols)), shape=(n_baskets, n_songs))
+            return (batch.T @ batch).tocsr()
+
+        for basket in baskets:
+            rows.extend([n_baskets] * len(basket))
+            cols.extend(basket)
+            n_baskets += 1
+            if n_baskets == BASKETS_PER_BATCH:
+                cooccurrence = cooccurrence + flush()
+                rows, cols, n_baskets = [], [], 0
+        if n_baskets:
+            cooccurrence = cooccurrence + flush()
+        return cooccurrence
+
+    def _top_k_neighbors(self, cooccurrence):
+        """
+        Similitud coseno C_ij / sqrt(C_ii * C_jj) y los top-K vecinos de cada canción.
+        :return: Arrays (id_cancion, posicion, id_vecino, puntuacion).
+        """
+        popularity = cooccurrence.diagonal().astype(np.float64)
+        inv_sqrt = np.zeros_like(popularity)
+        nonzero = popularity > 0
+        inv_sqrt[nonzero] = 1.0 / np.sqrt(popularity[nonzero])
+        scaling = sparse.diags(inv_sqrt)
+        similarity = (scaling @ cooccurrence.astype(np.float64) @ scaling).tocsr()
+        similarity.setdiag(0)
+        similarity.eliminate_zeros()
+
+        songs, positions, neighbors, scores = [], [], [], []
+        for song in np.flatnonzero(np.diff(similarity.indptr)):
+            start, end = similarity.indptr[song], similarity.indptr[song + 1]
+            row_scores = similarity.data[start:end]
+            row_neighbors = similarity.indices[start:end]
+            if len(row_scores) > self.top_k:
+                best = np.argpartition(-row_scores, self.top_k)[:self.top_k]
+                row_scores, row_neighbors = row_scores[best], row_neighbors[best]
+            order = np.argsort(-row_scores, kind="stable")
+            songs.append(np.full(len(order), song, dtype=np.int32))
+            positions.append(np.arange(1, len(order) + 1, dtype=np.int16))
+            neighbors.append(row_neighbors[order])
+            scores.append(row_scores[order].astype(np.float32))
+        if not songs:
+            empty = np.array([], dtype=np.int32)
+            return empty, empty.astype(np.int16), empty, empty.astype(np.float32)
+        return np.concatenate(songs), np.concatenate(positions), np.concatenate(neighbors), np.concatenate(scores)
+
+    def _insert_arrays(self, transaction, query, arrays):
+        """Inserta columnas de NumPy por lotes usando unnest() sobre arrays de PostgreSQL."""
+        total = len(arrays[0])
+        for start in range(0, total, INSERT_BATCH_ROWS):
+            params = tuple(column[start:start + INSERT_BATCH_ROWS].tolist() for column in arrays)
+            transaction.execute_query(query, params)
+
+    def build(self):
+        """
+        Reconstruye por completo la co-ocurrencia y el índice de vecinos. Si alguna lectura
+        falla o se cancela no se modifica el índice guardado.
+        :return: Número de canciones con vecinos, o None si falló.
+        """
+        self.ensure_schema()
+        max_id = self.db_manager.execute_query(
+            sql.SQL("SELECT COALESCE(MAX(id_cancion), 0) FROM cancion"), fetch_type='one', route="replica"
+        )
+        if max_id is None:
+            return None
+        # Los IDs de canción se usan directamente como índices de columna; las canciones creadas
+        # durante la construcción quedan fuera (las añaden record_play y la siguiente reconstrucción)
+        n_songs = max_id[0] + 1
+
+        session_stats, playlist_stats = {}, {}
+        cooccurrence = self._accumulate(self._iter_session_baskets(max_id[0], session_stats), n_songs)
+        if session_stats["failed"]:
+            st.error("No se pudieron leer las reproducciones; el índice de recomendaciones no se modificó.")
+            return None
+        cooccurrence = cooccurrence + self._accumulate(self._iter_playlist_baskets(max_id[0], playlist_stats), n_songs)
+        if playlist_stats["failed"]:
+            st.error("No se pudieron leer las playlists; el índice de recomendaciones no se modificó.")
+            return None
+        songs, positions, neighbors, scores = self._top_k_neighbors(cooccurrence)
+
+        pairs = sparse.triu(cooccurrence, k=1).tocoo()
+        popularity = cooccurrence.diagonal()
+        popular_songs = np.flatnonzero(popularity)
+        try:
+            with self.db_manager.transaction() as tx:
+                tx.execute_query(sql.SQL("TRUNCATE cancion_coocurrencia, cancion_popularidad, cancion_vecino"))
+                # La co-ocurrencia se guarda en ambos sentidos para leer la fila de una canción por índice
+                self._insert_arrays(tx, sql.SQL("""
+                    INSERT INTO cancion_coocurrencia (id_cancion_a, id_cancion_b, conteo)
+                    SELECT a, b, c FROM unnest(%s::int[], %s::int[], %s::int[]) AS t(a, b, c)
+                    UNION ALL
+                    SELECT b, a, c FROM unnest(%s::int[], %s::int[], %s::int[]) AS t(a, b, c)
+                """), (pairs.row, pairs.col, pairs.data, pairs.row, pairs.col, pairs.data))
+                self._insert_arrays(tx, sql.SQL("""
+                    INSERT INTO cancion_popularidad (id_cancion, conteo)
+                    SELECT * FROM unnest(%s::int[], %s::int[])
+                """), (popular_songs, popularity[popular_songs]))
+                self._insert_arrays(tx, sql.SQL("""
+                    INSERT INTO cancion_vecino (id_cancion, posicion, id_vecino, puntuacion)
+                    SELECT * FROM unnest(%s::int[], %s::smallint[], %s::int[], %s::real[])
+                """), (songs, positions, neighbors, scores))
+        except Exception as e:
+            st.error(f"No se pudo guardar el índice de recomendaciones: {e}")
+            return None
+        return len(np.unique(songs))
+
+    # --- Actualización incremental ---
+
+    def record_play(self, play):
+        """
+        Actualiza la co-ocurrencia con una reproducción nueva sin reconstruir el índice:
+        la canción se empareja con las de la sesión en curso del usuario y se recalculan
+        los vecinos solo de las canciones afectadas. Como en build(), una sesión solo cuenta
+        para la popularidad cuando tiene al menos dos canciones. La reconstrucción periódica
+        con build() corrige la deriva de las puntuaciones de canciones no afectadas.
+        :param play: Diccionario con id_reproduccion, id_usuario, id_cancion y fecha_reproduccion.
+        """
+        id_cancion, fecha = play.get("id_cancion"), play.get("fecha_reproduccion")
+        if id_cancion is None or fecha is None or play.get("id_usuario") is None or not self._is_ready():
+            return
+
+        # Reproducciones anteriores del usuario, de la más reciente a la más antigua
+        previous = self.db_manager.execute_query(sql.SQL("""
+            SELECT id_cancion, fecha_reproduccion
+            FROM reproduccion
+            WHERE id_usuario = %s AND id_reproduccion <> %s AND fecha_reproduccion <= %s
+            ORDER BY fecha_reproduccion DESC
+            LIMIT %s
+        """), (play["id_usuario"], play.get("id_reproduccion") or 0, fecha, MAX_BASKET_SONGS), fetch_type='all') or []
+
+        session, last_played = set(), fecha
+        for previous_song, played_at in previous:
+            if last_played - played_at > self.session_gap:
+                break
+            session.add(previous_song)
+            last_played = played_at
+        if id_cancion in session:
+            return # La canción ya contaba en esta sesión: la cesta no cambia
+        if not session:
+            return # Cesta de una sola canción: build() tampoco la cuenta
+        partners = sorted(session)
+        # Con la segunda canción la sesión empieza a contar también para la primera
+        counted = [id_cancion] + partners if len(partners) == 1 else [id_cancion]
+
+        with self.db_manager.transaction() as tx:
+            tx.execute_query(sql.SQL("""
+                INSERT INTO cancion_popularidad (id_cancion, conteo)
+                SELECT s, 1 FROM unnest(%s::int[]) AS s
+                ON CONFLICT (id_cancion) DO UPDATE SET conteo = cancion_popularidad.conteo + 1
+            """), (counted,))
+            tx.execute_query(sql.SQL("""
+                INSERT INTO cancion_coocurrencia (id_cancion_a, id_cancion_b, conteo)
+                SELECT %s, b, 1 FROM unnest(%s::int[]) AS b
+                UNION ALL
+                SELECT b, %s, 1 FROM unnest(%s::int[]) AS b
+                ON CONFLICT (id_cancion_a, id_cancion_b)
+                DO UPDATE SET conteo = cancion_coocurrencia.conteo + 1
+            """), (id_cancion, partners, id_cancion, partners))
+            self._refresh_neighbors(tx, [id_cancion] + partners)
+
+    def _refresh_neighbors(self, transaction, song_ids):
+        """
+        Recalcula los top-K vecinos de las canciones indicadas desde la co-ocurrencia guardada.
+        Un advisory lock por canción (tomados en orden, hasta el fin de la transacción) evita que
+        dos reproducciones simultáneas hagan DELETE+INSERT de la misma canción a la vez.
+        """
+        transaction.execute_query(sql.SQL("""
+            SELECT pg_advisory_xact_lock(%s, s)
+            FROM (SELECT DISTINCT s FROM unnest(%s::int[]) AS s ORDER BY s) AS ordenadas
+        """), (NEIGHBORS_LOCK_SPACE, song_ids), fetch_type='all')
+        transaction.execute_query(sql.SQL("DELETE FROM cancion_vecino WHERE id_cancion = ANY(%s)"), (song_ids,))
+        transaction.execute_query(sql.SQL("""
+            INSERT INTO cancion_vecino (id_cancion, posicion, id_vecino, puntuacion)
+            SELECT id_cancion_a, posicion, id_cancion_b, puntuacion
+            FROM (
+                SELECT co.id_cancion_a, co.id_cancion_b,
+                       co.conteo / sqrt(pa.conteo::float8 * pb.conteo) AS puntuacion,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY co.id_cancion_a
+                           ORDER BY co.conteo / sqrt(pa.conteo::float8 * pb.conteo) DESC
+                       ) AS posicion
+                FROM cancion_coocurrencia co
+                JOIN cancion_popularidad pa ON pa.id_cancion = co.id_cancion_a
+                JOIN cancion_popularidad pb ON pb.id_cancion = co.id_cancion_b
+                WHERE co.id_cancion_a = ANY(%s)
+            ) ranking
+            WHERE posicion <= %s
+        """), (song_ids, self.top_k))
+
+    # --- Consultas ---
+
+    def similar_songs(self, id_cancion, limit=10):
+        """
+        Canciones similares a partir del índice precalculado (lectura de K filas por clave primaria).
+        :return: Lista de tuplas (id_cancion, titulo_cancion, puntuacion).
+        """
+        if not self._is_ready():
+            return []
+        return self.db_manager.execute_query(sql.SQL("""
+            SELECT v.id_vecino, c.titulo_cancion, v.puntuacion
+            FROM cancion_vecino v
+            JOIN cancion c ON c.id_cancion = v.id_vecino
+            WHERE v.id_cancion = %s
+            ORDER BY v.posicion
+            LIMIT %s
+        """), (id_cancion, limit), fetch_type='all', route="replica") or []
+
+    def recommend_for_user(self, id_usuario, limit=10, recent_plays=20):
+        """
+        Recomendaciones para un usuario: suma las puntuaciones de los vecinos de sus últimas
+        reproducciones, excluyendo lo que ya escuchó en ellas. El coste está acotado por
+        recent_plays * top_k filas, sin importar el tamaño del historial.
+        :return: Lista de tuplas (id_cancion, titulo_cancion, puntuacion).
+        """
+        if not self._is_ready():
+            return []
+        return self.db_manager.execute_query(sql.SQL("""
+            WITH recientes AS (
+                SELECT id_cancion
+                FROM reproduccion
+                WHERE id_usuario = %s
+                ORDER BY fecha_reproduccion DESC
+                LIMIT %s
+            )
+            SELECT v.id_vecino, c.titulo_cancion, SUM(v.puntuacion) AS puntuacion
+            FROM cancion_vecino v
+            JOIN cancion c ON c.id_cancion = v.id_vecino
+            WHERE v.id_cancion IN (SELECT id_cancion FROM recientes)
+              AND v.id_vecino NOT IN (SELECT id_cancion FROM recientes)
+            GROUP BY v.id_vecino, c.titulo_cancion
+            ORDER BY puntuacion DESC
+            LIMIT %s
+        """), (id_usuario, recent_plays, limit), fetch_type='all', route="replica") or []
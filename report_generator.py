@@ -1,51 +1,251 @@
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import psycopg2
 import streamlit as st
 import pandas as pd
 from psycopg2 import sql
 
+from listening_analytics import SESSIONS_TABLE
+
+# Los reportes agregan tablas completas: se les concede más tiempo que a las consultas interactivas
+REPORT_TIMEOUT_MS = 300000
+# Rangos por worker en la ejecución particionada: más rangos que workers equilibran la carga
+PARTITIONS_PER_WORKER = 4
+# Reportes completos que se conservan mientras el feed de cambios no notifique escrituras
+REPORT_CACHE_ENTRIES = 8
+# Límite superior de filas enviadas al navegador (cada fila viaja en el mensaje del dataframe)
+MAX_REPORT_ROWS = 200000
+# Filas hasta las que la tabla se vuelve a dibujar con cada bloque; después solo se actualiza
+# el contador y la tabla se dibuja una vez al final (reenviar todo en cada bloque es cuadrático)
+PROGRESSIVE_RENDER_ROWS = 20000
+
+MOST_PLAYED_BY_COUNTRY_QUERY = """
+SELECT
+    u.pais AS Pais_Usuario,
+    c.titulo_cancion AS Titulo_Cancion,
+    a.nombre_artista AS Nombre_Artista,
+    COUNT(r.id_reproduccion) AS Total_Reproducciones
+FROM
+    reproduccion r
+JOIN
+    usuario u ON r.id_usuario = u.id_usuario
+JOIN
+    cancion c ON r.id_cancion = c.id_cancion
+JOIN
+    artista a ON c.id_artista = a.id_artista
+GROUP BY
+    u.pais, c.titulo_cancion, a.nombre_artista
+ORDER BY
+    u.pais, Total_Reproducciones DESC
+"""
+
+# Agregado parcial sobre un rango de la columna de partición; los parciales se suman en Python
+MOST_PLAYED_BY_COUNTRY_PARTIAL_QUERY = """
+SELECT
+    u.pais, c.titulo_cancion, a.nombre_artista, COUNT(r.id_reproduccion)
+FROM
+    reproduccion r
+JOIN
+    usuario u ON r.id_usuario = u.id_usuario
+JOIN
+    cancion c ON r.id_cancion = c.id_cancion
+JOIN
+    artista a ON c.id_artista = a.id_artista
+WHERE
+    r.{column} >= %s AND r.{column} < %s
+GROUP BY
+    u.pais, c.titulo_cancion, a.nombre_artista
+"""
+
 class ReportGenerator:
     """
     Clase para generar diversos reportes a partir de los datos de la base de datos.
     """
-    def __init__(self, db_manager):
+    def __init__(self, db_manager, max_rows=50000, first_chunk_rows=500, play_statistics=None):
         self.db_manager = db_manager
+        self.play_statistics = play_statistics # Sketches aproximados (PlayStatistics), opcional
+        self.max_rows = max_rows # Límite de filas que se envían al navegador
+        self.first_chunk_rows = first_chunk_rows # Tamaño del primer bloque (tiempo hasta la primera fila)
+        self.change_feed = None # ChangeFeed opcional: permite reutilizar reportes sin cambios en la BD
+        self._report_cache = {} # {(consulta, parámetros, max_rows): (versión, resultado, stats)}
 
-    def _display_report(self, data, columns, title):
-        """Función auxiliar para mostrar un DataFrame de reporte."""
-        if data:
-            df = pd.DataFrame(data, columns=columns)
-            st.subheader(f"Resultados: {title}")
-            st.dataframe(df, use_container_width=True, hide_index=True)
+    def _display_report(self, query, columns, title, tables, params=None, max_rows=None):
+        """
+        Función auxiliar para mostrar un reporte por bloques: el primer bloque se muestra
+        en cuanto llega y los siguientes se van añadiendo hasta PROGRESSIVE_RENDER_ROWS filas;
+        el resto se acumula y se muestra una sola vez al terminar (hasta MAX_REPORT_ROWS filas).
+        :param tables: Tablas que lee la consulta; con el feed de cambios el resultado se
+                       reutiliza mientras no se notifiquen escrituras en ellas.
+        """
+        max_rows = min(max_rows or self.max_rows, MAX_REPORT_ROWS)
+        st.subheader(f"Resultados: {title}")
+        table_placeholder = st.empty()
+        status_placeholder = st.empty()
+        result = None
+        stats = {}
+        cache_key = (query, repr(params), max_rows)
+        version = self.change_feed.version(*tables) if self.change_feed is not None else None
+        cached = self._report_cache.get(cache_key) if version is not None else None
+        if cached is not None and cached[0] == version:
+            _, result, stats = cached # Ninguna escritura notificada desde que se calculó
+            table_placeholder.dataframe(result.to_dataframe(columns), use_container_width=True, hide_index=True)
         else:
+            # Tras un cambio notificado se lee del primario: lo leído de una réplica con retraso
+            # quedaría en caché con la versión nueva
+            route = "replica"
+            if version is not None and self.change_feed.recently_changed(
+                    *tables, within_s=getattr(self.db_manager, "max_replica_lag_s", 0)):
+                route = "primary"
+            # Los bloques se acumulan por columnas (texto con diccionario), sin conservar tuplas
+            for result in self.db_manager.stream_query(
+                sql.SQL(query), params,
+                chunk_size=self.first_chunk_rows,
+                max_rows=max_rows,
+                route=route,
+                timeout_ms=REPORT_TIMEOUT_MS,
+                stats=stats,
+                columnar=True
+            ):
+                if stats["rows"] <= PROGRESSIVE_RENDER_ROWS:
+                    table_placeholder.dataframe(result.to_dataframe(columns), use_container_width=True, hide_index=True)
+                status_placeholder.caption(f"Cargando... {stats['rows']} filas recibidas.")
+            if result is not None and stats["rows"] > PROGRESSIVE_RENDER_ROWS:
+                table_placeholder.dataframe(result.to_dataframe(columns), use_container_width=True, hide_index=True)
+            if version is not None and result is not None and not stats["failed"]:
+                if len(self._report_cache) >= REPORT_CACHE_ENTRIES:
+                    self._report_cache.pop(next(iter(self._report_cache)), None)
+                self._report_cache[cache_key] = (version, result, stats)
+
+        if result is None:
+            status_placeholder.empty()
+            st.info(f"No hay datos disponibles para el reporte: {title}.")
+        elif stats["truncated_rows"]:
+            status_placeholder.warning(
+                f"Se muestran las primeras {stats['rows']} filas; "
+                f"{stats['truncated_rows']} filas adicionales no se muestran (límite: {max_rows})."
+            )
+        else:
+            status_placeholder.caption(f"{stats['rows']} filas.")
+
+    def _display_rows(self, rows, columns, title, max_rows=None):
+        """Muestra un resultado ya calculado en memoria, respetando el límite de filas."""
+        max_rows = min(max_rows or self.max_rows, MAX_REPORT_ROWS)
+        st.subheader(f"Resultados: {title}")
+        if not rows:
             st.info(f"No hay datos disponibles para el reporte: {title}.")
+            return
+        st.dataframe(pd.DataFrame(rows[:max_rows], columns=columns), use_container_width=True, hide_index=True)
+        if len(rows) > max_rows:
+            st.warning(f"Se muestran las primeras {max_rows} filas; "
+                       f"{len(rows) - max_rows} filas adicionales no se muestran (límite: {max_rows}).")
+        else:
+            st.caption(f"{len(rows)} filas.")
 
-    def generate_most_played_by_country(self):
+    def _partition_ranges(self, column, partitions):
         """
-        Genera un reporte de las canciones más reproducidas agrupadas por el país del usuario.
+        Divide reproduccion en rangos [desde, hasta) de igual amplitud sobre column
+        (id_reproduccion o fecha_reproduccion). MIN/MAX se resuelven con el índice de la columna.
         """
-        query = """
-        SELECT
-            u.pais AS Pais_Usuario,
-            c.titulo_cancion AS Titulo_Cancion,
-            a.nombre_artista AS Nombre_Artista,
-            COUNT(r.id_reproduccion) AS Total_Reproducciones
-        FROM
-            reproduccion r
-        JOIN
-            usuario u ON r.id_usuario = u.id_usuario
-        JOIN
-            cancion c ON r.id_cancion = c.id_cancion
-        JOIN
-            artista a ON c.id_artista = a.id_artista
-        GROUP BY
-            u.pais, c.titulo_cancion, a.nombre_artista
-        ORDER BY
-            u.pais, Total_Reproducciones DESC;
+        bounds = self.db_manager.execute_query(
+            sql.SQL("SELECT MIN({column}), MAX({column}) FROM reproduccion").format(column=sql.Identifier(column)),
+            fetch_type='one', route="replica"
+        )
+        if not bounds or bounds[0] is None:
+            return []
+        low, high = bounds
+        if column == "fecha_reproduccion":
+            high = high + timedelta(microseconds=1) # Límite superior exclusivo
+            edges = [low + (high - low) * i / partitions for i in range(partitions)] + [high]
+        else:
+            high = high + 1
+            edges = [low + (high - low) * i // partitions for i in range(partitions)] + [high]
+        return [(start, end) for start, end in zip(edges, edges[1:]) if start < end]
+
+    def _run_partitioned(self, partial_query, ranges, workers):
+        """
+        Ejecuta partial_query sobre cada rango en paralelo, cada worker con su propia conexión,
+        y suma los conteos parciales por grupo (la última columna es el conteo).
+        Se usan hilos: psycopg2 libera el GIL mientras espera al servidor, que es donde se hace el trabajo.
+        """
+        def run(worker_ranges):
+            partial = Counter()
+            connection = self.db_manager.new_connection(route="replica")
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SET statement_timeout = %s", (REPORT_TIMEOUT_MS,))
+                    for start, end in worker_ranges:
+                        cursor.execute(partial_query, (start, end))
+                        for *group, count in cursor.fetchall():
+                            partial[tuple(group)] += count
+            finally:
+                connection.close()
+            return partial
+
+        assignments = [ranges[i::workers] for i in range(workers) if ranges[i::workers]]
+        merged = Counter()
+        with ThreadPoolExecutor(max_workers=len(assignments) or 1) as pool:
+            for partial in pool.map(run, assignments):
+                merged.update(partial)
+        return merged
+
+    def generate_most_played_by_country(self, max_rows=None, parallel_workers=None, partition_by="id_reproduccion"):
+        """
+        Genera un reporte de las canciones más reproducidas agrupadas por el país del usuario.
+        Con parallel_workers > 1 la agregación se divide en rangos de partition_by
+        (id_reproduccion o fecha_reproduccion) que se calculan en paralelo y se combinan en Python.
         """
-        data = self.db_manager.execute_query(sql.SQL(query), fetch_type='all')
         columns = ["Pais", "Titulo Cancion", "Artista", "Reproducciones"]
-        self._display_report(data, columns, "Canciones Más Reproducidas por País de Usuario")
+        title = "Canciones Más Reproducidas por País de Usuario"
+        if not parallel_workers or parallel_workers <= 1:
+            self._display_report(MOST_PLAYED_BY_COUNTRY_QUERY, columns, title,
+                                 ("reproduccion", "usuario", "cancion", "artista"), max_rows=max_rows)
+            return
+
+        partial_query = sql.SQL(MOST_PLAYED_BY_COUNTRY_PARTIAL_QUERY).format(column=sql.Identifier(partition_by))
+        try:
+            ranges = self._partition_ranges(partition_by, parallel_workers * PARTITIONS_PER_WORKER)
+            merged = self._run_partitioned(partial_query, ranges, parallel_workers)
+        except psycopg2.Error as e:
+            st.error(f"Error al ejecutar el reporte particionado: {e}")
+            return
+        # Mismo orden que la consulta original: país (NULL al final) y reproducciones descendente
+        rows = sorted(
+            (group + (count,) for group, count in merged.items()),
+            key=lambda row: (row[0] is None, row[0] or "", -row[3])
+        )
+        self._display_rows(rows, columns, title, max_rows=max_rows)
 
-    def generate_artist_counts(self):
+    def explain_parallelism(self, query=MOST_PLAYED_BY_COUNTRY_QUERY):
+        """
+        Revisa con EXPLAIN si PostgreSQL planifica la consulta con workers paralelos (nodos Gather).
+        :return: Diccionario con 'parallel', 'workers_planned' y 'max_parallel_workers_per_gather', o None.
+        """
+        result = self.db_manager.execute_query(
+            sql.SQL("EXPLAIN (FORMAT JSON) ") + sql.SQL(query), fetch_type='one', route="replica"
+        )
+        setting = self.db_manager.execute_query(
+            sql.SQL("SHOW max_parallel_workers_per_gather"), fetch_type='one', route="replica"
+        )
+        if not result:
+            return None
+        plan = json.loads(result[0]) if isinstance(result[0], str) else result[0]
+        workers_planned = 0
+        nodes = [plan[0]["Plan"]]
+        while nodes:
+            node = nodes.pop()
+            if node.get("Node Type") in ("Gather", "Gather Merge"):
+                workers_planned += node.get("Workers Planned", 0)
+            nodes.extend(node.get("Plans", []))
+        return {
+            "parallel": workers_planned > 0,
+            "workers_planned": workers_planned,
+            "max_parallel_workers_per_gather": setting[0] if setting else None
+        }
+
+    def generate_artist_counts(self, max_rows=None):
         """
         Genera un reporte que muestra el número total de álbumes y canciones
         por cada artista.
@@ -64,9 +264,67 @@ class ReportGenerator:
         GROUP BY
             ar.nombre_artista
         ORDER BY
-            Total_Albumes DESC, Total_Canciones DESC;
+            Total_Albumes DESC, Total_Canciones DESC
         """
-        data = self.db_manager.execute_query(sql.SQL(query), fetch_type='all')
         columns = ["Artista", "Total Albumes", "Total Canciones"]
-        self._display_report(data, columns, "Artistas con Más Álbumes y Canciones")
+        self._display_report(query, columns, "Artistas con Más Álbumes y Canciones",
+                             ("artista", "album", "cancion"), max_rows=max_rows)
 
+    def generate_daily_sessions(self, max_rows=None):
+        """
+        Genera un reporte de sesiones de escucha por día a partir de los agregados
+        precalculados en sesion_diaria (ver ListeningAnalytics.compute).
+        """
+        query = """
+        SELECT
+            fecha,
+            sesiones,
+            usuarios,
+            reproducciones,
+            ROUND(reproducciones::numeric / NULLIF(sesiones, 0), 2) AS canciones_por_sesion,
+            ROUND(duracion_total_seg::numeric / NULLIF(sesiones, 0) / 60, 1) AS minutos_por_sesion,
+            saltos,
+            cambios_dispositivo
+        FROM
+            sesion_diaria
+        ORDER BY
+            fecha DESC
+        """
+        columns = ["Fecha", "Sesiones", "Usuarios", "Reproducciones", "Canciones por Sesion",
+                   "Minutos por Sesion", "Saltos", "Cambios de Dispositivo"]
+        self._display_report(query, columns, "Sesiones de Escucha por Día", (SESSIONS_TABLE,), max_rows=max_rows)
+
+    def unique_listeners_approx(self, dimension, key, start_date, end_date):
+        """
+        Oyentes únicos aproximados de una canción (dimension="cancion") o de un país
+        (dimension="pais") en [start_date, end_date), sin COUNT(DISTINCT) sobre reproduccion.
+        :return: Estimación o None si las estadísticas aproximadas no están habilitadas.
+        """
+        if self.play_statistics is None:
+            return None
+        return self.play_statistics.unique_listeners(dimension, key, start_date, end_date)
+
+    def generate_top_songs_approx(self, start_date, end_date, n=20):
+        """
+        Muestra las canciones más reproducidas en [start_date, end_date) a partir de los sketches,
+        con sus oyentes únicos aproximados. Solo se consulta cancion para resolver los títulos.
+        """
+        if self.play_statistics is None:
+            st.info("Las estadísticas aproximadas no están habilitadas.")
+            return
+        top = self.play_statistics.top_songs(n, start_date, end_date)
+        if not top:
+            st.info("No hay reproducciones registradas en los sketches para ese periodo.")
+            return
+        titles = dict(self.db_manager.execute_query(
+            sql.SQL("SELECT id_cancion, titulo_cancion FROM cancion WHERE id_cancion = ANY(%s)"),
+            ([song for song, _, _ in top],), fetch_type='all', route="replica"
+        ) or [])
+        rows = [
+            (song, titles.get(song), count, error,
+             self.play_statistics.unique_listeners("cancion", song, start_date, end_date))
+            for song, count, error in top
+        ]
+        columns = ["Id Cancion", "Titulo Cancion", "Reproducciones (aprox.)", "Error Maximo", "Oyentes Unicos (aprox.)"]
+        st.subheader("Resultados: Canciones Más Escuchadas (aproximado)")
+        st.dataframe(pd.DataFrame(rows, columns=columns), use_container_width=True, hide_index=True)
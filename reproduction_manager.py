@@ -1,3 +1,4 @@
+import streamlit as st
 from base_manager import BaseManager
 
 class ReproductionManager(BaseManager):
@@ -13,5 +14,33 @@ class ReproductionManager(BaseManager):
             "dispositivo": "TEXT",
             "ubicacion": "TEXT"
         }
-        super().__init__(db_manager, "reproduccion", columns, "id_reproduccion")
+        relations = {
+            "id_usuario": ("usuario", "nombre", "nombre_usuario"),
+            "id_cancion": ("cancion", "titulo_cancion", "titulo_cancion")
+        }
+        super().__init__(db_manager, "reproduccion", columns, "id_reproduccion", relations=relations)
+        self.play_listeners = [] # Funciones notificadas con cada reproducción nueva
+
+    def add_play_listener(self, listener):
+        """
+        Registra una función que recibirá cada reproducción creada como diccionario
+        (id_reproduccion, id_usuario, id_cancion, fecha_reproduccion, dispositivo, ubicacion).
+        Dentro de una transacción se llama después del COMMIT; si se revierte, no se llama.
+        """
+        self.play_listeners.append(listener)
+
+    def _after_create(self, record_id, record, transaction):
+        """Notifica la nueva reproducción a los listeners registrados (tras el COMMIT si hay transacción)."""
+        play = dict(record, id_reproduccion=record_id)
+        if transaction is not None:
+            transaction.on_commit(lambda: self._notify_play(play))
+        else:
+            self._notify_play(play)
 
+    def _notify_play(self, play):
+        """Entrega la reproducción a cada listener; el fallo de uno no afecta a los demás."""
+        for listener in self.play_listeners:
+            try:
+                listener(play)
+            except Exception as e: # Un listener defectuoso no debe impedir registrar la reproducción
+                st.warning(f"No se pudo procesar la reproducción {play['id_reproduccion']} en {getattr(listener, '__qualname__', listener)}: {e}")
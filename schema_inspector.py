@@ -0,0 +1,151 @@
+from psycopg2 import sql
+
+# Correspondencia entre tipos de PostgreSQL y los tipos que usan los managers
+PG_TYPE_MAP = {
+    "smallint": "INT",
+    "integer": "INT",
+    "bigint": "INT",
+    "boolean": "BOOLEAN",
+    "date": "DATE",
+    "time without time zone": "TIME",
+    "time with time zone": "TIME",
+    "timestamp without time zone": "TIMESTAMP",
+    "timestamp with time zone": "TIMESTAMP",
+    "numeric": "NUMERIC",
+    "real": "NUMERIC",
+    "double precision": "NUMERIC",
+}
+
+class SchemaInspector:
+    """
+    Clase para leer una sola vez los metadatos del esquema (columnas, claves primarias
+    y foráneas, índices y tamaño estimado de cada tabla) desde information_schema/pg_catalog.
+    """
+    def __init__(self, db_manager, schema="public"):
+        self.db_manager = db_manager
+        self.schema = schema
+        self.tables = {} # {tabla: metadatos}
+        self.loaded = False
+
+    def load(self):
+        """
+        Carga los metadatos de todas las tablas del esquema.
+        :return: True si la carga fue exitosa.
+        """
+        columns = self.db_manager.execute_query(sql.SQL("""
+            SELECT table_name, column_name, data_type, column_default, is_identity
+            FROM information_schema.columns
+            WHERE table_schema = %s
+            ORDER BY table_name, ordinal_position
+        """), (self.schema,), fetch_type='all')
+        if columns is None:
+            return False
+
+        primary_keys = self.db_manager.execute_query(sql.SQL("""
+            SELECT tc.table_name, kcu.column_name
+            FROM information_schema.table_constraints tc
+            JOIN information_schema.key_column_usage kcu
+              ON kcu.constraint_name = tc.constraint_name
+             AND kcu.table_schema = tc.table_schema
+             AND kcu.table_name = tc.table_name
+            WHERE tc.table_schema = %s AND tc.constraint_type = 'PRIMARY KEY'
+            ORDER BY tc.table_name, kcu.ordinal_position
+        """), (self.schema,), fetch_type='all') or []
+
+        foreign_keys = self.db_manager.execute_query(sql.SQL("""
+            SELECT cl.relname, a.attname, rcl.relname, ra.attname
+            FROM pg_constraint con
+            JOIN pg_class cl ON cl.oid = con.conrelid
+            JOIN pg_namespace n ON n.oid = cl.relnamespace
+            JOIN pg_class rcl ON rcl.oid = con.confrelid
+            JOIN LATERAL unnest(con.conkey, con.confkey) AS k(attnum, refattnum) ON TRUE
+            JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+            JOIN pg_attribute ra ON ra.attrelid = con.confrelid AND ra.attnum = k.refattnum
+            WHERE con.contype = 'f' AND n.nspname = %s
+        """), (self.schema,), fetch_type='all') or []
+
+        indexes = self.db_manager.execute_query(sql.SQL("""
+            SELECT t.relname, i.relname, ix.indisunique, ix.indisprimary, am.amname,
+                   array_agg(a.attname::text ORDER BY k.ord), pg_get_indexdef(ix.indexrelid)
+            FROM pg_index ix
+            JOIN pg_class t ON t.oid = ix.indrelid
+            JOIN pg_class i ON i.oid = ix.indexrelid
+            JOIN pg_am am ON am.oid = i.relam
+            JOIN pg_namespace n ON n.oid = t.relnamespace
+            JOIN LATERAL unnest(ix.indkey) WITH ORDINALITY AS k(attnum, ord) ON TRUE
+            JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+            WHERE n.nspname = %s
+            GROUP BY t.relname, i.relname, ix.indisunique, ix.indisprimary, am.amname, ix.indexrelid
+        """), (self.schema,), fetch_type='all') or []
+
+        sizes = self.db_manager.execute_query(sql.SQL("""
+            SELECT c.relname, GREATEST(c.reltuples, 0)::bigint, pg_total_relation_size(c.oid)
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('r', 'p') AND n.nspname = %s
+        """), (self.schema,), fetch_type='all') or []
+
+        tables = {}
+        for table_name, column_name, data_type, column_default, is_identity in columns:
+            table = tables.setdefault(table_name, {
+                "columns": {}, "primary_key": [], "foreign_keys": {},
+                "indexes": [], "estimated_rows": 0, "total_bytes": 0
+            })
+            col_type = PG_TYPE_MAP.get(data_type, "TEXT")
+            generated = is_identity == "YES" or (column_default or "").startswith("nextval(")
+            if col_type == "INT" and generated:
+                col_type = "SERIAL"
+            table["columns"][column_name] = col_type
+        for table_name, column_name in primary_keys:
+            if table_name in tables:
+                tables[table_name]["primary_key"].append(column_name)
+        for table_name, column_name, ref_table, ref_column in foreign_keys:
+            if table_name in tables:
+                tables[table_name]["foreign_keys"][column_name] = (ref_table, ref_column)
+        for table_name, index_name, unique, primary, method, index_columns, definition in indexes:
+            if table_name in tables:
+                tables[table_name]["indexes"].append({
+                    "name": index_name,
+                    "columns": list(index_columns),
+                    "unique": unique,
+                    "primary": primary,
+                    "method": method,
+                    "definition": definition
+                })
+        for table_name, estimated_rows, total_bytes in sizes:
+            if table_name in tables:
+                tables[table_name]["estimated_rows"] = estimated_rows
+                tables[table_name]["total_bytes"] = total_bytes
+
+        self.tables = tables
+        self.loaded = True
+        return True
+
+    def table(self, table_name):
+        """Devuelve los metadatos de una tabla o None si no existe en el esquema."""
+        return self.tables.get(table_name)
+
+    def leading_index(self, table_name, column_name):
+        """
+        Devuelve el primer índice cuya columna inicial es column_name (o None).
+        Solo esos índices sirven para filtrar u ordenar por la columna.
+        """
+        table = self.table(table_name)
+        if not table:
+            return None
+        for index in table["indexes"]:
+            if index["columns"] and index["columns"][0] == column_name:
+                return index
+        return None
+
+    def estimated_rows(self, table_name):
+        """
+        Estimación actual de filas según pg_class.reltuples (sin recorrer la tabla).
+        """
+        result = self.db_manager.execute_query(sql.SQL("""
+            SELECT GREATEST(c.reltuples, 0)::bigint
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relname = %s
+        """), (self.schema, table_name), fetch_type='one', route="replica")
+        return result[0] if result else None
@@ -13,5 +13,9 @@ class SongManager(BaseManager):
             "id_artista": "INT",
             "id_album": "INT"
         }
-        super().__init__(db_manager, "cancion", columns, "id_cancion")
+        relations = {
+            "id_artista": ("artista", "nombre_artista", "nombre_artista"),
+            "id_album": ("album", "titulo_album", "titulo_album")
+        }
+        super().__init__(db_manager, "cancion", columns, "id_cancion", relations=relations)
 
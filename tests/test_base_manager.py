@@ -0,0 +1,68 @@
+import sqlite3
+from contextlib import nullcontext
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("psycopg2")
+pytest.importorskip("streamlit")
+
+from psycopg2 import sql
+
+from base_manager import BaseManager
+from columnar import ColumnarResult
+
+def _render(query):
+    """Convierte una consulta de psycopg2.sql a texto SQLite (sin conexión a PostgreSQL)."""
+    if isinstance(query, sql.Composed):
+        return "".join(_render(part) for part in query.seq)
+    if isinstance(query, sql.Identifier):
+        return ".".join(f'"{name}"' for name in query.strings)
+    if isinstance(query, sql.Placeholder):
+        return "?"
+    return query.string.replace("%s", "?")
+
+class _SQLiteDB:
+    """DBManager mínimo sobre SQLite en memoria: ejecuta las consultas que compone BaseManager."""
+    max_replica_lag_s = 0
+
+    def __init__(self, type_codes):
+        self.connection = sqlite3.connect(":memory:")
+        self.type_codes = type_codes # {columna: OID de PostgreSQL} para el resultado columnar
+        self.queries = []
+
+    def execute_query(self, query, params=None, fetch_type=None, **kwargs):
+        text = _render(query)
+        self.queries.append(text)
+        cursor = self.connection.execute(text, params or ())
+        if fetch_type == 'one':
+            return cursor.fetchone()
+        if fetch_type == 'columnar':
+            result = ColumnarResult([d[0] for d in cursor.description],
+                                    [self.type_codes.get(d[0]) for d in cursor.description])
+            result.append(cursor.fetchall())
+            return result
+        return cursor.fetchall()
+
+def _keyset_manager(rows=25):
+    db = _SQLiteDB({"id_usuario": 23, "nombre": 25})
+    db.connection.execute("CREATE TABLE usuario (id_usuario INTEGER PRIMARY KEY, nombre TEXT)")
+    db.connection.executemany("INSERT INTO usuario VALUES (?, ?)", [(i, f"u{i}") for i in range(1, rows + 1)])
+    manager = BaseManager(db, "usuario", {"id_usuario": "SERIAL", "nombre": "TEXT"}, "id_usuario")
+    manager.pagination_strategy = "keyset"
+    return manager, db
+
+def _load(manager, pagination_info, page_change):
+    manager.load_data_logic(nullcontext(), pagination_info, nullcontext(), page_change=page_change)
+    return pagination_info["first_key"], pagination_info["last_key"]
+
+def test_keyset_pagination_forward_and_back():
+    manager, db = _keyset_manager()
+    pagination_info = {"offset": 0, "limit": 10, "current_page": 1, "total_records": 0}
+    assert _load(manager, pagination_info, 0) == (1, 10)
+    assert _load(manager, pagination_info, 1) == (11, 20)
+    assert '"t"."id_usuario" > ?' in db.queries[-1]
+    assert _load(manager, pagination_info, 1) == (21, 25)
+    assert _load(manager, pagination_info, -1) == (11, 20)
+    assert '"t"."id_usuario" < ?' in db.queries[-1]
+    assert pagination_info["total_records"] == 25
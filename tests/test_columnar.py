@@ -0,0 +1,16 @@
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+
+from columnar import ColumnarResult
+
+def test_numeric_keeps_decimal_precision():
+    result = ColumnarResult(["importe", "ratio"], [1700, 701])
+    result.append([(Decimal("12345678901234567.89"), 0.5), (None, None)])
+    assert result.value("importe", 0) == Decimal("12345678901234567.89")
+    assert result.value("importe", 1) is None
+    assert result.value("ratio", 0) == 0.5
+    assert result.value("ratio", 1) is None
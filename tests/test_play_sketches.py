@@ -0,0 +1,133 @@
+import random
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("psycopg2")
+
+from play_sketches import CountMinSketch, HyperLogLog, PlayStatistics, SpaceSaving
+
+# --- HyperLogLog ---
+
+def test_hll_stays_sparse_for_few_values():
+    sketch = HyperLogLog(p=10)
+    for value in range(5):
+        sketch.add(value)
+    assert sketch.registers is None
+    assert sketch.count() == 5
+
+def test_hll_densifies_and_estimates_large_cardinality():
+    sketch = HyperLogLog(p=10)
+    for value in range(20000):
+        sketch.add(value)
+    assert sketch.registers is not None
+    assert abs(sketch.count() - 20000) / 20000 < 0.1
+
+def test_hll_merge_sparse_and_dense_matches_single_sketch():
+    combined, small, large = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for value in range(3):
+        small.add(f"u{value}")
+        combined.add(f"u{value}")
+    for value in range(5000):
+        large.add(value)
+        combined.add(value)
+    assert small.registers is None and large.registers is not None
+    assert HyperLogLog().merge(small).merge(large).count() == combined.count()
+    assert small.merge(large).count() == combined.count()
+
+# --- Count-Min ---
+
+def test_count_min_never_underestimates():
+    rng = random.Random(1)
+    sketch = CountMinSketch(width=64, depth=3)
+    truth = Counter(rng.randrange(500) for _ in range(5000))
+    for key, count in truth.items():
+        sketch.add(key, count)
+    assert all(sketch.estimate(key) >= count for key, count in truth.items())
+
+# --- Space-Saving ---
+
+def _check_bounds(summary, truth):
+    for key, count, error in summary.top(summary.k):
+        assert count >= truth[key] # Nunca subestima
+        assert count - error <= truth[key] # El error acota la sobreestimación
+
+def test_space_saving_bounds_and_heavy_hitter():
+    rng = random.Random(2)
+    stream = [0] * 2000 + [rng.randrange(1, 1000) for _ in range(3000)]
+    rng.shuffle(stream)
+    summary = SpaceSaving(k=20)
+    for key in stream:
+        summary.add(key)
+    assert summary.top(1)[0][0] == 0
+    _check_bounds(summary, Counter(stream))
+
+def test_space_saving_merge_credits_other_minimum_for_absent_keys():
+    rng = random.Random(3)
+    first_stream = [rng.randrange(200) for _ in range(3000)]
+    second_stream = [rng.randrange(100, 300) for _ in range(3000)]
+    first, second = SpaceSaving(k=15), SpaceSaving(k=15)
+    for key in first_stream:
+        first.add(key)
+    for key in second_stream:
+        second.add(key)
+    merged = SpaceSaving(k=15).merge(first).merge(second)
+    _check_bounds(merged, Counter(first_stream) + Counter(second_stream))
+
+def test_space_saving_merge_of_unfilled_summaries_is_exact():
+    first, second = SpaceSaving(k=10), SpaceSaving(k=10)
+    first.add("a", 3)
+    second.add("b", 2)
+    second.add("a", 1)
+    assert first.merge(second).top(2) == [("a", 4, 0), ("b", 2, 0)]
+
+# --- PlayStatistics ---
+
+class _FakeDB:
+    """Entrega las filas indicadas por stream_query; con fail=True la lectura se corta a la mitad."""
+    def __init__(self, rows, fail=False):
+        self.rows = rows
+        self.fail = fail
+        self.streams = 0
+
+    def execute_query(self, query, params=None, **kwargs):
+        return ("ES",) # País de cualquier usuario
+
+    def stream_query(self, query, params=None, stats=None, **kwargs):
+        self.streams += 1
+        stats.update({"rows": 0, "truncated_rows": 0, "failed": False})
+        start, end = params
+        rows = [row for row in self.rows if start <= row[2] < end]
+        if self.fail:
+            rows = rows[:len(rows) // 2]
+            stats["failed"] = True
+        if rows:
+            stats["rows"] = len(rows)
+            yield rows
+
+def _plays(day, count):
+    played_at = datetime.combine(day, datetime.min.time())
+    return [(user, 7, played_at + timedelta(minutes=user), "ES") for user in range(count)]
+
+def test_failed_warm_up_keeps_existing_sketches():
+    today = date.today()
+    statistics = PlayStatistics(_FakeDB(_plays(today, 10)))
+    assert statistics.warm_up(today, today + timedelta(days=1)) == 10
+    statistics.db_manager = _FakeDB(_plays(today, 40), fail=True)
+    assert statistics.warm_up(today, today + timedelta(days=1)) is None
+    assert statistics.unique_listeners("cancion", 7, today, today + timedelta(days=1)) == 10
+
+def test_ensure_window_loads_only_missing_days():
+    today = date.today()
+    yesterday = today - timedelta(days=1)
+    db = _FakeDB(_plays(yesterday, 3) + _plays(today, 5))
+    statistics = PlayStatistics(db)
+    statistics.record_play({"id_usuario": 99, "id_cancion": 7, "fecha_reproduccion": datetime.now()})
+    assert statistics.missing_days(yesterday, today + timedelta(days=1)) == [yesterday, today]
+    assert statistics.ensure_window(yesterday, today + timedelta(days=1))
+    assert statistics.covered_window() == (yesterday, today)
+    assert statistics.unique_listeners("cancion", 7, yesterday, today + timedelta(days=1)) == 5
+    assert statistics.ensure_window(yesterday, today + timedelta(days=1))
+    assert db.streams == 1
@@ -0,0 +1,54 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("scipy")
+pytest.importorskip("psycopg2")
+pytest.importorskip("streamlit")
+
+from recommendation_engine import RecommendationEngine
+
+class _FakeDB:
+    """Devuelve las reproducciones anteriores indicadas y registra las escrituras de la transacción."""
+    def __init__(self, previous):
+        self.previous = previous
+        self.writes = []
+
+    def execute_query(self, query, params=None, fetch_type=None, **kwargs):
+        if "to_regclass" in query.string:
+            return (True,) # El índice de recomendaciones existe
+        if "SELECT id_cancion, fecha_reproduccion" in query.string:
+            return self.previous
+        self.writes.append((query.string, params))
+        return []
+
+    @contextmanager
+    def transaction(self):
+        yield self
+
+    def popularity_updates(self):
+        return [params[0] for query, params in self.writes if "cancion_popularidad (id_cancion" in query]
+
+def _play(song, at):
+    return {"id_reproduccion": 100, "id_usuario": 1, "id_cancion": song, "fecha_reproduccion": at}
+
+def test_singleton_session_does_not_count_towards_popularity():
+    now = datetime(2026, 1, 1, 12)
+    db = _FakeDB([])
+    RecommendationEngine(db).record_play(_play(7, now))
+    assert db.writes == []
+
+def test_second_song_credits_both_songs_of_the_session():
+    now = datetime(2026, 1, 1, 12)
+    db = _FakeDB([(3, now - timedelta(minutes=3))])
+    RecommendationEngine(db).record_play(_play(7, now))
+    assert db.popularity_updates() == [[7, 3]]
+
+def test_later_songs_credit_only_the_new_song():
+    now = datetime(2026, 1, 1, 12)
+    db = _FakeDB([(3, now - timedelta(minutes=3)), (5, now - timedelta(minutes=6))])
+    RecommendationEngine(db).record_play(_play(7, now))
+    assert db.popularity_updates() == [[7]]
+    assert any("pg_advisory_xact_lock" in query for query, _ in db.writes)